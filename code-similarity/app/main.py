@@ -4,6 +4,7 @@ import json
 from datetime import datetime
 import operator
 import logging
+import asyncio
 
 # LangChain and LangGraph imports
 from langchain_core.messages import HumanMessage, AIMessage
@@ -17,6 +18,12 @@ from langgraph.graph import END, StateGraph
 # Prisma integration
 from prisma import Prisma
 
+# Local similarity scoring
+from similarity import score_code_similarity, parse_similarity_score
+from reference_solutions import ReferenceSolutionStore
+from plagiarism import (PlagiarismIndex, PlagiarismReport, content_hash, DEFAULT_TOP_K, MIN_PLAGIARISM_SCORE,
+                        SIGNATURE_VERSION)
+
 # Environment variables
 import dotenv
 dotenv.load_dotenv()
@@ -71,6 +78,9 @@ class PipelineState(TypedDict):
 # Create a Prisma client as a global singleton
 prisma_client = Prisma()
 
+# Reference solutions are generated once per question, language and model
+reference_store = ReferenceSolutionStore(prisma_client)
+
 async def connect_to_database() -> str:
     """Connect to the Neon PostgreSQL database via Prisma."""
     logger.info("Attempting to connect to database...")
@@ -103,25 +113,6 @@ async def get_question_from_db(question_id: int) -> QuestionType:
         "constraints": question.constraints or ""
     }
 
-async def store_llm_solution(solution: LLMSolutionType) -> str:
-    """Store an LLM-generated solution in the database."""
-    await prisma_client.llmsolution.create(
-        data={
-            "questionId": solution["question_id"],
-            "llmName": solution["llm_name"],
-            "solution": solution["solution"],
-            "timestamp": datetime.now(),
-            "metrics": json.dumps({}),  # Convert empty dict to JSON string for Prisma
-            "question": {
-                "connect": {
-                    "id": solution["question_id"]
-                }
-            }
-        }
-    )
-    
-    return f"Solution for {solution['llm_name']} stored successfully"
-
 async def store_comparison_result(result: ComparisonResultType) -> str:
     """Store a comparison result in the database."""
     await prisma_client.comparison.create(
@@ -141,9 +132,74 @@ async def store_comparison_result(result: ComparisonResultType) -> str:
     
     return f"Comparison result for candidate {result['candidate_id']} stored successfully"
 
+async def get_candidate_submissions(question_id: int) -> Dict[str, str]:
+    """Retrieve the latest submission of every candidate for a question."""
+    comparisons = await prisma_client.comparison.find_many(
+        where={"questionId": question_id},
+        order={"timestamp": "asc"}
+    )
+    return {comparison.candidateId: comparison.candidateSolution for comparison in comparisons}
+
+async def load_submission_fingerprints(question_id: int) -> Dict[str, Dict[str, Any]]:
+    """Retrieve the stored MinHash signatures of a question's submissions by candidate."""
+    rows = await prisma_client.submissionfingerprint.find_many(
+        where={"questionId": question_id}
+    )
+    return {
+        row.candidateId: {"content_hash": row.contentHash, "signature": row.signature,
+                          "signature_version": row.signatureVersion}
+        for row in rows
+    }
+
+async def store_submission_fingerprints(question_id: int, fingerprints: Dict[str, Dict[str, Any]]) -> str:
+    """Store MinHash signatures, replacing those of candidates who resubmitted."""
+    if not fingerprints:
+        return "No submission fingerprints to store"
+
+    await prisma_client.submissionfingerprint.delete_many(
+        where={"questionId": question_id, "candidateId": {"in": list(fingerprints)}}
+    )
+    await prisma_client.submissionfingerprint.create_many(
+        data=[
+            {
+                "questionId": question_id,
+                "candidateId": candidate_id,
+                "contentHash": entry["content_hash"],
+                "signature": json.dumps(entry["signature"]),  # Convert list to JSON string for Prisma
+                "signatureVersion": SIGNATURE_VERSION,
+                "timestamp": datetime.now()
+            }
+            for candidate_id, entry in fingerprints.items()
+        ]
+    )
+
+    return f"Stored {len(fingerprints)} submission fingerprints for question {question_id}"
+
 
 # --------------------- LLM CODE GENERATION --------------------- #
 
+# Limits on LLM calls made by the pipeline
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", 4))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 60))
+
+_llm_semaphores: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+
+def _llm_semaphore() -> asyncio.Semaphore:
+    """Semaphore limiting concurrent LLM calls on the running event loop."""
+    loop = asyncio.get_running_loop()
+    if loop not in _llm_semaphores:
+        # Drop semaphores of event loops that have been closed, e.g. by earlier asyncio.run calls
+        for closed in [other for other in _llm_semaphores if other.is_closed()]:
+            del _llm_semaphores[closed]
+        _llm_semaphores[loop] = asyncio.Semaphore(LLM_CONCURRENCY)
+    return _llm_semaphores[loop]
+
+async def ainvoke_llm(runnable, inputs, timeout: float = None):
+    """Invoke an LLM runnable without blocking the event loop, within the concurrency and time limits."""
+    async with _llm_semaphore():
+        return await asyncio.wait_for(runnable.ainvoke(inputs), timeout or LLM_TIMEOUT_SECONDS)
+
+
 def create_llm_toolkit():
     """Create LLM instances for code generation."""
     llms = {
@@ -161,7 +217,9 @@ def create_llm_toolkit():
     return llms
 
 
-# Define the system prompt for code generation
+# Define the system prompt for code generation; bump the id whenever the prompt changes
+# so stored reference solutions written for the old prompt are not served
+CODE_GEN_PROMPT_ID = "code-gen-v1"
 code_gen_prompt = ChatPromptTemplate.from_messages([
     ("system", "You are a skilled programmer taking a coding test. Please solve the following programming problem. Write only the code as your answer, without explanations or additional text."),
     ("human", """
@@ -180,35 +238,38 @@ async def generate_solution(llm, state, llm_name):
     logger.info(f"Generating solution using {llm_name}...")
     question = state["question"]
     
-    try:
+    async def generate():
         chain = code_gen_prompt | llm
         logger.debug(f"Invoking {llm_name} with question: {question['text'][:100]}...")
-        response = chain.invoke({
+        response = await ainvoke_llm(chain, {
             "question_text": question["text"],
             "constraints": question.get("constraints", ""),
             "language": question.get("language", "Python")
         })
-        
-        solution = response.content
-        logger.info(f"Successfully generated solution with {llm_name}")
+        return response.content
+    
+    try:
+        # Reuse the stored reference solution; the LLM is only called the first time
+        solution = await reference_store.get_or_generate(
+            question["text"],
+            question.get("constraints", ""),
+            question.get("language", "Python"),
+            getattr(llm, "model_name", llm_name),  # The toolkit name is only a label, key on the real model
+            CODE_GEN_PROMPT_ID,
+            generate,
+            question_id=question["id"],
+            legacy_name=llm_name  # Rows stored before solutions were keyed by model and prompt
+        )
+        logger.info(f"Got solution from {llm_name}")
         logger.debug(f"Solution length: {len(solution)} characters")
         
-        # Store in database
-        logger.debug(f"Storing {llm_name} solution in database...")
-        await store_llm_solution({
-            "question_id": question["id"],
-            "llm_name": llm_name,
-            "solution": solution,
-            "timestamp": datetime.now().isoformat()
-        })
-        
         # Return only the new solution
         return {
             "llm_solutions": {llm_name: solution},
             "error": ""  # Return empty error string to maintain state
         }
     except Exception as e:
-        error_msg = f"Error generating solution with {llm_name}: {str(e)}\n"
+        error_msg = f"Error generating solution with {llm_name}: {str(e) or type(e).__name__}\n"
         logger.error(error_msg, exc_info=True)
         return {
             "error": error_msg,
@@ -216,54 +277,88 @@ async def generate_solution(llm, state, llm_name):
         }
 
 
+async def invalidate_reference_solutions(question_id: int, llm_name: str = None) -> int:
+    """Discard a question's stored reference solutions so they are generated again on next use."""
+    question = await get_question_from_db(question_id)
+    # Solutions are stored under the model behind the toolkit name, not the name itself
+    llm = create_llm_toolkit().get(llm_name) if llm_name else None
+    return await reference_store.invalidate(
+        question["text"],
+        question["constraints"],
+        language=question["language"],
+        model=llm.model_name if llm else llm_name,
+        question_id=question_id,
+        legacy_name=llm_name
+    )
+
+
 # --------------------- CODE COMPARISON --------------------- #
 
-def calculate_code_similarity(code1: str, code2: str) -> float:
+# LLM used only to settle borderline local similarity scores
+similarity_judge_llm = ChatOpenAI(
+    model="gpt-4-turbo",
+    temperature=0.2,
+    openai_api_key=os.getenv("OPENAI_API_KEY")
+)
 
-    # Simple character-based Jaccard similarity
-        """
-        Calculate similarity between two code snippets using an LLM.
-        """
-        llm = ChatOpenAI(
-            model="gpt-4-turbo",
-            temperature=0.2,
-            openai_api_key=os.getenv("OPENAI_API_KEY")
-        )
+similarity_judge_prompt = """
+You are a code similarity evaluator. Given two code snippets, evaluate their similarity on a scale of 0 to 10, considering logic, structure, and standard coding practices.
 
-        prompt = f"""
-        You are a code similarity evaluator. Given two code snippets, evaluate their similarity on a scale of 0 to 10, considering logic, structure, and standard coding practices.
+Code Snippet 1:
+{code1}
 
-        Code Snippet 1:
-        {code1}
+Code Snippet 2:
+{code2}
 
-        Code Snippet 2:
-        {code2}
+Reply with the score line only, in the format 'Similarity Score: X/10'.
+"""
 
-        Provide a similarity score between 0 and 10:
-        """
 
-        response = llm(prompt)
-        score = float(response.content.strip())
-        return score
+async def calculate_code_similarity(code1: str, code2: str, language: str = "Python") -> float:
+    """
+    Calculate similarity between two code snippets on a 0-10 scale.
+
+    The local engine scores every pair; the LLM is only asked when the local
+    score falls in the borderline band, and its answer is used if it parses.
+    """
+    result = score_code_similarity(code1, code2, language)
+    logger.debug(f"Local similarity {result['score']} ({result['components']})")
+    if not result["borderline"]:
+        return result["score"]
+
+    try:
+        response = await ainvoke_llm(similarity_judge_llm, similarity_judge_prompt.format(code1=code1, code2=code2))
+        llm_score = parse_similarity_score(response.content)
+    except Exception as e:
+        logger.warning(f"LLM similarity check failed, keeping local score: {str(e) or type(e).__name__}")
+        return result["score"]
+
+    if llm_score is None:
+        logger.warning(f"Could not parse LLM similarity score from: {response.content[:100]}")
+        return result["score"]
+    return llm_score
 
 
 async def compare_solutions(state):
     """Compare candidate solution with all LLM solutions."""
     logger.info("Starting solution comparison...")
-    similarity_scores = {}
     
     candidate_solution = state["candidate_solution"]
     logger.debug(f"Comparing against candidate solution (length: {len(candidate_solution)})")
     
-    for llm_name, llm_solution in state["llm_solutions"].items():
-        logger.debug(f"Calculating similarity score for {llm_name}...")
-        similarity_scores[llm_name] = calculate_code_similarity(
+    # Score against all references at once; only borderline pairs wait on the LLM
+    llm_names = list(state["llm_solutions"])
+    scores = await asyncio.gather(*(
+        calculate_code_similarity(
             candidate_solution, 
-            llm_solution
+            state["llm_solutions"][llm_name],
+            state["question"].get("language", "Python")
         )
-        logger.info(f"Similarity score for {llm_name}: {similarity_scores[llm_name]:.4f}")
-    
-    state["similarity_scores"] = similarity_scores
+        for llm_name in llm_names
+    ))
+    similarity_scores = dict(zip(llm_names, scores))
+    for llm_name, score in similarity_scores.items():
+        logger.info(f"Similarity score for {llm_name}: {score:.4f}")
     
     # Store comparison results
     logger.debug("Storing comparison results in database...")
@@ -276,16 +371,13 @@ async def compare_solutions(state):
     })
     
     logger.info("Comparison completed successfully")
-    return state
+    return {"similarity_scores": similarity_scores, "status": "completed"}
 
 
 # --------------------- LANGGRAPH WORKFLOW --------------------- #
 
 async def initialize_state(question_id, candidate_id, candidate_solution):
     """Initialize the state for the pipeline."""
-    # Connect to the database
-    await connect_to_database()
-    
     # Get the question
     question = await get_question_from_db(question_id)
     
@@ -300,17 +392,19 @@ async def initialize_state(question_id, candidate_id, candidate_solution):
     }
 
 
-def build_code_comparison_graph():
+def build_code_comparison_graph(llm_toolkit: Dict[str, Any] = None):
     """Build the LangGraph workflow for code comparison."""
     logger.info("Building code comparison graph...")
     
-    llm_toolkit = create_llm_toolkit()
-    logger.debug(f"Created LLM toolkit with models: {list(llm_toolkit.keys())}")
+    if llm_toolkit is None:
+        llm_toolkit = create_llm_toolkit()
+    logger.debug(f"Using LLM toolkit with models: {list(llm_toolkit.keys())}")
     
     workflow = StateGraph(PipelineState)
     
-    # Add nodes with logging wrappers
-    workflow.add_node("start", lambda x: x)
+    # Add nodes with logging wrappers; nodes return only the keys they change,
+    # so the merged llm_solutions and error fields are not duplicated
+    workflow.add_node("start", lambda state: {})
     logger.debug("Added start node")
     
     for llm_name, llm in llm_toolkit.items():
@@ -325,38 +419,135 @@ def build_code_comparison_graph():
     
     async def compare_wrapper(state):
         logger.info("Executing comparison node...")
-        if len(state["llm_solutions"]) == len(create_llm_toolkit()):
+        if len(state["llm_solutions"]) == len(llm_toolkit):
             logger.info("All solutions ready, proceeding with comparison")
             return await compare_solutions(state)
         logger.info("Waiting for more solutions before comparison")
-        return state
+        return {}
     
     workflow.add_node("compare_solutions", compare_wrapper)
     logger.debug("Added comparison node")
     
-    async def disconnect_wrapper(state):
-        logger.info("Executing disconnect node...")
-        await disconnect_from_database()
-        logger.info("Completed disconnect node")
-        return state
-    
-    workflow.add_node("disconnect", disconnect_wrapper)
-    logger.debug("Added disconnect node")
-    
     # Add edges with logging
     for llm_name in llm_toolkit.keys():
         workflow.add_edge("start", f"generate_{llm_name}")
         workflow.add_edge(f"generate_{llm_name}", "compare_solutions")
         logger.debug(f"Added edges for {llm_name}")
     
-    workflow.add_edge("compare_solutions", "disconnect")
-    workflow.add_edge("disconnect", END)
+    workflow.add_edge("compare_solutions", END)
     workflow.set_entry_point("start")
     
     logger.info("Graph building completed")
     return workflow.compile()
 
 
+# --------------------- COMPARISON SERVICE --------------------- #
+
+class CodeComparisonService:
+    """
+    Long-lived code comparison pipeline shared by all requests.
+
+    Holds the compiled graph, the LLM clients and one database connection (the
+    Prisma query engine pools connections underneath it). Graph runs keep all
+    their data in their own state, so any number of comparisons can run
+    concurrently on one service. The connection is opened on first use and only
+    closed by close(), never by an individual run.
+    """
+    
+    def __init__(self, db: Prisma = None, llm_toolkit: Dict[str, Any] = None):
+        self.db = db or prisma_client
+        self.llm_toolkit = llm_toolkit or create_llm_toolkit()
+        self.graph = build_code_comparison_graph(self.llm_toolkit)
+        self._connect_locks: Dict[asyncio.AbstractEventLoop, asyncio.Lock] = {}
+        logger.info("Code comparison service ready")
+    
+    async def start(self) -> None:
+        """Connect to the database unless already connected."""
+        if self.db.is_connected():
+            return
+        async with self._connect_lock():
+            if not self.db.is_connected():
+                await connect_to_database()
+    
+    def _connect_lock(self) -> asyncio.Lock:
+        """Lock serializing connection attempts on the running event loop.
+        
+        A lock is bound to the loop it is first used on, and the service may outlive
+        that loop (e.g. across asyncio.run calls), so each loop gets its own.
+        """
+        loop = asyncio.get_running_loop()
+        if loop not in self._connect_locks:
+            for closed in [other for other in self._connect_locks if other.is_closed()]:
+                del self._connect_locks[closed]
+            self._connect_locks[loop] = asyncio.Lock()
+        return self._connect_locks[loop]
+    
+    async def close(self) -> None:
+        """Disconnect from the database once no more comparisons will run."""
+        if self.db.is_connected():
+            await disconnect_from_database()
+    
+    async def compare(self, question_id: int, candidate_id: str, candidate_solution: str):
+        """Compare one candidate solution with the reference solutions and return the final state."""
+        logger.info(f"Starting pipeline for question {question_id}, candidate {candidate_id}")
+        await self.start()
+        
+        logger.info("Initializing pipeline state...")
+        initial_state = await initialize_state(
+            question_id=question_id,
+            candidate_id=candidate_id,
+            candidate_solution=candidate_solution
+        )
+        
+        logger.info("Executing graph...")
+        result = await self.graph.ainvoke(initial_state)
+        logger.info("Pipeline execution completed")
+        return result
+    
+    async def check_plagiarism(
+        self,
+        question_id: int,
+        top_k: int = DEFAULT_TOP_K,
+        min_score: float = MIN_PLAGIARISM_SCORE
+    ) -> PlagiarismReport:
+        """Compare all candidates' submissions for a question with each other."""
+        logger.info(f"Starting plagiarism check for question {question_id}")
+        await self.start()
+        
+        question = await get_question_from_db(question_id)
+        submissions = await get_candidate_submissions(question_id)
+        stored = await load_submission_fingerprints(question_id)
+
+        index = PlagiarismIndex(language=question["language"])
+        changed = {}
+        for candidate_id, code in submissions.items():
+            code_hash = content_hash(code)
+            entry = stored.get(candidate_id)
+            # Signatures of changed code, or computed by another MinHash scheme, are recomputed
+            reusable = entry and entry["content_hash"] == code_hash and entry["signature_version"] == SIGNATURE_VERSION
+            signature = entry["signature"] if reusable else None
+            signature_used = index.add(candidate_id, code, signature)
+            if signature is None:
+                changed[candidate_id] = {"content_hash": code_hash, "signature": signature_used}
+
+        logger.info(f"Indexed {len(submissions)} submissions, {len(changed)} newly fingerprinted")
+        await store_submission_fingerprints(question_id, changed)
+
+        report = index.report(top_k=top_k, min_score=min_score)
+        logger.info(f"Scored {report['compared_pairs']} candidate pairs, found {len(report['clusters'])} clusters")
+        return report
+
+
+_comparison_service: CodeComparisonService = None
+
+def get_comparison_service() -> CodeComparisonService:
+    """Return the process-wide comparison service, creating it on first use."""
+    global _comparison_service
+    if _comparison_service is None:
+        _comparison_service = CodeComparisonService()
+    return _comparison_service
+
+
 # --------------------- MAIN EXECUTION --------------------- #
 
 async def run_code_comparison_pipeline(
@@ -375,29 +566,34 @@ async def run_code_comparison_pipeline(
     Returns:
         Final state with comparison results
     """
-    logger.info(f"Starting pipeline for question {question_id}, candidate {candidate_id}")
-    
-    graph = build_code_comparison_graph()
-    logger.info("Graph compiled successfully")
-    
-    logger.info("Initializing pipeline state...")
-    initial_state = await initialize_state(
-        question_id=question_id,
-        candidate_id=candidate_id,
-        candidate_solution=candidate_solution
-    )
-    
-    logger.info("Executing graph...")
-    result = await graph.ainvoke(initial_state)
-    logger.info("Pipeline execution completed")
-    
-    return result
+    return await get_comparison_service().compare(question_id, candidate_id, candidate_solution)
+
+
+async def run_plagiarism_check(
+    question_id: int,
+    top_k: int = DEFAULT_TOP_K,
+    min_score: float = MIN_PLAGIARISM_SCORE
+) -> PlagiarismReport:
+    """
+    Compare all candidates' submissions for a question with each other.
+
+    Submissions are fingerprinted once and indexed with MinHash/LSH, so only
+    likely matches are scored. Signatures are persisted next to the comparisons
+    and reused until the candidate submits different code.
+
+    Args:
+        question_id: ID of the programming question
+        top_k: Number of most similar candidate pairs to return
+        min_score: Minimum similarity score (0-10) for a pair to be reported
+
+    Returns:
+        The top-k most similar pairs and the clusters of candidates they connect
+    """
+    return await get_comparison_service().check_plagiarism(question_id, top_k, min_score)
 
 
 # Example usage
 if __name__ == "__main__":
-    import asyncio
-    
     async def main():
         # Example candidate solution
         candidate_solution = """
@@ -419,5 +615,7 @@ if __name__ == "__main__":
         
         print("Pipeline completed")
         print("Similarity scores:", final_state["similarity_scores"])
+        
+        await get_comparison_service().close()
     
     asyncio.run(main())
\ No newline at end of file
@@ -1,13 +1,24 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware  # Add this import
 from pydantic import BaseModel
-from typing import Dict, Optional
+from typing import Dict, List, Optional
+from contextlib import asynccontextmanager
 from datetime import datetime
 import os
+import json
+import time
+import uuid
+import asyncio
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 import logging
 from dotenv import load_dotenv
+from prisma import Prisma
+
+from similarity import score_code_similarity, parse_similarity_score
+from reference_solutions import ReferenceSolutionStore
+from plagiarism import PlagiarismIndex, content_hash, DEFAULT_TOP_K, MIN_PLAGIARISM_SCORE
 
 load_dotenv()
 
@@ -22,7 +33,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# Reference solutions are shared across requests; they are also kept in the
+# LLMSolution table when a database is configured
+db = Prisma() if os.getenv("DATABASE_URL") else None
+reference_store = ReferenceSolutionStore(db)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Hold the database connection for as long as the app serves requests."""
+    if db is not None:
+        await db.connect()
+        logger.info("Connected to database for reference solutions")
+    try:
+        yield
+    finally:
+        if db is not None and db.is_connected():
+            await db.disconnect()
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -45,15 +73,72 @@ class CodeComparisonResponse(BaseModel):
     similarity_score: float
     llm_solution: str
 
+class ReferenceInvalidationRequest(BaseModel):
+    question_text: str
+    language: Optional[str] = None
+    constraints: Optional[str] = None
+
+class CandidateSubmission(BaseModel):
+    candidate_id: str
+    code: str
+
+class QuestionSubmissions(BaseModel):
+    question_text: str
+    submissions: List[CandidateSubmission]
+    question_id: Optional[int] = None  # Comparison rows are only stored for questions in the database
+    language: str = "Python"
+    constraints: Optional[str] = None
+
+class BatchComparisonRequest(BaseModel):
+    questions: List[QuestionSubmissions]  # One question, or every question of an exam
+
+class PlagiarismCheckRequest(BaseModel):
+    submissions: List[CandidateSubmission]
+    language: str = "Python"
+    top_k: int = DEFAULT_TOP_K
+    min_score: float = MIN_PLAGIARISM_SCORE
+
 
 # LLM setup
+LLM_MODEL = "gpt-4-turbo"
 llm = ChatOpenAI(
-    model="gpt-4-turbo",
+    model=LLM_MODEL,
     temperature=0.2,
+    timeout=float(os.getenv("LLM_TIMEOUT_SECONDS", 60)),  # A hung call must not hold a request slot forever
     openai_api_key=os.getenv("OPENAI_API_KEY")
 )
 
-# Prompts
+# Comparisons served at once; further requests get 429 instead of queueing on the worker
+MAX_IN_FLIGHT_COMPARISONS = int(os.getenv("MAX_IN_FLIGHT_COMPARISONS", 32))
+in_flight_comparisons = 0
+
+async def comparison_slot():
+    """Hold one of the in-flight comparison slots for the duration of a request."""
+    global in_flight_comparisons
+    # No await between the check and the increment, so the event loop cannot interleave them
+    if in_flight_comparisons >= MAX_IN_FLIGHT_COMPARISONS:
+        logger.warning(f"Rejecting comparison: {in_flight_comparisons} already in flight")
+        raise HTTPException(status_code=429, detail="Too many comparisons in progress, retry shortly",
+                            headers={"Retry-After": "1"})
+    in_flight_comparisons += 1
+    try:
+        yield
+    finally:
+        in_flight_comparisons -= 1
+
+# Batch comparisons served at once; each can score thousands of submissions, so
+# they are admitted separately from single comparisons
+MAX_IN_FLIGHT_BATCHES = int(os.getenv("MAX_IN_FLIGHT_BATCHES", 2))
+in_flight_batches = 0
+
+# Batch comparison tuning
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", 50))  # Unique submissions scored per worker thread call
+BATCH_WRITE_SIZE = int(os.getenv("BATCH_WRITE_SIZE", 500))  # Comparison rows per bulk insert
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", 4))  # Concurrent borderline LLM checks
+
+# Prompts; bump SOLUTION_PROMPT_ID whenever solution_prompt changes so stored
+# reference solutions written for the old prompt are not served
+SOLUTION_PROMPT_ID = "solution-v1"
 solution_prompt = ChatPromptTemplate.from_messages([
     ("system", "You are a skilled programmer. Write a solution for the given problem. Provide only the code, no explanations."),
     ("human", """
@@ -86,6 +171,18 @@ comparison_prompt = ChatPromptTemplate.from_messages([
     """)
 ])
 
+def local_analysis(result: Dict) -> str:
+    """Describe a local similarity result for the report."""
+    components = result["components"]
+    return f"""Similarity Score: {result['score']}/10 (local)
+
+| Measure | Similarity |
+|---|---|
+| Winnowed fingerprints | {components['winnowing']:.2f} |
+| Structure | {components['structure']:.2f} |
+| Token n-grams | {components['ngram']:.2f} |
+"""
+
 def generate_report(
     question: str,
     candidate_code: str,
@@ -99,7 +196,8 @@ def generate_report(
     report_dir = "reports"
     os.makedirs(report_dir, exist_ok=True)
 
-    report_path = "./reports/comparison_report_{timestamp}.md"
+    # Concurrent requests can finish within the same second, so add a unique suffix
+    report_path = f"./reports/comparison_report_{timestamp}_{uuid.uuid4().hex[:8]}.md"
 
     report_content = f"""# Code Comparison Report
 
@@ -126,60 +224,51 @@ def generate_report(
 
     return report_path
 
-@app.post("/compare-code", response_model=CodeComparisonResponse)
+@app.post("/compare-code", response_model=CodeComparisonResponse, dependencies=[Depends(comparison_slot)])
 async def compare_code(request: CodeComparisonRequest):
+    # Everything slow is awaited, so other requests keep being served meanwhile
     try:
         logger.info("Received code comparison request")
 
-        # Generate reference solution using LLM
-        logger.info("Generating reference solution")
-        solution_chain = solution_prompt | llm
-        solution_response = solution_chain.invoke({
-            "question_text": request.question_text,
-            "language": request.language,
-            "constraints": request.constraints or "None"
-        })
-        llm_solution = solution_response.content
-
-        # Compare solutions
+        # Reuse the reference solution for this question, generating it on first use
+        llm_solution = await get_reference(request.question_text, request.language, request.constraints)
+
+        # Score locally, off the event loop since tokenizing and parsing large submissions
+        # is CPU-bound; only borderline scores get the detailed LLM comparison
         logger.info("Comparing solutions")
-        comparison_chain = comparison_prompt | llm
-        comparison_response = comparison_chain.invoke({
-            "language": request.language,
-            "candidate_code": request.candidate_code,
-            "reference_code": llm_solution
-        })
-
-        # Extract score
-        content = comparison_response.content
-        logger.debug(f"Comparison response: {content}")
-
-        # Try different patterns to extract the score
-        similarity_score = 0
-        try:
-            if "**" in content:
-                import re
-                score_match = re.search(r'\*\*(\d+)/10\*\*', content)
-                if score_match:
-                    similarity_score = float(score_match.group(1))
+        local_result = await asyncio.to_thread(
+            score_code_similarity, request.candidate_code, llm_solution, request.language
+        )
+        similarity_score = local_result["score"]
+        analysis = local_analysis(local_result)
+
+        if local_result["borderline"]:
+            logger.info(f"Local score {similarity_score} is borderline, asking the LLM")
+            comparison_chain = comparison_prompt | llm
+            comparison_response = await comparison_chain.ainvoke({
+                "language": request.language,
+                "candidate_code": request.candidate_code,
+                "reference_code": llm_solution
+            })
+
+            content = comparison_response.content
+            logger.debug(f"Comparison response: {content}")
+            llm_score = parse_similarity_score(content)
+            if llm_score is not None:
+                similarity_score = llm_score
             else:
-                analysis_lines = content.split("\n")
-                score_line = next(line for line in analysis_lines if "score" in line.lower())
-                score_match = re.search(r'(\d+)(?:/10)?', score_line)
-                if score_match:
-                    similarity_score = float(score_match.group(1))
-        except Exception as e:
-            logger.warning(f"Error extracting score, using default scoring method: {str(e)}")
-            similarity_score = 5
+                logger.warning("Could not extract a score from the LLM comparison, keeping the local score")
+            analysis = f"{content}\n\n{analysis}"
 
         # Generate and save report
         logger.info("Generating report")
-        report_path = generate_report(
+        report_path = await asyncio.to_thread(
+            generate_report,
             question=request.question_text,
             candidate_code=request.candidate_code,
             llm_solution=llm_solution,
             similarity_score=similarity_score,
-            analysis=comparison_response.content,
+            analysis=analysis,
             language=request.language
         )
 
@@ -196,9 +285,205 @@ async def compare_code(request: CodeComparisonRequest):
         logger.error(f"Error processing request: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+async def generate_reference(question_text: str, language: str, constraints: Optional[str]) -> str:
+    """Ask the LLM for a reference solution."""
+    logger.info("Generating reference solution")
+    solution_chain = solution_prompt | llm
+    solution_response = await solution_chain.ainvoke({
+        "question_text": question_text,
+        "language": language,
+        "constraints": constraints or "None"
+    })
+    return solution_response.content
+
+async def get_reference(question_text: str, language: str, constraints: Optional[str]) -> str:
+    """Return the stored reference solution for a question, generating it on first use."""
+    return await reference_store.get_or_generate(
+        question_text,
+        constraints,
+        language,
+        LLM_MODEL,
+        SOLUTION_PROMPT_ID,
+        lambda: generate_reference(question_text, language, constraints)
+    )
+
+async def judge_borderline(candidate_code: str, reference_code: str, language: str,
+                           semaphore: asyncio.Semaphore) -> Optional[float]:
+    """Ask the LLM to score a pair the local engine could not settle; None if it gives no usable score."""
+    async with semaphore:
+        try:
+            comparison_chain = comparison_prompt | llm
+            response = await comparison_chain.ainvoke({
+                "language": language,
+                "candidate_code": candidate_code,
+                "reference_code": reference_code
+            })
+        except Exception as e:
+            logger.warning(f"Borderline LLM check failed, keeping the local score: {str(e)}")
+            return None
+    return parse_similarity_score(response.content)
+
+async def store_comparisons(rows: List[Dict]) -> int:
+    """Insert Comparison rows in one statement; returns how many were stored."""
+    if not rows or db is None or not db.is_connected():
+        return 0
+    return await db.comparison.create_many(data=rows)
+
+async def store_batch_rows(rows: List[Dict], stats: Dict) -> None:
+    """Store a batch's Comparison rows, counting the ones that could not be stored as unsaved."""
+    try:
+        stored = await store_comparisons(rows)
     except Exception as e:
-        logger.error(f"Error processing request: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e))
+        # The results were already streamed; the summary reports that they were not saved
+        logger.error(f"Could not store {len(rows)} batch comparisons: {str(e)}", exc_info=True)
+        return
+    stats["stored"] += stored
+    stats["unsaved"] -= stored
+
+def ndjson(record: Dict) -> str:
+    return json.dumps(record) + "\n"
+
+async def compare_question_batch(question: QuestionSubmissions, reference: str, stats: Dict):
+    """Score all submissions of one question, yielding an NDJSON line per candidate.
+
+    Identical submissions are scored once. Local scoring runs in a worker thread a
+    chunk at a time so the event loop keeps serving other requests, and borderline
+    scores of a chunk are checked by the LLM concurrently.
+    """
+    groups: Dict[str, List[CandidateSubmission]] = {}
+    for submission in question.submissions:
+        groups.setdefault(content_hash(submission.code), []).append(submission)
+    stats["unique"] += len(groups)
+
+    semaphore = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+    rows = []
+    unique = list(groups.items())
+    for start in range(0, len(unique), BATCH_CHUNK_SIZE):
+        chunk = unique[start:start + BATCH_CHUNK_SIZE]
+        local_results = await asyncio.to_thread(
+            lambda: [score_code_similarity(members[0].code, reference, question.language) for _, members in chunk]
+        )
+
+        borderline = [i for i, result in enumerate(local_results) if result["borderline"]]
+        llm_scores = await asyncio.gather(*(
+            judge_borderline(chunk[i][1][0].code, reference, question.language, semaphore) for i in borderline
+        ))
+        stats["llm_checks"] += len(borderline)
+        scores = [result["score"] for result in local_results]
+        for i, llm_score in zip(borderline, llm_scores):
+            if llm_score is not None:
+                scores[i] = llm_score
+
+        for (code_hash, members), result, score in zip(chunk, local_results, scores):
+            for member in members:
+                yield ndjson({
+                    "type": "result",
+                    "question_id": question.question_id,
+                    "candidate_id": member.candidate_id,
+                    "similarity_score": score,
+                    "components": result["components"],
+                    "content_hash": code_hash,
+                    "duplicate_of": members[0].candidate_id if member is not members[0] else None
+                })
+                if question.question_id is not None:
+                    stats["unsaved"] += 1  # Until its bulk insert succeeds
+                    rows.append({
+                        "questionId": question.question_id,
+                        "candidateId": member.candidate_id,
+                        "candidateSolution": member.code,
+                        "similarityScores": json.dumps({LLM_MODEL: score}),  # Convert dict to JSON string
+                        "timestamp": datetime.now()
+                    })
+
+        if len(rows) >= BATCH_WRITE_SIZE:
+            await store_batch_rows(rows, stats)
+            rows = []
+
+    await store_batch_rows(rows, stats)
+
+async def compare_batch(request: BatchComparisonRequest, total: int):
+    """Compare every question of a batch, yielding its NDJSON lines."""
+    started = time.perf_counter()
+    stats = {"submissions": total, "unique": 0, "llm_checks": 0, "stored": 0, "unsaved": 0, "failed_questions": 0}
+
+    # Every question's reference is needed; fetch or generate them all at once
+    references = await asyncio.gather(*(
+        get_reference(question.question_text, question.language, question.constraints)
+        for question in request.questions
+    ), return_exceptions=True)
+
+    for index, (question, reference) in enumerate(zip(request.questions, references)):
+        try:
+            if isinstance(reference, BaseException):
+                raise reference
+            async for line in compare_question_batch(question, reference, stats):
+                yield line
+        except Exception as e:
+            # The response is already streaming, so report the failure in-band
+            logger.error(f"Batch comparison failed for question {index}: {str(e)}", exc_info=True)
+            stats["failed_questions"] += 1
+            yield ndjson({"type": "error", "question_index": index, "question_id": question.question_id,
+                          "error": str(e)})
+
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    logger.info(f"Batch comparison finished: {stats}")
+    yield ndjson({"type": "summary", **stats, "saved": stats["unsaved"] == 0})
+
+@app.post("/compare-code/batch")
+async def compare_code_batch(request: BatchComparisonRequest):
+    """Compare a batch of submissions with their questions' reference solutions, streaming NDJSON.
+
+    Each candidate gets a "result" line as soon as it is scored; a failed question
+    gets an "error" line; the last line is a "summary", whose "saved" is false when
+    some results of questions with a question_id were not stored.
+    """
+    global in_flight_batches
+    # Checked before streaming starts, so a rejected batch gets a plain 429
+    if in_flight_batches >= MAX_IN_FLIGHT_BATCHES:
+        logger.warning(f"Rejecting batch comparison: {in_flight_batches} already in flight")
+        raise HTTPException(status_code=429, detail="Too many batch comparisons in progress, retry later",
+                            headers={"Retry-After": "5"})
+    in_flight_batches += 1
+
+    total = sum(len(question.submissions) for question in request.questions)
+    logger.info(f"Received batch comparison for {total} submissions to {len(request.questions)} questions")
+
+    async def results():
+        global in_flight_batches
+        try:
+            async for line in compare_batch(request, total):
+                yield line
+        finally:
+            # The slot is held until the last line is sent, not just until the endpoint returns
+            in_flight_batches -= 1
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+@app.post("/reference-solutions/invalidate")
+async def invalidate_reference_solution(request: ReferenceInvalidationRequest):
+    """Discard the stored reference solution of a question so the next comparison generates a new one."""
+    invalidated = await reference_store.invalidate(
+        request.question_text,
+        request.constraints,
+        language=request.language
+    )
+    return {"invalidated": invalidated}
+
+@app.post("/plagiarism-check")
+def plagiarism_check(request: PlagiarismCheckRequest):
+    """Compare all submissions of one question with each other and return similar pairs and clusters."""
+    # A plain def so FastAPI runs this CPU-bound work in its thread pool
+    logger.info(f"Received plagiarism check for {len(request.submissions)} submissions")
+    index = PlagiarismIndex(language=request.language)
+    try:
+        for submission in request.submissions:
+            index.add(submission.candidate_id, submission.code)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    report = index.report(top_k=request.top_k, min_score=request.min_score)
+    logger.info(f"Scored {report['compared_pairs']} candidate pairs, found {len(report['clusters'])} clusters")
+    return report
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,172 @@
+"""Cross-candidate plagiarism detection.
+
+Compares every submission for a question with every other one without scoring
+all n^2 pairs. Each submission's winnowed fingerprint set (see similarity.py) is
+summarized as a MinHash signature; locality-sensitive hashing over bands of the
+signature proposes candidate pairs whose fingerprints are likely to overlap, and
+only those pairs are scored exactly. Pairs at or above the plagiarism threshold
+are grouped into clusters of candidates that share code.
+
+Signatures are plain lists of integers, so they can be persisted and reused
+for later batches instead of being recomputed.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple, TypedDict
+from collections import defaultdict
+import os
+import random
+import hashlib
+
+from similarity import fingerprint, compare_fingerprints, WINNOW_K, WINNOW_WINDOW
+
+
+# --------------------- CONFIGURATION --------------------- #
+
+NUM_PERM = int(os.getenv("PLAGIARISM_NUM_PERM", 128))  # MinHash values per signature
+# Bands of NUM_PERM // LSH_BANDS rows each; 32 bands of 4 rows catch pairs above a Jaccard of about 0.4
+LSH_BANDS = int(os.getenv("PLAGIARISM_LSH_BANDS", 32))
+MIN_PLAGIARISM_SCORE = float(os.getenv("PLAGIARISM_MIN_SCORE", 7.0))  # Pairs below are not reported
+# Candidate pairs whose signatures estimate a lower fingerprint Jaccard are not scored exactly;
+# pairs scoring MIN_PLAGIARISM_SCORE have a fingerprint Jaccard above 0.5, so this leaves room
+# for the estimate's error
+MIN_ESTIMATED_JACCARD = float(os.getenv("PLAGIARISM_MIN_JACCARD", 0.3))
+DEFAULT_TOP_K = 20
+
+MAX_HASH = (1 << 32) - 1
+HASH_PRIME = (1 << 61) - 1
+
+# One universal hash (a * x + b) mod p per MinHash value, standing in for an independent
+# random permutation. The seed is fixed so signatures stay comparable across processes
+# and persisted batches.
+_random = random.Random(20250316)
+HASH_FUNCTIONS = [(_random.randrange(1, HASH_PRIME), _random.randrange(HASH_PRIME)) for _ in range(NUM_PERM)]
+
+# Stored with persisted signatures; a signature of another version is recomputed
+SIGNATURE_VERSION = f"universal-v1/{NUM_PERM}/{WINNOW_K}-{WINNOW_WINDOW}"
+
+
+class SimilarPair(TypedDict):
+    candidates: Tuple[str, str]
+    score: float
+    components: Dict[str, float]
+
+
+class CandidateCluster(TypedDict):
+    candidates: List[str]
+    max_score: float
+
+
+class PlagiarismReport(TypedDict):
+    submissions: int
+    compared_pairs: int
+    pairs: List[SimilarPair]
+    clusters: List[CandidateCluster]
+
+
+def content_hash(code: str) -> str:
+    """Hash of a submission's code, ignoring surrounding whitespace."""
+    return hashlib.sha256(code.strip().encode("utf-8")).hexdigest()
+
+
+def estimated_jaccard(first: List[int], second: List[int]) -> float:
+    """Fraction of equal MinHash values, an estimate of the Jaccard similarity of the sets."""
+    return sum(a == b for a, b in zip(first, second)) / NUM_PERM
+
+
+def minhash_signature(hashes: Iterable[int]) -> List[int]:
+    """MinHash signature of a set of 32-bit hashes."""
+    hashes = list(hashes)
+    if not hashes:
+        return [MAX_HASH] * NUM_PERM
+    return [min((a * value + b) % HASH_PRIME for value in hashes) & MAX_HASH for a, b in HASH_FUNCTIONS]
+
+
+# --------------------- INDEX --------------------- #
+
+class PlagiarismIndex:
+    """MinHash/LSH index over the submissions of one question."""
+
+    def __init__(self, language: str = "Python", bands: int = LSH_BANDS):
+        if NUM_PERM % bands:
+            raise ValueError(f"{NUM_PERM} MinHash permutations cannot be split into {bands} bands")
+        self.language = language
+        self.bands = bands
+        self.rows = NUM_PERM // bands
+        self.code: Dict[str, str] = {}
+        self.signatures: Dict[str, List[int]] = {}
+        self.buckets: Dict[Tuple[int, Tuple[int, ...]], List[str]] = defaultdict(list)
+
+    def add(self, candidate_id: str, code: str, signature: Optional[List[int]] = None) -> List[int]:
+        """Index a submission, reusing a stored signature when given, and return its signature."""
+        if candidate_id in self.code:
+            raise ValueError(f"Candidate {candidate_id} is already indexed")
+        if signature is None or len(signature) != NUM_PERM:
+            signature = minhash_signature(fingerprint(code, self.language)["winnow"])
+
+        self.code[candidate_id] = code
+        self.signatures[candidate_id] = signature
+        if code.strip():
+            for band in range(self.bands):
+                key = tuple(signature[band * self.rows:(band + 1) * self.rows])
+                self.buckets[(band, key)].append(candidate_id)
+        return signature
+
+    def candidate_pairs(self) -> List[Tuple[str, str]]:
+        """Pairs of submissions that share at least one LSH bucket."""
+        pairs = set()
+        for members in self.buckets.values():
+            for i, first in enumerate(members):
+                for second in members[i + 1:]:
+                    pairs.add((first, second) if first < second else (second, first))
+        return sorted(pairs)
+
+    def score_pairs(self, min_score: float = MIN_PLAGIARISM_SCORE) -> Tuple[List[SimilarPair], int]:
+        """Score the candidate pairs exactly; return those at or above min_score and the number compared."""
+        candidates = [(first, second) for first, second in self.candidate_pairs()
+                      if estimated_jaccard(self.signatures[first], self.signatures[second]) >= MIN_ESTIMATED_JACCARD]
+        pairs = []
+        for first, second in candidates:
+            result = compare_fingerprints(fingerprint(self.code[first], self.language),
+                                          fingerprint(self.code[second], self.language))
+            if result["score"] >= min_score:
+                pairs.append({"candidates": (first, second), "score": result["score"],
+                              "components": result["components"]})
+        pairs.sort(key=lambda pair: (-pair["score"], pair["candidates"]))
+        return pairs, len(candidates)
+
+    def report(self, top_k: int = DEFAULT_TOP_K, min_score: float = MIN_PLAGIARISM_SCORE) -> PlagiarismReport:
+        """Top-k most similar pairs and the clusters of candidates they connect."""
+        pairs, compared = self.score_pairs(min_score)
+        return {
+            "submissions": len(self.code),
+            "compared_pairs": compared,
+            "pairs": pairs[:top_k],
+            "clusters": cluster_pairs(pairs)
+        }
+
+
+def cluster_pairs(pairs: List[SimilarPair]) -> List[CandidateCluster]:
+    """Group candidates connected by similar pairs, largest clusters first."""
+    parent: Dict[str, str] = {}
+
+    def find(candidate: str) -> str:
+        parent.setdefault(candidate, candidate)
+        while parent[candidate] != candidate:
+            parent[candidate] = parent[parent[candidate]]
+            candidate = parent[candidate]
+        return candidate
+
+    for pair in pairs:
+        first, second = pair["candidates"]
+        parent[find(first)] = find(second)
+
+    members: Dict[str, List[str]] = defaultdict(list)
+    max_scores: Dict[str, float] = defaultdict(float)
+    for candidate in parent:
+        members[find(candidate)].append(candidate)
+    for pair in pairs:
+        root = find(pair["candidates"][0])
+        max_scores[root] = max(max_scores[root], pair["score"])
+
+    clusters = [{"candidates": sorted(group), "max_score": max_scores[root]} for root, group in members.items()]
+    clusters.sort(key=lambda cluster: (-len(cluster["candidates"]), -cluster["max_score"]))
+    return clusters
@@ -0,0 +1,239 @@
+"""Reference solution store.
+
+LLM reference solutions depend only on the question, the language, the model
+that wrote them and the prompt it was given, so each is generated once and
+reused for every candidate. The
+store checks an in-process LRU first, then the LLMSolution table, and only then
+calls the LLM. Concurrent requests for the same missing solution share a single
+generation, which keeps running when any one of them is cancelled. Invalidated solutions stay in the table for history, but are no
+longer served.
+"""
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from collections import OrderedDict
+from datetime import datetime
+import os
+import json
+import asyncio
+import hashlib
+import logging
+
+from prisma import Prisma
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_CACHE_SIZE = int(os.getenv("REFERENCE_CACHE_SIZE", 1024))
+
+ReferenceKey = Tuple[str, str, str, str]
+
+
+def question_hash(question_text: str, constraints: Optional[str] = None) -> str:
+    """Hash identifying a question by its text and constraints, ignoring surrounding whitespace."""
+    content = f"{question_text.strip()}\n\n{(constraints or '').strip()}"
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class ReferenceSolutionStore:
+    """Reference solutions keyed by question hash, language, model and prompt."""
+
+    def __init__(self, db: Optional[Prisma] = None, max_entries: int = REFERENCE_CACHE_SIZE):
+        self.db = db
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[ReferenceKey, str]" = OrderedDict()
+        self._pending: Dict[ReferenceKey, asyncio.Future] = {}
+        self._epochs: Dict[ReferenceKey, int] = {}  # Bumped by invalidate while a load is pending
+        self.stats = {"memory_hits": 0, "db_hits": 0, "generated": 0}
+
+    @staticmethod
+    def key(question_text: str, constraints: Optional[str], language: str, model: str,
+            prompt: str) -> ReferenceKey:
+        return question_hash(question_text, constraints), language.strip().lower(), model, prompt
+
+    @staticmethod
+    def _llm_name(key: ReferenceKey) -> str:
+        """Value of the llmName column, which records both the model and the prompt."""
+        return f"{key[2]}/{key[3]}"
+
+    async def get_or_generate(
+        self,
+        question_text: str,
+        constraints: Optional[str],
+        language: str,
+        model: str,
+        prompt: str,
+        generate: Callable[[], Awaitable[str]],
+        question_id: Optional[int] = None,
+        legacy_name: Optional[str] = None
+    ) -> str:
+        """Return the stored reference solution, generating and storing it on first use.
+
+        `model` is the model actually called and `prompt` identifies the prompt it is given,
+        so changing either produces a new solution instead of serving the old one. Rows
+        written before solutions were keyed this way only have a question id and a plain
+        llmName; they are reused when `question_id` and `legacy_name` match.
+        """
+        key = self.key(question_text, constraints, language, model, prompt)
+        solution = self._remember(key)
+        if solution is not None:
+            self.stats["memory_hits"] += 1
+            return solution
+
+        # The load or generation runs as its own task that every request, the first
+        # included, only waits on; cancelling one request does not cancel it for the others
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load_or_generate(key, generate, question_id, legacy_name))
+            self._pending[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: ReferenceKey, task: asyncio.Future) -> None:
+        if self._pending.get(key) is task:
+            del self._pending[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved when every waiter was cancelled
+
+    async def _load_or_generate(self, key: ReferenceKey, generate: Callable[[], Awaitable[str]],
+                                question_id: Optional[int], legacy_name: Optional[str]) -> str:
+        # An invalidation while this runs bumps the epoch; the result is then still returned
+        # to the requests waiting for it, but not kept
+        epoch = self._epochs.get(key, 0)
+
+        solution = await self._load(key)
+        if solution is None and question_id is not None and legacy_name:
+            solution = await self._load_legacy(question_id, legacy_name)
+            if solution is not None and self._epochs.get(key, 0) == epoch:
+                # Copy it under the current key so later lookups find it directly
+                await self._save(key, solution, question_id)
+        if solution is not None:
+            self.stats["db_hits"] += 1
+            if self._epochs.get(key, 0) == epoch:
+                self._remember(key, solution)
+            return solution
+
+        logger.info(f"Generating reference solution with {self._llm_name(key)} for question {key[0][:12]}")
+        solution = await generate()
+        self.stats["generated"] += 1
+        if self._epochs.get(key, 0) != epoch:
+            logger.info(f"Reference solution for question {key[0][:12]} was invalidated while generating, not storing it")
+            return solution
+        # Failed or empty generations are not worth keeping
+        if solution.strip():
+            self._remember(key, solution)
+            await self._save(key, solution, question_id)
+        return solution
+
+    def _remember(self, key: ReferenceKey, solution: Optional[str] = None) -> Optional[str]:
+        """Look up a solution in memory, or store one, keeping the most recently used entries."""
+        if solution is None:
+            solution = self._memory.get(key)
+            if solution is not None:
+                self._memory.move_to_end(key)
+            return solution
+
+        self._memory[key] = solution
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+        return solution
+
+    async def _load(self, key: ReferenceKey) -> Optional[str]:
+        if self.db is None or not self.db.is_connected():
+            return None
+        question_hash, language = key[:2]
+        row = await self.db.llmsolution.find_first(
+            where={"questionHash": question_hash, "language": language, "llmName": self._llm_name(key),
+                   "invalidatedAt": None},
+            order={"timestamp": "desc"}
+        )
+        return row.solution if row else None
+
+    async def _load_legacy(self, question_id: int, legacy_name: str) -> Optional[str]:
+        """Latest solution stored for a question before solutions had a question hash."""
+        if self.db is None or not self.db.is_connected():
+            return None
+        row = await self.db.llmsolution.find_first(
+            where={"questionId": question_id, "llmName": legacy_name, "questionHash": None, "invalidatedAt": None},
+            order={"timestamp": "desc"}
+        )
+        if row and row.solution.strip():
+            logger.info(f"Reusing reference solution {row.id} stored for question {question_id} by {legacy_name}")
+            return row.solution
+        return None
+
+    async def _save(self, key: ReferenceKey, solution: str, question_id: Optional[int]) -> None:
+        if self.db is None or not self.db.is_connected():
+            return
+        question_hash, language = key[:2]
+        data = {
+            "questionHash": question_hash,
+            "language": language,
+            "llmName": self._llm_name(key),
+            "solution": solution,
+            "timestamp": datetime.now(),
+            "metrics": json.dumps({})  # Convert empty dict to JSON string for Prisma
+        }
+        if question_id is not None:
+            data["question"] = {"connect": {"id": question_id}}
+        try:
+            await self.db.llmsolution.create(data=data)
+        except Exception as e:
+            # The solution is still served from memory
+            logger.warning(f"Could not store reference solution: {str(e)}")
+
+    async def invalidate(
+        self,
+        question_text: str,
+        constraints: Optional[str] = None,
+        language: Optional[str] = None,
+        model: Optional[str] = None,
+        question_id: Optional[int] = None,
+        legacy_name: Optional[str] = None
+    ) -> int:
+        """Stop serving the stored solutions of a question, optionally only for one language or model.
+
+        Generations still running for the question are not stored when they finish. With
+        `question_id`, solutions stored for it before solutions had a question hash are
+        invalidated too, only those of `legacy_name` if given. Returns the number of distinct solutions
+        invalidated, each counted once whether it was in memory, in the database or both.
+        """
+        target_hash = question_hash(question_text, constraints)
+        language = language.strip().lower() if language else None
+
+        def matches(key: ReferenceKey) -> bool:
+            return key[0] == target_hash and language in (None, key[1]) and model in (None, key[2])
+
+        for key in [key for key in self._pending if matches(key)]:
+            self._epochs[key] = self._epochs.get(key, 0) + 1
+            # Later requests start a new load instead of waiting for the invalidated one
+            del self._pending[key]
+
+        invalidated = {key for key in self._memory if matches(key)}
+        for key in invalidated:
+            del self._memory[key]
+
+        if self.db is not None and self.db.is_connected():
+            where = {"questionHash": target_hash, "invalidatedAt": None}
+            if language:
+                where["language"] = language
+            if model:
+                where["llmName"] = {"startswith": f"{model}/"}
+            rows = await self.db.llmsolution.find_many(where=where)
+            for row in rows:
+                row_model, _, row_prompt = row.llmName.rpartition("/")
+                invalidated.add((row.questionHash, row.language, row_model, row_prompt))
+
+            if question_id is not None:
+                legacy_where = {"questionId": question_id, "questionHash": None, "invalidatedAt": None}
+                if legacy_name:
+                    legacy_where["llmName"] = legacy_name
+                legacy = await self.db.llmsolution.find_many(where=legacy_where)
+                invalidated.update(("legacy", question_id, row.llmName) for row in legacy)
+                if legacy:
+                    await self.db.llmsolution.update_many(where={"id": {"in": [row.id for row in legacy]}},
+                                                          data={"invalidatedAt": datetime.now()})
+            if rows:
+                await self.db.llmsolution.update_many(where={"id": {"in": [row.id for row in rows]}},
+                                                      data={"invalidatedAt": datetime.now()})
+
+        logger.info(f"Invalidated {len(invalidated)} reference solutions for question {target_hash[:12]}")
+        return len(invalidated)
@@ -0,0 +1,286 @@
+"""Local code similarity scoring.
+
+Scores two code snippets on the same 0-10 scale the LLM evaluator uses, without
+any network call. Markdown code fences around a snippet, as LLM replies often
+have, are removed first. Each snippet is then fingerprinted once:
+
+- tokens are normalized (identifiers, numbers and strings collapse to placeholders,
+  comments are dropped) so renaming variables does not hide copied code;
+- k-grams of normalized tokens are winnowed into a compact set of hashes;
+- normalized token n-grams give a Jaccard similarity of the surface form;
+- Python code is parsed into an AST whose node-type n-grams capture structure;
+  other languages, and any pair where one side does not parse, compare the
+  skeleton of keywords and brackets instead.
+
+The three similarities are blended into one score. Only scores
+inside the borderline band are worth a second opinion from the LLM.
+"""
+from typing import Dict, List, Optional, TypedDict
+from functools import lru_cache
+from collections import Counter
+import os
+import io
+import re
+import ast
+import zlib
+import keyword
+import tokenize
+
+
+# --------------------- CONFIGURATION --------------------- #
+
+WINNOW_K = 5  # Tokens per hashed k-gram
+WINNOW_WINDOW = 4  # k-grams per winnowing window
+TOKEN_NGRAM = 3  # Tokens per n-gram for the Jaccard similarity
+AST_NGRAM = 3  # Node types per n-gram for the structural similarity
+
+# Weights of the component similarities in the final score
+WEIGHTS = {"winnowing": 0.6, "structure": 0.3, "ngram": 0.1}
+
+# Any two snippets share some structure and common token n-grams, so unrelated code
+# blends to about SCORE_FLOOR; edited copies (renamed identifiers, added comments or
+# temporaries, reordered branches) blend to SCORE_CEILING or more. The score is linear
+# between the two, so unrelated code scores 0 and edited copies 10.
+SCORE_FLOOR = 0.15
+SCORE_CEILING = 0.65
+
+# Scores in this band are ambiguous enough to ask the LLM. It is kept narrow so that
+# only a small share of candidates needs an LLM call (see test_similarity.py)
+BORDERLINE_LOW = float(os.getenv("SIMILARITY_BORDERLINE_LOW", 4.5))
+BORDERLINE_HIGH = float(os.getenv("SIMILARITY_BORDERLINE_HIGH", 7.0))
+
+FINGERPRINT_CACHE_SIZE = int(os.getenv("SIMILARITY_FINGERPRINT_CACHE", 4096))
+
+# Keywords kept verbatim for languages other than Python
+KEYWORDS = frozenset("""
+    abstract and as assert async auto await bool boolean break byte case catch char class const constexpr continue
+    def default del delete do double elif else enum except explicit export extends extern false final finally float
+    fn for foreach from func function go goto if impl implements import in instanceof int interface is lambda let
+    long loop match mod module mut namespace new nil none not null or package pass private protected pub public
+    raise register return self short signed sizeof static struct super switch template this throw throws trait
+    true try type typedef typename union unsigned use using var virtual void volatile where while with yield
+""".split())
+
+BRACKETS = frozenset("(){}[]")
+
+TOKEN_PATTERN = re.compile(r"""
+    (?P<comment>//[^\n]*|/\*.*?\*/|\#[^\n]*)
+  | (?P<string>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|`(?:\\.|[^`\\])*`)
+  | (?P<number>\b\d[\w.]*)
+  | (?P<name>[A-Za-z_$][\w$]*)
+  | (?P<op>==|!=|<=|>=|&&|\|\||\+\+|--|->|=>|::|<<|>>|\*\*|//|[-+*/%=<>!&|^~?:;,.(){}\[\]@])
+""", re.VERBOSE | re.DOTALL)
+
+
+FENCE_PATTERN = re.compile(r"^[ \t]*```[^\n]*\n(.*?)^[ \t]*```", re.MULTILINE | re.DOTALL)
+
+
+class CodeFingerprint(TypedDict):
+    tokens: List[str]
+    winnow: frozenset
+    ngrams: frozenset
+    structure: Optional[Counter]  # AST n-grams, None when the code is not parsed
+    skeleton: Counter
+
+
+class SimilarityResult(TypedDict):
+    score: float
+    components: Dict[str, float]
+    borderline: bool
+
+
+# --------------------- NORMALIZATION --------------------- #
+
+def _is_python(language: str) -> bool:
+    return (language or "").strip().lower() in ("python", "python3", "py")
+
+
+def _python_tokens(code: str) -> Optional[List[str]]:
+    """Normalized tokens of Python code, or None if it does not tokenize."""
+    tokens = []
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(code).readline):
+            if token.type == tokenize.NAME:
+                tokens.append(token.string if keyword.iskeyword(token.string) else "ID")
+            elif token.type == tokenize.NUMBER:
+                tokens.append("NUM")
+            elif token.type == tokenize.STRING:
+                tokens.append("STR")
+            elif token.type == tokenize.OP:
+                tokens.append(token.string)
+            elif token.type == tokenize.INDENT:
+                tokens.append("INDENT")
+            elif token.type == tokenize.DEDENT:
+                tokens.append("DEDENT")
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return None
+    return tokens
+
+
+def _generic_tokens(code: str) -> List[str]:
+    """Normalized tokens of code in any C-like or scripting language."""
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(code):
+        kind = match.lastgroup
+        if kind == "comment":
+            continue
+        if kind == "string":
+            tokens.append("STR")
+        elif kind == "number":
+            tokens.append("NUM")
+        elif kind == "name":
+            word = match.group()
+            tokens.append(word.lower() if word.lower() in KEYWORDS else "ID")
+        else:
+            tokens.append(match.group())
+    return tokens
+
+
+def normalize_tokens(code: str, language: str = "Python") -> List[str]:
+    """Split code into tokens with identifiers and literals replaced by placeholders."""
+    if _is_python(language):
+        tokens = _python_tokens(code)
+        if tokens is not None:
+            return tokens
+    return _generic_tokens(code)
+
+
+# --------------------- FINGERPRINTS --------------------- #
+
+def _hash_gram(gram) -> int:
+    return zlib.crc32("\x1f".join(gram).encode())
+
+
+def _ngrams(items: List[str], n: int) -> List[tuple]:
+    if len(items) < n:
+        return [tuple(items)] if items else []
+    return [tuple(items[i:i + n]) for i in range(len(items) - n + 1)]
+
+
+def winnow(tokens: List[str], k: int = WINNOW_K, window: int = WINNOW_WINDOW) -> frozenset:
+    """Select the minimum k-gram hash of every window (Schleimer et al., 2003)."""
+    hashes = [_hash_gram(gram) for gram in _ngrams(tokens, k)]
+    if len(hashes) <= window:
+        return frozenset(hashes)
+
+    fingerprints = set()
+    for start in range(len(hashes) - window + 1):
+        fingerprints.add(min(hashes[start:start + window]))
+    return frozenset(fingerprints)
+
+
+def _structure(code: str, language: str) -> Optional[Counter]:
+    """N-grams of AST node types for Python code, or None if it is not Python or does not parse."""
+    if not _is_python(language):
+        return None
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+    nodes = [type(node).__name__ for node in ast.walk(tree)
+             if not isinstance(node, (ast.Load, ast.Store, ast.Del))]
+    return Counter(_ngrams(nodes, AST_NGRAM))
+
+
+def _skeleton(tokens: List[str]) -> Counter:
+    """N-grams of the keywords, brackets and indentation of normalized tokens."""
+    skeleton = [token for token in tokens if token in KEYWORDS or token in BRACKETS
+                or keyword.iskeyword(token) or token in ("INDENT", "DEDENT")]
+    return Counter(_ngrams(skeleton, AST_NGRAM))
+
+
+def strip_fences(code: str) -> str:
+    """Code inside markdown fences, or the code itself when it has none."""
+    blocks = FENCE_PATTERN.findall(code)
+    if blocks:
+        return "\n".join(blocks)
+    # A reply cut off before its closing fence
+    if code.lstrip().startswith("```"):
+        return code.lstrip().partition("\n")[2]
+    return code
+
+
+def _dedent(code: str) -> str:
+    lines = [line for line in code.splitlines() if line.strip()]
+    indent = min((len(line) - len(line.lstrip()) for line in lines), default=0)
+    return "\n".join(line[indent:] for line in code.splitlines())
+
+
+@lru_cache(maxsize=FINGERPRINT_CACHE_SIZE)
+def fingerprint(code: str, language: str = "Python") -> CodeFingerprint:
+    """Compute, and cache, everything needed to compare a snippet with others."""
+    # Dedent so snippets pasted with leading indentation still parse
+    code = _dedent(strip_fences(code))
+    tokens = normalize_tokens(code, language)
+    return {
+        "tokens": tokens,
+        "winnow": winnow(tokens),
+        "ngrams": frozenset(_ngrams(tokens, TOKEN_NGRAM)),
+        "structure": _structure(code, language),
+        "skeleton": _skeleton(tokens)
+    }
+
+
+# --------------------- SCORING --------------------- #
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    if not a and not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _weighted_jaccard(a: Counter, b: Counter) -> float:
+    union = sum((a | b).values())
+    if not union:
+        return 0.0
+    return sum((a & b).values()) / union
+
+
+def compare_fingerprints(a: CodeFingerprint, b: CodeFingerprint) -> SimilarityResult:
+    """Blend the component similarities of two fingerprints into a 0-10 score."""
+    # AST and keyword n-grams are not comparable, so both sides must use the same one
+    if a["structure"] is not None and b["structure"] is not None:
+        structure = _weighted_jaccard(a["structure"], b["structure"])
+    else:
+        structure = _weighted_jaccard(a["skeleton"], b["skeleton"])
+    components = {
+        "winnowing": _jaccard(a["winnow"], b["winnow"]),
+        "structure": structure,
+        "ngram": _jaccard(a["ngrams"], b["ngrams"])
+    }
+    blend = sum(WEIGHTS[name] * value for name, value in components.items())
+    score = round(10 * min(max((blend - SCORE_FLOOR) / (SCORE_CEILING - SCORE_FLOOR), 0.0), 1.0), 2)
+    return {
+        "score": score,
+        "components": {name: round(value, 4) for name, value in components.items()},
+        "borderline": is_borderline(score)
+    }
+
+
+def score_code_similarity(code1: str, code2: str, language: str = "Python") -> SimilarityResult:
+    """Score the similarity of two code snippets from 0 (unrelated) to 10 (identical)."""
+    if not code1.strip() or not code2.strip():
+        return {"score": 0.0, "components": {name: 0.0 for name in WEIGHTS}, "borderline": False}
+    return compare_fingerprints(fingerprint(code1, language), fingerprint(code2, language))
+
+
+def is_borderline(score: float) -> bool:
+    """Whether a local score is too ambiguous to trust without the LLM."""
+    return BORDERLINE_LOW <= score <= BORDERLINE_HIGH
+
+
+# The number right after the word "score", as in 'Similarity Score: 7/10' or 'a score of 7.5'
+LABELLED_SCORE_PATTERN = re.compile(r"\bscore\b[\s:*=-]*(?:(?:of|is)\s+)?(\d+(?:\.\d+)?)", re.IGNORECASE)
+SCORE_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*(?:/\s*10|out of 10)", re.IGNORECASE)
+
+
+def parse_similarity_score(text: str) -> Optional[float]:
+    """Extract a 0-10 score from an LLM reply such as 'Similarity Score: 7/10'.
+
+    Other numbers in the reply, such as a count of snippets, are never taken for the score.
+    """
+    match = LABELLED_SCORE_PATTERN.search(text) or SCORE_PATTERN.search(text)
+    if match is None:
+        return None
+    score = float(match.group(1))
+    return score if 0 <= score <= 10 else None
@@ -0,0 +1,50 @@
+"""Checks that the MinHash/LSH index finds copied submissions.
+
+Run with: python -m pytest app/test_plagiarism.py
+"""
+from plagiarism import PlagiarismIndex, minhash_signature, estimated_jaccard
+from similarity import fingerprint
+from test_similarity import SOLUTIONS
+
+
+BFS = '''
+from collections import deque
+
+def shortest_path(graph, start, goal):
+    queue = deque([(start, 0)])
+    seen = {start}
+    while queue:
+        node, dist = queue.popleft()
+        if node == goal:
+            return dist
+        for nxt in graph[node]:
+            if nxt not in seen:
+                seen.add(nxt)
+                queue.append((nxt, dist + 1))
+    return -1
+'''
+BFS_SWAPPED = BFS.replace("    queue = deque([(start, 0)])\n    seen = {start}\n",
+                          "    seen = {start}\n    queue = deque([(start, 0)])\n")
+
+
+def test_estimated_jaccard_is_close_to_the_exact_one():
+    for first, second in [(BFS, BFS_SWAPPED), (SOLUTIONS["two_sum"]["reference"], SOLUTIONS["two_sum"]["copy_range"])]:
+        a, b = fingerprint(first)["winnow"], fingerprint(second)["winnow"]
+        exact = len(a & b) / len(a | b)
+        assert abs(estimated_jaccard(minhash_signature(a), minhash_signature(b)) - exact) < 0.15
+
+
+def test_copies_are_reported_and_other_solutions_are_not_copies():
+    index = PlagiarismIndex()
+    index.add("bfs", BFS)
+    index.add("bfs_swapped", BFS_SWAPPED)
+    for problem, solutions in SOLUTIONS.items():
+        for variant, code in solutions.items():
+            index.add(f"{problem}/{variant}", code)
+
+    reported = {pair["candidates"] for pair in index.report(top_k=100)["pairs"]}
+    assert ("bfs", "bfs_swapped") in reported
+    assert ("two_sum/copy_temp_var", "two_sum/reference") in reported
+    # Other solutions are not copies of the reference (though two of them may copy each other)
+    assert not any("/alt_" in first and second.endswith("/reference") or
+                   "/alt_" in second and first.endswith("/reference") for first, second in reported)
@@ -0,0 +1,364 @@
+"""Checks of the local similarity score against a small corpus of candidate solutions.
+
+Run with: python -m pytest app/test_similarity.py
+"""
+from itertools import combinations
+
+from similarity import score_code_similarity, parse_similarity_score, BORDERLINE_LOW
+
+
+# Solutions of a few problems: a reference and the kinds of submission a test gets.
+# "copy_*" variants are edited copies of the reference; "alt_*" variants solve the
+# problem another way.
+SOLUTIONS = {
+    "fibonacci": {
+        "reference": '''
+def fib(n):
+    a, b = 0, 1
+    for _ in range(n):
+        a, b = b, a + b
+    return a
+''',
+        "copy_renamed": '''
+def fibonacci(count):
+    prev, cur = 0, 1
+    for _ in range(count):
+        prev, cur = cur, prev + cur
+    return prev
+''',
+        "copy_commented": '''
+def fib(n):
+    # two running values of the sequence
+    a, b = 0, 1
+    for _ in range(n):
+        a, b = b, a + b  # advance one step
+    return a
+''',
+        "alt_while": '''
+def fib(n):
+    prev, cur = 0, 1
+    i = 0
+    while i < n:
+        prev, cur = cur, prev + cur
+        i += 1
+    return prev
+''',
+        "alt_recursive": '''
+def fib(n):
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+''',
+        "alt_memo": '''
+from functools import lru_cache
+
+@lru_cache(None)
+def fib(n):
+    if n <= 1:
+        return n
+    return fib(n - 1) + fib(n - 2)
+''',
+    },
+    "two_sum": {
+        "reference": '''
+def two_sum(nums, target):
+    seen = {}
+    for i, x in enumerate(nums):
+        if target - x in seen:
+            return [seen[target - x], i]
+        seen[x] = i
+    return []
+''',
+        "copy_renamed": '''
+def twoSum(arr, goal):
+    index = {}
+    for k, value in enumerate(arr):
+        if goal - value in index:
+            return [index[goal - value], k]
+        index[value] = k
+    return []
+''',
+        "copy_temp_var": '''
+def two_sum(nums, target):
+    # remember where each number was seen
+    seen = {}
+    for i, x in enumerate(nums):
+        need = target - x
+        if need in seen:
+            return [seen[need], i]
+        seen[x] = i
+    return []
+''',
+        "copy_range": '''
+def two_sum(nums, target):
+    seen = {}
+    for i in range(len(nums)):
+        if target - nums[i] in seen:
+            return [seen[target - nums[i]], i]
+        seen[nums[i]] = i
+    return []
+''',
+        "alt_brute_force": '''
+def two_sum(nums, target):
+    for i in range(len(nums)):
+        for j in range(i + 1, len(nums)):
+            if nums[i] + nums[j] == target:
+                return [i, j]
+    return []
+''',
+        "alt_sorted": '''
+def two_sum(nums, target):
+    order = sorted(range(len(nums)), key=lambda i: nums[i])
+    lo, hi = 0, len(nums) - 1
+    while lo < hi:
+        total = nums[order[lo]] + nums[order[hi]]
+        if total == target:
+            return sorted([order[lo], order[hi]])
+        if total < target:
+            lo += 1
+        else:
+            hi -= 1
+    return []
+''',
+    },
+    "binary_search": {
+        "reference": '''
+def binary_search(items, target):
+    lo, hi = 0, len(items) - 1
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        if items[mid] == target:
+            return mid
+        if items[mid] < target:
+            lo = mid + 1
+        else:
+            hi = mid - 1
+    return -1
+''',
+        "copy_renamed": '''
+def search(arr, x):
+    left, right = 0, len(arr) - 1
+    while left <= right:
+        middle = (left + right) // 2
+        if arr[middle] == x:
+            return middle
+        if arr[middle] < x:
+            left = middle + 1
+        else:
+            right = middle - 1
+    return -1
+''',
+        "copy_swapped_branches": '''
+def binary_search(items, target):
+    lo, hi = 0, len(items) - 1
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        if items[mid] == target:
+            return mid
+        if items[mid] > target:
+            hi = mid - 1
+        else:
+            lo = mid + 1
+    return -1
+''',
+        "alt_recursive": '''
+def binary_search(items, target, lo=0, hi=None):
+    if hi is None:
+        hi = len(items) - 1
+    if lo > hi:
+        return -1
+    mid = (lo + hi) // 2
+    if items[mid] == target:
+        return mid
+    if items[mid] < target:
+        return binary_search(items, target, mid + 1, hi)
+    return binary_search(items, target, lo, mid - 1)
+''',
+        "alt_bisect": '''
+import bisect
+
+def binary_search(items, target):
+    i = bisect.bisect_left(items, target)
+    return i if i < len(items) and items[i] == target else -1
+''',
+        "alt_linear": '''
+def binary_search(items, target):
+    for i, item in enumerate(items):
+        if item == target:
+            return i
+    return -1
+''',
+    },
+    "palindrome": {
+        "reference": '''
+def is_palindrome(s):
+    left, right = 0, len(s) - 1
+    while left < right:
+        while left < right and not s[left].isalnum():
+            left += 1
+        while left < right and not s[right].isalnum():
+            right -= 1
+        if s[left].lower() != s[right].lower():
+            return False
+        left += 1
+        right -= 1
+    return True
+''',
+        "copy_renamed": '''
+def check(text):
+    i, j = 0, len(text) - 1
+    while i < j:
+        while i < j and not text[i].isalnum():
+            i += 1
+        while i < j and not text[j].isalnum():
+            j -= 1
+        if text[i].lower() != text[j].lower():
+            return False
+        i += 1
+        j -= 1
+    return True
+''',
+        "alt_slice": '''
+def is_palindrome(s):
+    s = ''.join(c.lower() for c in s if c.isalnum())
+    return s == s[::-1]
+''',
+        "alt_filter_loop": '''
+def is_palindrome(s):
+    chars = [c.lower() for c in s if c.isalnum()]
+    for i in range(len(chars) // 2):
+        if chars[i] != chars[-1 - i]:
+            return False
+    return True
+''',
+    },
+    "word_count": {
+        "reference": '''
+def word_count(text):
+    counts = {}
+    for word in text.split():
+        word = word.lower()
+        counts[word] = counts.get(word, 0) + 1
+    return counts
+''',
+        "copy_renamed": '''
+def count_words(s):
+    freq = {}
+    for w in s.split():
+        w = w.lower()
+        freq[w] = freq.get(w, 0) + 1
+    return freq
+''',
+        "alt_counter": '''
+from collections import Counter
+
+def word_count(text):
+    return dict(Counter(word.lower() for word in text.split()))
+''',
+        "alt_defaultdict": '''
+from collections import defaultdict
+
+def word_count(text):
+    counts = defaultdict(int)
+    for word in text.lower().split():
+        counts[word] += 1
+    return dict(counts)
+''',
+    },
+    "max_subarray": {
+        "reference": '''
+def max_subarray(nums):
+    best = cur = nums[0]
+    for x in nums[1:]:
+        cur = max(x, cur + x)
+        best = max(best, cur)
+    return best
+''',
+        "copy_renamed": '''
+def maxSubArray(arr):
+    answer = running = arr[0]
+    for value in arr[1:]:
+        running = max(value, running + value)
+        answer = max(answer, running)
+    return answer
+''',
+        "alt_brute_force": '''
+def max_subarray(nums):
+    best = nums[0]
+    for i in range(len(nums)):
+        total = 0
+        for j in range(i, len(nums)):
+            total += nums[j]
+            best = max(best, total)
+    return best
+''',
+        "alt_prefix": '''
+def max_subarray(nums):
+    best = nums[0]
+    prefix = 0
+    lowest = 0
+    for x in nums:
+        prefix += x
+        best = max(best, prefix - lowest)
+        lowest = min(lowest, prefix)
+    return best
+''',
+    },
+}
+
+
+def _pairs(kind):
+    """Candidate-vs-reference pairs of the same problem whose variant starts with kind."""
+    return [(problem, variant, score_code_similarity(solutions[variant], solutions["reference"]))
+            for problem, solutions in SOLUTIONS.items() for variant in solutions if variant.startswith(kind)]
+
+
+def _unrelated_pairs():
+    """References of different problems, scored against each other."""
+    return [(first, second, score_code_similarity(SOLUTIONS[first]["reference"], SOLUTIONS[second]["reference"]))
+            for first, second in combinations(SOLUTIONS, 2)]
+
+
+def test_edited_copies_are_never_settled_as_different():
+    # A copy either scores above the borderline band or is passed to the LLM
+    for problem, variant, result in _pairs("copy_"):
+        assert result["score"] >= BORDERLINE_LOW, (problem, variant, result)
+
+
+def test_unrelated_code_scores_near_zero():
+    for first, second, result in _unrelated_pairs():
+        assert result["score"] <= 1.0, (first, second, result)
+        assert not result["borderline"], (first, second, result)
+
+
+def test_other_solutions_score_below_copies():
+    copies = min(result["score"] for _, _, result in _pairs("copy_"))
+    for problem, variant, result in _pairs("alt_"):
+        assert result["score"] < copies, (problem, variant, result)
+
+
+def test_only_a_minority_of_pairs_is_borderline():
+    # Every candidate of a test is scored against the reference of its own question,
+    # so that is the population the LLM fallback rate applies to
+    results = [result for _, _, result in _pairs("copy_") + _pairs("alt_")]
+    borderline = sum(result["borderline"] for result in results)
+    assert borderline / len(results) <= 0.2, f"{borderline} of {len(results)} pairs are borderline"
+
+
+def test_fences_are_ignored():
+    code = SOLUTIONS["two_sum"]["reference"]
+    fenced = f"Here is my solution:\n```python\n{code}```\n"
+    assert score_code_similarity(code, fenced)["score"] == 10.0
+
+
+def test_identical_code_scores_ten_even_if_unparsable():
+    code = "def f(:\n    return [1, 2"
+    assert score_code_similarity(code, code)["score"] == 10.0
+
+
+def test_parse_similarity_score_reads_the_labelled_number():
+    assert parse_similarity_score("Similarity Score: 7/10\nThe 2 solutions...") == 7.0
+    assert parse_similarity_score("**Similarity Score**: 8.5/10") == 8.5
+    assert parse_similarity_score("Compared 2 snippets; score 11") is None
+    assert parse_similarity_score("I'd rate them 6 out of 10") == 6.0
+    assert parse_similarity_score("No score given") is None
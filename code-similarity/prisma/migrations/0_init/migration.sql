@@ -0,0 +1,57 @@
+-- CreateEnum
+CREATE TYPE "DifficultyLevel" AS ENUM ('EASY', 'MEDIUM', 'HARD', 'EXPERT');
+
+-- CreateTable
+CREATE TABLE "Question" (
+    "id" SERIAL NOT NULL,
+    "text" TEXT NOT NULL,
+    "language" TEXT NOT NULL DEFAULT 'Python',
+    "constraints" TEXT,
+    "createdAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "updatedAt" TIMESTAMP(3) NOT NULL,
+
+    CONSTRAINT "Question_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateTable
+CREATE TABLE "LLMSolution" (
+    "id" SERIAL NOT NULL,
+    "questionId" INTEGER NOT NULL,
+    "llmName" TEXT NOT NULL,
+    "solution" TEXT NOT NULL,
+    "metrics" JSONB NOT NULL DEFAULT '{}',
+    "timestamp" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT "LLMSolution_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateTable
+CREATE TABLE "Comparison" (
+    "id" SERIAL NOT NULL,
+    "questionId" INTEGER NOT NULL,
+    "candidateId" TEXT NOT NULL,
+    "candidateSolution" TEXT NOT NULL,
+    "similarityScores" JSONB NOT NULL,
+    "timestamp" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT "Comparison_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateTable
+CREATE TABLE "Problem" (
+    "id" SERIAL NOT NULL,
+    "text" TEXT NOT NULL,
+    "language" TEXT NOT NULL DEFAULT 'Python',
+    "constraints" TEXT,
+    "difficulty" "DifficultyLevel" NOT NULL DEFAULT 'MEDIUM',
+    "createdAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "updatedAt" TIMESTAMP(3) NOT NULL,
+
+    CONSTRAINT "Problem_pkey" PRIMARY KEY ("id")
+);
+
+-- AddForeignKey
+ALTER TABLE "LLMSolution" ADD CONSTRAINT "LLMSolution_questionId_fkey" FOREIGN KEY ("questionId") REFERENCES "Question"("id") ON DELETE RESTRICT ON UPDATE CASCADE;
+
+-- AddForeignKey
+ALTER TABLE "Comparison" ADD CONSTRAINT "Comparison_questionId_fkey" FOREIGN KEY ("questionId") REFERENCES "Question"("id") ON DELETE RESTRICT ON UPDATE CASCADE;
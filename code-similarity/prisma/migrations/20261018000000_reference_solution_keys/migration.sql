@@ -0,0 +1,33 @@
+-- DropForeignKey
+ALTER TABLE "LLMSolution" DROP CONSTRAINT "LLMSolution_questionId_fkey";
+
+-- AlterTable
+ALTER TABLE "LLMSolution" ADD COLUMN     "invalidatedAt" TIMESTAMP(3),
+ADD COLUMN     "language" TEXT,
+ADD COLUMN     "questionHash" TEXT,
+ALTER COLUMN "questionId" DROP NOT NULL;
+
+-- CreateTable
+CREATE TABLE "SubmissionFingerprint" (
+    "id" SERIAL NOT NULL,
+    "questionId" INTEGER NOT NULL,
+    "candidateId" TEXT NOT NULL,
+    "contentHash" TEXT NOT NULL,
+    "signature" JSONB NOT NULL,
+    "signatureVersion" TEXT NOT NULL DEFAULT '',
+    "timestamp" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT "SubmissionFingerprint_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE INDEX "LLMSolution_questionHash_language_llmName_idx" ON "LLMSolution"("questionHash", "language", "llmName");
+
+-- CreateIndex
+CREATE UNIQUE INDEX "SubmissionFingerprint_questionId_candidateId_key" ON "SubmissionFingerprint"("questionId", "candidateId");
+
+-- AddForeignKey
+ALTER TABLE "LLMSolution" ADD CONSTRAINT "LLMSolution_questionId_fkey" FOREIGN KEY ("questionId") REFERENCES "Question"("id") ON DELETE SET NULL ON UPDATE CASCADE;
+
+-- AddForeignKey
+ALTER TABLE "SubmissionFingerprint" ADD CONSTRAINT "SubmissionFingerprint_questionId_fkey" FOREIGN KEY ("questionId") REFERENCES "Question"("id") ON DELETE RESTRICT ON UPDATE CASCADE;
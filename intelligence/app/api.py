@@ -1,67 +1,337 @@
 import os
-from flask import Flask, jsonify
+import json
+import time
+import uuid
+import hmac
+import ipaddress
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from flask import Flask, jsonify, request, Response
 from flask_cors import CORS  # If you need CORS
 
+from main import run_security_audit, logger, metrics, TargetScope
+
 app = Flask(__name__)
-CORS(app)  # If you need CORS
+# Only the dashboard may call the job routes from a browser
+DASHBOARD_ORIGINS = os.environ.get("AUDIT_DASHBOARD_ORIGINS", "http://localhost:3000").split(",")
+CORS(app, resources={r"/api/pentesting*": {"origins": DASHBOARD_ORIGINS}})
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_REPORT_PATH = os.path.join(BASE_DIR, "security_report.md")
+JOB_REPORTS_DIR = os.path.join(BASE_DIR, "reports")
+
+# Defaults used when a client starts an audit without specifying one
+DEFAULT_OBJECTIVE = """Perform a comprehensive security assessment of 192.0.0.2.
+    Identify open ports, discover hidden directories, and test for common web vulnerabilities
+    including SQL injection. Ensure all tests are non-intrusive and respect the target scope."""
+DEFAULT_ALLOWED_DOMAINS = ["localhost"]
+DEFAULT_ALLOWED_IP_RANGES = ["192.0.0.2"]
+
+# Hosts this server may ever scan; a submitted scope must lie within them.
+# Comma-separated, defaulting to the default scope above.
+SERVER_SCOPE = TargetScope(
+    [domain for domain in os.environ.get("AUDIT_SCOPE_DOMAINS", ",".join(DEFAULT_ALLOWED_DOMAINS)).split(",") if domain],
+    [ip_range for ip_range in os.environ.get("AUDIT_SCOPE_IP_RANGES", ",".join(DEFAULT_ALLOWED_IP_RANGES)).split(",")
+     if ip_range]
+)
+# When set, every job route requires "Authorization: Bearer <token>" (or ?token= for event streams)
+API_TOKEN = os.environ.get("AUDIT_API_TOKEN")
+
+# Seconds between keep-alive comments on idle event streams
+SSE_KEEPALIVE_SECONDS = 15
+
+
+class AuditJob:
+    """State of one background audit: status, event history, per-task results and report."""
+
+    def __init__(self, job_id: str, params: Dict):
+        self.id = job_id
+        self.params = params
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.report_path = os.path.join(JOB_REPORTS_DIR, f"security_report_{job_id}.md")
+        self.report_chunks: List[str] = []
+        self.results: Dict[str, Dict] = {}
+        self.progress = {"node": None, "completed_tasks": 0, "queued_tasks": 0}
+        self.events: List[Dict] = []
+        self.condition = threading.Condition()
+
+    def add_event(self, event_type: str, data: Dict) -> None:
+        """Record an event and wake up event stream readers."""
+        with self.condition:
+            self.events.append({"id": len(self.events), "type": event_type, "data": data})
+            self.condition.notify_all()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def summary(self) -> Dict:
+        with self.condition:
+            return {
+                "jobId": self.id,
+                "status": self.status,
+                "error": self.error,
+                "createdAt": self.created_at,
+                "finishedAt": self.finished_at,
+                "progress": dict(self.progress),
+                "reportPath": self.report_path
+            }
+
+
+class AuditJobManager:
+    """Runs audits on a background worker pool and keeps their state for polling and streaming."""
+
+    def __init__(self, max_workers: int = 2, max_finished_jobs: int = 100):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="audit")
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs: Dict[str, AuditJob] = {}
+        self.lock = threading.Lock()
+
+    def submit(self, params: Dict) -> AuditJob:
+        """Queue an audit and return its job."""
+        job = AuditJob(uuid.uuid4().hex, params)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._prune()
+        job.add_event("status", {"status": job.status})
+        self.executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[AuditJob]:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def all_jobs(self) -> List[AuditJob]:
+        with self.lock:
+            return sorted(self.jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    def latest_completed(self) -> Optional[AuditJob]:
+        for job in self.all_jobs():
+            if job.status == "completed":
+                return job
+        return None
+
+    def _prune(self) -> None:
+        """Forget the oldest finished jobs beyond max_finished_jobs."""
+        finished = sorted((job for job in self.jobs.values() if job.finished), key=lambda job: job.created_at)
+        for job in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job.id]
+
+    def _run(self, job: AuditJob) -> None:
+        with job.condition:
+            job.status = "running"
+        job.add_event("status", {"status": job.status})
+        os.makedirs(JOB_REPORTS_DIR, exist_ok=True)
+
+        def on_event(node: str, state: Dict) -> None:
+            # Publish results of tasks completed since the previous node
+            new_results = list(state.get('results', {}).items())[len(job.results):]
+            with job.condition:
+                for task_signature, task_result in new_results:
+                    job.results[task_signature] = task_result
+                job.progress = {
+                    "node": node,
+                    "completed_tasks": len(state.get('completed_tasks', [])),
+                    "queued_tasks": len(state.get('task_index', {}))
+                }
+            for task_signature, task_result in new_results:
+                job.add_event("task", {
+                    "signature": task_signature,
+                    "success": task_result['success'],
+                    "executionTime": task_result['execution_time']
+                })
+            job.add_event("progress", dict(job.progress))
+
+        def on_report_chunk(chunk: str) -> None:
+            with job.condition:
+                job.report_chunks.append(chunk)
+            job.add_event("report", {"chunk": chunk})
+
+        try:
+            run_security_audit(
+                job.params["objective"],
+                job.params["allowed_domains"],
+                job.params["allowed_ip_ranges"],
+                parallel=job.params["parallel"],
+                batch_analysis=job.params["batch_analysis"],
+                force_refresh=job.params["force_refresh"],
+                report_path=job.report_path,
+                on_report_chunk=on_report_chunk,
+                on_event=on_event,
+                audit_id=job.id
+            )
+            status = "completed"
+        except Exception as e:
+            logger.error(f"Audit job {job.id} failed: {e}", exc_info=True)
+            with job.condition:
+                job.error = str(e)
+            status = "failed"
+
+        with job.condition:
+            job.status = status
+            job.finished_at = time.time()
+        job.add_event("status", {"status": status, "error": job.error})
+
+
+job_manager = AuditJobManager(max_workers=int(os.environ.get("AUDIT_WORKERS", 2)))
+
+
+@app.before_request
+def require_api_token():
+    if API_TOKEN is None or not request.path.startswith("/api/pentesting") or request.method == "OPTIONS":
+        return None
+    header = request.headers.get("Authorization", "")
+    token = header[len("Bearer "):] if header.startswith("Bearer ") else request.args.get("token", "")
+    if not hmac.compare_digest(token.encode(), API_TOKEN.encode()):
+        return jsonify({"error": "Missing or invalid API token"}), 401
+    return None
+
+
+def _out_of_server_scope(allowed_domains: List, allowed_ip_ranges: List) -> List[str]:
+    """Return the submitted domains and IP ranges that are not within SERVER_SCOPE."""
+    rejected = []
+    for domain in allowed_domains:
+        if not isinstance(domain, str) or not SERVER_SCOPE.is_target_allowed(domain):
+            rejected.append(str(domain))
+    for ip_range in allowed_ip_ranges:
+        try:
+            network = ipaddress.ip_network(ip_range)
+        except (TypeError, ValueError):
+            rejected.append(str(ip_range))
+            continue
+        if not any(network.version == allowed.version and network.subnet_of(allowed)
+                   for allowed in SERVER_SCOPE.allowed_ip_ranges):
+            rejected.append(str(ip_range))
+    return rejected
+
+
+def _job_or_404(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        return None, (jsonify({"error": f"Unknown job {job_id}"}), 404)
+    return job, None
+
 
 @app.route('/api/pentesting', methods=['POST'])
 def pentesting():
-    # Your existing POST code
-    report_path = "../security_report.md"
-    return jsonify({"reportPath": report_path})
+    """Queue a security audit and return its job id."""
+    body = request.get_json(silent=True) or {}
+    params = {
+        "objective": body.get("objective", DEFAULT_OBJECTIVE),
+        "allowed_domains": body.get("allowed_domains", DEFAULT_ALLOWED_DOMAINS),
+        "allowed_ip_ranges": body.get("allowed_ip_ranges", DEFAULT_ALLOWED_IP_RANGES),
+        "parallel": bool(body.get("parallel", False)),
+        "batch_analysis": bool(body.get("batch_analysis", False)),
+        "force_refresh": bool(body.get("force_refresh", False))
+    }
+    if not isinstance(params["allowed_domains"], list) or not isinstance(params["allowed_ip_ranges"], list):
+        return jsonify({"error": "allowed_domains and allowed_ip_ranges must be lists"}), 400
+    rejected = _out_of_server_scope(params["allowed_domains"], params["allowed_ip_ranges"])
+    if rejected:
+        logger.warning(f"Rejected audit request for targets outside the server scope: {rejected}")
+        return jsonify({"error": "Targets outside the scope this server may audit", "rejected": rejected}), 403
 
-@app.route('/api/pentesting/report', methods=['GET'])
-def get_security_report():
-    try:
-        # Hardcoded security report content
-        report_content = """# Security Audit Report for 192.0.0.2
+    job = job_manager.submit(params)
+    return jsonify({
+        "jobId": job.id,
+        "status": job.status,
+        "reportPath": job.report_path,
+        "statusUrl": f"/api/pentesting/{job.id}",
+        "eventsUrl": f"/api/pentesting/{job.id}/events"
+    }), 202
 
-## Executive Summary
-This report summarizes the findings from the security audit conducted on the IP address 192.0.0.2. The audit focused on identifying open ports, hidden directories, and common web vulnerabilities, including SQL injection. The findings are categorized by risk level: critical, moderate, and low.
 
----
+@app.route('/api/pentesting/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify({"jobs": [job.summary() for job in job_manager.all_jobs()]})
 
-## Critical Vulnerabilities
 
-### 1. Open Ports with Potential Risks
-- **Description**: Multiple open ports were identified, including 3000 (ppp), 5000 (rtsp), 5432 (PostgreSQL), 5555 (http), 7000 (rtsp), and 8080 (http-proxy). Some of these services may be misconfigured or outdated, posing security risks.
-- **Affected Targets**: All open ports on 192.0.0.2.
-- **Potential Impact**: Unauthorized access, data leakage, or exploitation of vulnerabilities in outdated services could lead to data breaches or service disruptions.
-- **Recommended Remediation Steps**:
-  - Conduct a thorough review of the services running on these ports.
-  - Ensure that all services are updated to the latest versions.
-  - Implement firewall rules to restrict access to only necessary ports and services.
-  - Consider disabling any unnecessary services.
+@app.route('/api/pentesting/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job, error = _job_or_404(job_id)
+    if error:
+        return error
+    return jsonify(job.summary())
 
----
 
-## Moderate Vulnerabilities
+@app.route('/api/pentesting/<job_id>/results', methods=['GET'])
+def get_job_results(job_id):
+    job, error = _job_or_404(job_id)
+    if error:
+        return error
+    with job.condition:
+        results = dict(job.results)
+    return jsonify({"jobId": job.id, "status": job.status, "results": results})
 
-### 2. Lack of Directory Discovery
-- **Description**: The ffuf scan did not discover any hidden directories or endpoints, which may indicate a lack of proper web application security measures.
-- **Affected Targets**: Web application hosted on 192.0.0.2.
-- **Potential Impact**: While no immediate vulnerabilities were found, the absence of discovered endpoints may suggest that security measures are in place, or it may indicate a lack of thorough testing.
-- **Recommended Remediation Steps**:
-  - Implement a more comprehensive web application security assessment.
-  - Regularly review and update security measures to ensure they are effective.
 
----
+@app.route('/api/pentesting/<job_id>/report', methods=['GET'])
+def get_job_report(job_id):
+    """Return the report generated so far; it is complete once the job status is completed."""
+    job, error = _job_or_404(job_id)
+    if error:
+        return error
+    with job.condition:
+        content = "".join(job.report_chunks)
+    return jsonify({"success": job.status == "completed", "status": job.status, "content": content})
 
-## Low-Risk Issues
 
-### 3. SQL Injection Testing
-- **Description**: The SQLMap scan confirmed that the target is not vulnerable to SQL injection attacks.
-- **Affected Targets**: Web application hosted on 192.0.0.2.
-- **Potential Impact**: No immediate risk as the application appears to be secure against SQL injection.
-- **Recommended Remediation Steps**:
-  - Continue to monitor and test for SQL injection vulnerabilities regularly.
-  - Ensure that input validation and parameterized queries are consistently applied in the application code.
+@app.route('/api/pentesting/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """Stream job events as server-sent events, replaying history after Last-Event-ID."""
+    job, error = _job_or_404(job_id)
+    if error:
+        return error
+
+    last_event_id = request.headers.get("Last-Event-ID", request.args.get("after", -1))
+    try:
+        next_index = int(last_event_id) + 1
+    except (TypeError, ValueError):
+        next_index = 0
+
+    def generate():
+        nonlocal next_index
+        while True:
+            with job.condition:
+                if next_index >= len(job.events) and not job.finished:
+                    job.condition.wait(timeout=SSE_KEEPALIVE_SECONDS)
+                events = job.events[next_index:]
+                finished = job.finished
+
+            if not events:
+                if finished:
+                    return
+                yield ": keep-alive\n\n"
+                continue
+
+            for event in events:
+                yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+            next_index += len(events)
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
----
 
-## Conclusion
-The security audit of 192.0.0.2 revealed several critical and moderate vulnerabilities that require immediate attention. The presence of multiple open ports poses a significant risk, and it is essential to review and secure these services. Regular security assessments and updates are recommended to maintain a robust security posture."""
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Expose audit pipeline metrics in the Prometheus text format."""
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/api/pentesting/report', methods=['GET'])
+def get_security_report():
+    """Return the most recent completed report, falling back to the last report written by the CLI."""
+    try:
+        job = job_manager.latest_completed()
+        if job is not None:
+            with job.condition:
+                report_content = "".join(job.report_chunks)
+        else:
+            with open(DEFAULT_REPORT_PATH, 'r') as f:
+                report_content = f.read()
 
         return jsonify({
             "success": True,
@@ -75,4 +345,6 @@ The security audit of 192.0.0.2 revealed several critical and moderate vulnerabi
         }), 500
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5050, debug=True)
+    # Local only and without the debugger unless explicitly configured
+    app.run(host=os.environ.get("AUDIT_API_HOST", "127.0.0.1"), port=5050,
+            debug=os.environ.get("FLASK_DEBUG") == "1", threaded=True)
@@ -1,18 +1,38 @@
 import os
 import json
 import time
+import asyncio
 import logging
 import re
 import ipaddress
+import signal
 import sys
-from typing import TypedDict, List, Dict, Any, Tuple, Optional, Annotated
-from subprocess import Popen, PIPE, TimeoutExpired
+import hashlib
+import base64
+import heapq
+import bisect
+import threading
+import contextvars
+import resource
+import uuid
+import sqlite3
+import tempfile
+import mmap
+from abc import ABC, abstractmethod
+from array import array
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from typing import TypedDict, List, Dict, Any, Tuple, Optional, Annotated, Callable, Union, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, lru_cache
 from dotenv import load_dotenv
 
 # LangGraph and LangChain imports
 from langgraph.graph import START, END, StateGraph
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import HumanMessage, AIMessage, AIMessageChunk, BaseMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
 from langchain_openai import ChatOpenAI
 from langgraph.managed.is_last_step import RemainingSteps
 
@@ -47,17 +67,186 @@ logger.info("Security Audit Pipeline Initialized")
 class SecurityAuditState(TypedDict):
     objective: str  # Security objective set by the user
     target_scope: Dict  # Allowed domains and IP ranges
-    task_queue: List  # List of pending tasks
+    task_queue: Dict[str, List]  # Lane -> heap of ready task entries, managed by TaskScheduler
+    task_delayed: List  # Heap of task entries backing off after a failure
+    task_index: Dict[str, int]  # Signature -> sequence number of each queued task
+    task_retries: Dict[str, int]  # Signature -> number of retries after failures
+    task_seq: int  # Sequence counter used to order tasks of equal priority by age
     completed_tasks: List  # List of completed tasks
     results: Dict  # Results of completed tasks
     report: str  # Final security report
     task_complete: bool  # Added stop condition flag
     remaining_steps: RemainingSteps  # Track remaining steps
     seen_tasks: Dict[str, bool]  # Track unique tasks that have been processed
+    analyzed_count: int  # Number of completed tasks already analyzed for follow-ups
+    force_refresh: bool  # Ignore cached scan results and re-run every scan
+    report_digests: Dict[str, Dict]  # Per-finding report digests, keyed by task signature
+    wordlist_claims: Dict[str, Dict[str, List]]  # Target -> wordlist id -> entry ranges already tried
+    audit_id: str  # Identifier under which the audit state is checkpointed
+    checkpoint_node: str  # Last node whose output was checkpointed, used to resume
+
+
+# Workflow steps an audit may take before it stops and writes its report; every
+# executed wave and every analysis is one step, so large scopes need more
+DEFAULT_MAX_STEPS = 50
+
+# Parallel execution defaults: how many tasks run together in one wave and
+# how many instances of each tool may run at the same time
+DEFAULT_MAX_PARALLEL_TASKS = 8
+DEFAULT_TOOL_CONCURRENCY = {
+    "nmap_scan": 4,
+    "gobuster_scan": 2,
+    "ffuf_scan": 4,
+    "sqlmap_scan": 2,
+}
+
+
+# Metrics
+# Histogram buckets in seconds, wide enough for both LLM calls and long scans
+METRIC_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 900)
+
+# Audit whose node is running in the current thread, so metrics can also be attributed per audit
+current_audit_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_audit_id", default=None)
+
+
+class MetricsRegistry:
+    """Process-wide counters, gauges and histograms for the audit pipeline.
+    
+    Every series is exposed in the Prometheus text format by render_prometheus.
+    Counter increments and histogram observations made while an audit node runs
+    are also summed per audit, for the metrics section of that audit's report.
+    """
+    
+    def __init__(self, max_audits: int = 64):
+        self.max_audits = max_audits
+        self._lock = threading.Lock()
+        self._descriptions: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._gauges: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], List] = {}
+        self._audits: OrderedDict = OrderedDict()
+    
+    def describe(self, name: str, metric_type: str, help_text: str) -> None:
+        self._descriptions[name] = (metric_type, help_text)
+    
+    def _record_audit(self, name: str, labels: Tuple, value: float) -> None:
+        audit_id = current_audit_id.get()
+        if audit_id is None:
+            return
+        audit = self._audits.get(audit_id)
+        if audit is None:
+            audit = self._audits[audit_id] = {}
+            while len(self._audits) > self.max_audits:
+                self._audits.popitem(last=False)
+        totals = audit.setdefault((name, labels), [0.0, 0])
+        totals[0] += value
+        totals[1] += 1
+    
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+            self._record_audit(name, key[1], value)
+    
+    def set_gauge(self, name: str, value: float, **labels: str) -> None:
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+    
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(METRIC_BUCKETS), 0.0, 0]
+            position = bisect.bisect_left(METRIC_BUCKETS, value)
+            if position < len(METRIC_BUCKETS):
+                histogram[0][position] += 1
+            histogram[1] += value
+            histogram[2] += 1
+            self._record_audit(name, key[1], value)
+    
+    def audit_totals(self, audit_id: str) -> Dict[str, List[Tuple[Dict[str, str], float, int]]]:
+        """Return name -> [(labels, total, count)] for everything recorded during an audit."""
+        totals: Dict[str, List[Tuple[Dict[str, str], float, int]]] = {}
+        with self._lock:
+            for (name, labels), (total, count) in self._audits.get(audit_id, {}).items():
+                totals.setdefault(name, []).append((dict(labels), total, count))
+        return totals
+    
+    def forget_audit(self, audit_id: str) -> None:
+        with self._lock:
+            self._audits.pop(audit_id, None)
+    
+    @staticmethod
+    def _format_labels(labels: Tuple, extra: Tuple = ()) -> str:
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                   for _, value in pairs)
+        return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+    
+    def render_prometheus(self) -> str:
+        """Render every series in the Prometheus text exposition format."""
+        with self._lock:
+            series: Dict[str, List[str]] = {}
+            for (name, labels), value in self._counters.items():
+                series.setdefault(name, []).append(f"{name}{self._format_labels(labels)} {value}")
+            for (name, labels), value in self._gauges.items():
+                series.setdefault(name, []).append(f"{name}{self._format_labels(labels)} {value}")
+            for (name, labels), (buckets, total, count) in self._histograms.items():
+                lines = series.setdefault(name, [])
+                cumulative = 0
+                for bound, bucket_count in zip(METRIC_BUCKETS, buckets):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{self._format_labels(labels, (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_bucket{self._format_labels(labels, (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {total}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {count}")
+        
+        output = []
+        for name in sorted(series):
+            metric_type, help_text = self._descriptions.get(name, ("untyped", ""))
+            output.append(f"# HELP {name} {help_text}")
+            output.append(f"# TYPE {name} {metric_type}")
+            output.extend(series[name])
+        return "\n".join(output) + "\n"
+
+
+metrics = MetricsRegistry()
+metrics.describe("audit_node_duration_seconds", "histogram", "Duration of security audit workflow nodes.")
+metrics.describe("audit_tool_wall_seconds", "histogram", "Wall-clock time of scanner subprocesses.")
+metrics.describe("audit_tool_cpu_seconds_total", "counter",
+                 "CPU time of finished scanner subprocesses; approximate while several run at once.")
+metrics.describe("audit_llm_request_duration_seconds", "histogram", "Latency of LLM requests that missed the cache.")
+metrics.describe("audit_llm_tokens_total", "counter", "Tokens sent to and received from the LLM.")
+metrics.describe("audit_cache_requests_total", "counter", "Scan and LLM cache lookups by result.")
+metrics.describe("audit_task_queue_depth", "gauge", "Pending tasks in the queue of the most recently active audit.")
+
+
+@lru_cache(maxsize=65536)
+def _normalize_target(target: str) -> str:
+    """Normalize a domain or URL by removing protocol and www."""
+    target = target.lower()
+    target = re.sub(r'^https?://', '', target)
+    target = re.sub(r'^www\.', '', target)
+    return target.strip('/')
 
 
 class TargetScope:
-    """Class to enforce and validate target scopes for security scanning."""
+    """Class to enforce and validate target scopes for security scanning.
+    
+    The allow-lists are compiled once: IP ranges into merged, sorted integer
+    intervals per IP version searched with bisect, domains into a trie keyed by
+    reversed labels. Recent decisions are memoized.
+    """
+    
+    DECISION_MEMO_SIZE = 4096
+    COMPILED_SCOPES_SIZE = 32
+    
+    # Compiled scopes by fingerprint, so every node of an audit reuses the same instance
+    _compiled: 'OrderedDict[str, TargetScope]' = OrderedDict()
+    _compiled_lock = threading.Lock()
     
     def __init__(self, allowed_domains: List[str], allowed_ip_ranges: List[str]):
         # Normalize domains (remove http/https and www)
@@ -65,140 +254,973 @@ class TargetScope:
         self.allowed_ip_ranges = [ipaddress.ip_network(ip_range) for ip_range in allowed_ip_ranges]
         # logger.info(f"Initialized target scope with domains: {self.allowed_domains}")
         # logger.info(f"Initialized target scope with IP ranges: {self.allowed_ip_ranges}")
+        self._intervals = {4: self._compile_intervals(4), 6: self._compile_intervals(6)}
+        self._domain_trie = self._compile_domain_trie()
+        self._decisions: OrderedDict[str, bool] = OrderedDict()
+        self._decisions_lock = threading.Lock()
+        self.fingerprint = self._fingerprint(self.allowed_domains, [str(ip_range) for ip_range in self.allowed_ip_ranges])
+    
+    @staticmethod
+    def _fingerprint(allowed_domains: List[str], allowed_ip_ranges: List[str]) -> str:
+        return hashlib.sha256(json.dumps([allowed_domains, allowed_ip_ranges]).encode('utf-8')).hexdigest()
+    
+    def _compile_intervals(self, version: int) -> Tuple[List[int], List[int]]:
+        """Merge the ranges of one IP version into sorted, disjoint [start, end] intervals."""
+        ranges = sorted(
+            (int(network.network_address), int(network.broadcast_address))
+            for network in self.allowed_ip_ranges if network.version == version
+        )
+        starts, ends = [], []
+        for start, end in ranges:
+            if ends and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        return starts, ends
+    
+    def _compile_domain_trie(self) -> Dict:
+        """Build a trie of reversed domain labels; a None key marks an allowed domain."""
+        trie: Dict = {}
+        for domain in self.allowed_domains:
+            node = trie
+            for label in reversed(domain.split('.')):
+                node = node.setdefault(label, {})
+            node[None] = True
+        return trie
     
     def _normalize_domain(self, domain: str) -> str:
         """Normalize domain by removing protocol and www."""
-        domain = domain.lower()
-        domain = re.sub(r'^https?://', '', domain)
-        domain = re.sub(r'^www\.', '', domain)
-        return domain.strip('/')
+        return _normalize_target(domain)
+    
+    def _ip_allowed(self, ip: ipaddress._BaseAddress) -> bool:
+        starts, ends = self._intervals[ip.version]
+        value = int(ip)
+        index = bisect.bisect_right(starts, value) - 1
+        return index >= 0 and value <= ends[index]
+    
+    def _domain_allowed(self, domain: str) -> bool:
+        # Exact match or subdomain: some prefix of the reversed labels is an allowed domain
+        node = self._domain_trie
+        for label in reversed(domain.split('.')):
+            node = node.get(label)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
     
     def is_target_allowed(self, target: str) -> bool:
         """Check if the target is within the allowed scope."""
         # Normalize the target
         target = self._normalize_domain(target)
         
-        # Check if it's an IP
-        try:
-            ip = ipaddress.ip_address(target)
-            is_allowed = any(ip in ip_range for ip_range in self.allowed_ip_ranges)
-            if not is_allowed:
-                logger.warning(f"IP {target} is outside allowed scope {self.allowed_ip_ranges}")
-            return is_allowed
-        except ValueError:
-            # It's a domain
-            is_allowed = any(
-                target == allowed_domain or  # Exact match
-                target.endswith('.' + allowed_domain)  # Subdomain
-                for allowed_domain in self.allowed_domains
-            )
-            if not is_allowed:
-                logger.warning(f"Domain {target} is outside allowed scope {self.allowed_domains}")
-            return is_allowed
+        with self._decisions_lock:
+            is_allowed = self._decisions.get(target)
+            if is_allowed is not None:
+                self._decisions.move_to_end(target)
+        
+        if is_allowed is None:
+            # Check if it's an IP
+            try:
+                ip = ipaddress.ip_address(target)
+                is_allowed = self._ip_allowed(ip)
+            except ValueError:
+                # It's a domain
+                is_allowed = self._domain_allowed(target)
+            
+            with self._decisions_lock:
+                self._decisions[target] = is_allowed
+                if len(self._decisions) > self.DECISION_MEMO_SIZE:
+                    self._decisions.popitem(last=False)
+        
+        if not is_allowed:
+            logger.warning(f"Target {target} is outside allowed scope "
+                           f"({len(self.allowed_domains)} domains, {len(self.allowed_ip_ranges)} IP ranges)")
+        return is_allowed
     
     def to_dict(self) -> Dict:
         """Convert the scope to a dictionary for state storage."""
         return {
             "allowed_domains": self.allowed_domains,
-            "allowed_ip_ranges": [str(ip_range) for ip_range in self.allowed_ip_ranges]
+            "allowed_ip_ranges": [str(ip_range) for ip_range in self.allowed_ip_ranges],
+            "fingerprint": self.fingerprint
         }
     
     @classmethod
     def from_dict(cls, scope_dict: Dict) -> 'TargetScope':
-        """Create a TargetScope instance from a dictionary."""
-        return cls(
-            allowed_domains=scope_dict["allowed_domains"],
-            allowed_ip_ranges=scope_dict["allowed_ip_ranges"]
+        """Return the compiled TargetScope for a dictionary, compiling it only once."""
+        fingerprint = scope_dict.get("fingerprint") or cls._fingerprint(
+            scope_dict["allowed_domains"], scope_dict["allowed_ip_ranges"]
         )
+        with cls._compiled_lock:
+            target_scope = cls._compiled.get(fingerprint)
+        if target_scope is None:
+            target_scope = cls.register(cls(
+                allowed_domains=scope_dict["allowed_domains"],
+                allowed_ip_ranges=scope_dict["allowed_ip_ranges"]
+            ))
+        return target_scope
+    
+    @classmethod
+    def register(cls, target_scope: 'TargetScope') -> 'TargetScope':
+        """Keep a compiled scope so from_dict returns it for the rest of the audit."""
+        with cls._compiled_lock:
+            cls._compiled[target_scope.fingerprint] = target_scope
+            cls._compiled.move_to_end(target_scope.fingerprint)
+            while len(cls._compiled) > cls.COMPILED_SCOPES_SIZE:
+                cls._compiled.popitem(last=False)
+        return target_scope
+
+
+class StreamParser(ABC):
+    """Incremental parser fed with command output one line at a time."""
+    
+    @abstractmethod
+    def feed(self, line: str) -> None:
+        """Consume a single line of output."""
+    
+    @abstractmethod
+    def reset(self) -> None:
+        """Discard partial state, e.g. before a command is retried."""
+
+
+class NmapXmlParser(StreamParser):
+    """Incrementally parse nmap XML output (-oX -) into compact host records.
+    
+    Each <host> element is converted when it closes and then discarded, so memory
+    use does not grow with the size of the XML document.
+    """
+    
+    # Script output is truncated to keep records small
+    MAX_SCRIPT_OUTPUT = 500
+    
+    def __init__(self):
+        self.reset()
+    
+    def reset(self) -> None:
+        self._parser = ET.XMLPullParser(events=("end",))
+        self._ports: List[Dict] = []
+        self.hosts: List[Dict] = []
+    
+    def feed(self, line: str) -> None:
+        self._parser.feed(line)
+        for _, element in self._parser.read_events():
+            if element.tag == "port":
+                self._ports.append(self._port_record(element))
+            elif element.tag == "host":
+                self.hosts.append(self._host_record(element))
+                self._ports = []
+                element.clear()
+    
+    def _port_record(self, element: ET.Element) -> Dict:
+        state = element.find("state")
+        service = element.find("service")
+        record = {
+            "port": int(element.get("portid")),
+            "protocol": element.get("protocol"),
+            "state": state.get("state") if state is not None else "unknown"
+        }
+        if service is not None:
+            for field in ("name", "product", "version", "extrainfo"):
+                if service.get(field):
+                    record["service" if field == "name" else field] = service.get(field)
+        scripts = {
+            script.get("id"): script.get("output", "")[:self.MAX_SCRIPT_OUTPUT]
+            for script in element.findall("script")
+        }
+        if scripts:
+            record["scripts"] = scripts
+        if record["state"] == "open":
+            logger.info(f"Discovered open port {record['port']}/{record['protocol']} ({record.get('service', 'unknown')})")
+        return record
+    
+    def _host_record(self, element: ET.Element) -> Dict:
+        address = element.find("address")
+        status = element.find("status")
+        record = {
+            "address": address.get("addr") if address is not None else None,
+            "status": status.get("state") if status is not None else "unknown",
+            "ports": self._ports
+        }
+        hostnames = [hostname.get("name") for hostname in element.iter("hostname")]
+        if hostnames:
+            record["hostnames"] = hostnames
+        return record
+    
+    def open_ports(self) -> Dict[str, str]:
+        """Map open port numbers to service names across all hosts."""
+        return {
+            str(port["port"]): port.get("service", "unknown")
+            for host in self.hosts for port in host["ports"] if port["state"] == "open"
+        }
+
+
+class FfufJsonParser(StreamParser):
+    """Incrementally parse ffuf -json output (one JSON result per line) into compact hit records.
+    
+    Only path, status, size, word count and redirect of a hit are kept. Hits outside
+    match_status or with a size in filter_sizes are dropped, at most max_hits are
+    kept, and a status/size pair seen more than noise_threshold times (a catch-all
+    page answering every path) is reported as a single noise count instead of hits.
+    """
+    
+    def __init__(self, base_url: str, max_hits: int = 500, match_status: Optional[set] = None,
+                 filter_sizes: Optional[set] = None, noise_threshold: int = 50):
+        self.base_url = base_url.rstrip('/') + '/'
+        self.max_hits = max_hits
+        self.match_status = match_status
+        self.filter_sizes = filter_sizes or set()
+        self.noise_threshold = noise_threshold
+        self.reset()
+    
+    def reset(self) -> None:
+        self.hits: List[Dict] = []
+        self.total = 0
+        self.filtered = 0
+        self.truncated = False
+        self._pair_counts: Dict[Tuple[int, int], int] = {}
+    
+    def feed(self, line: str) -> None:
+        line = line.strip()
+        if not line.startswith('{'):
+            return
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError:
+            return
+        status = item.get('status')
+        if status is None:
+            return
+        
+        self.total += 1
+        length = item.get('length', 0)
+        if (self.match_status is not None and status not in self.match_status) or length in self.filter_sizes:
+            self.filtered += 1
+            return
+        
+        pair = (status, length)
+        self._pair_counts[pair] = self._pair_counts.get(pair, 0) + 1
+        if self._pair_counts[pair] > self.noise_threshold:
+            return
+        if len(self.hits) >= self.max_hits:
+            self.truncated = True
+            return
+        
+        hit = {"path": self._path(item), "status": status, "length": length, "words": item.get('words', 0)}
+        if item.get('redirectlocation'):
+            hit["redirect"] = item['redirectlocation']
+        self.hits.append(hit)
+    
+    def _path(self, item: Dict) -> str:
+        """Return the fuzzed path, taken from the result URL (ffuf base64-encodes input values)."""
+        url = item.get('url', '')
+        if url.startswith(self.base_url):
+            return url[len(self.base_url):]
+        fuzz = item.get('input', {}).get('FUZZ', '')
+        try:
+            return base64.b64decode(fuzz, validate=True).decode('utf-8')
+        except (ValueError, UnicodeDecodeError):
+            return fuzz
+    
+    def noise(self) -> Dict[str, int]:
+        """Return status/size pairs reported as noise, with how many hits each had."""
+        return {f"{status}/{length}": count for (status, length), count in self._pair_counts.items()
+                if count > self.noise_threshold}
+    
+    def result(self) -> Dict:
+        noisy = {(status, length) for (status, length), count in self._pair_counts.items()
+                 if count > self.noise_threshold}
+        hits = [hit for hit in self.hits if (hit["status"], hit["length"]) not in noisy]
+        result = {
+            "discovered_endpoints": [hit["path"] for hit in hits],
+            "status_codes": {hit["path"]: hit["status"] for hit in hits},
+            "total_results": self.total,
+            "filtered_results": self.filtered,
+            "noise": self.noise(),
+            "truncated": self.truncated
+        }
+        redirects = {hit["path"]: hit["redirect"] for hit in hits if "redirect" in hit}
+        if redirects:
+            result["redirects"] = redirects
+        return result
+
+
+class ScanResultCache:
+    """On-disk cache of scanner results keyed by tool, target, arguments and wordlist contents.
+    
+    Each entry is a JSON file in cache_dir; entries older than ttl_seconds are treated
+    as misses and removed.
+    """
+    
+    def __init__(self, cache_dir: str = "scan_cache", ttl_seconds: int = 24 * 60 * 60):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._wordlist_hashes: Dict[Tuple[str, float, int], str] = {}
+    
+    def _wordlist_hash(self, wordlist: str) -> str:
+        """Hash a wordlist's contents, memoized on path, mtime and size."""
+        stat = os.stat(wordlist)
+        memo_key = (os.path.abspath(wordlist), stat.st_mtime, stat.st_size)
+        if memo_key not in self._wordlist_hashes:
+            digest = hashlib.sha256()
+            with open(wordlist, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            self._wordlist_hashes[memo_key] = digest.hexdigest()
+        return self._wordlist_hashes[memo_key]
+    
+    def make_key(self, tool: str, target: str, arguments: List[str], wordlist: Optional[str] = None) -> str:
+        """Build the cache key for a scan."""
+        wordlist_hash = self._wordlist_hash(wordlist) if wordlist and os.path.exists(wordlist) else ""
+        signature = json.dumps([tool, target, arguments, wordlist_hash])
+        return hashlib.sha256(signature.encode('utf-8')).hexdigest()
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+    
+    def get(self, key: str) -> Optional[Dict]:
+        """Return the cached result for key, or None on a miss or expired entry."""
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            entry = None
+        
+        if entry is not None and time.time() - entry["created_at"] > self.ttl_seconds:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            entry = None
+        
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        metrics.inc("audit_cache_requests_total", cache="scan", result="miss" if entry is None else "hit")
+        return entry["result"] if entry is not None else None
+    
+    def set(self, key: str, tool: str, target: str, result: Dict) -> None:
+        """Store a scan result, replacing the file atomically."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"created_at": time.time(), "tool": tool, "target": target, "result": result}, f)
+        os.replace(tmp_path, path)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and the hit rate."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+# Shared scan result cache used by all scanners unless one is passed explicitly
+scan_cache = ScanResultCache(
+    cache_dir=os.environ.get("SCAN_CACHE_DIR", "scan_cache"),
+    ttl_seconds=int(os.environ.get("SCAN_CACHE_TTL", 24 * 60 * 60))
+)
+
+
+# Per-host rate limiting
+HOST_RATE_LIMIT = float(os.environ.get("HOST_RATE_LIMIT", 100))  # Initial requests per second per host
+HOST_RATE_MIN = float(os.environ.get("HOST_RATE_MIN", 5))
+HOST_RATE_MAX = float(os.environ.get("HOST_RATE_MAX", 1000))
+HOST_RATE_INCREASE = 10.0  # Added to a host's rate after a clean scan
+HOST_RATE_DECREASE = 0.5  # Factor applied to a host's rate after a failed or timed out scan
+HOST_SHARE_WINDOW_SECONDS = 60  # How long a host's peak number of concurrent scans is remembered
+REQUESTS_PER_THREAD = 10.0  # Request rate one scanner thread is expected to sustain
+
+
+def _threads_for_rate(rate: float, max_threads: int) -> int:
+    """Number of scanner threads needed to reach a request rate."""
+    return max(1, min(max_threads, int(-(-rate // REQUESTS_PER_THREAD))))
+
+
+class HostRateLimiter:
+    """Adaptive request budget per host, shared by every web scanner.
+    
+    Each host has a request rate that grows additively after clean scans and is
+    halved after errors and timeouts (AIMD). Scans running against a host at the same
+    time divide its rate between them, and each scanner derives its thread and rate
+    flags from its share. A failure also blocks the host for a backoff that doubles
+    with every consecutive failure, so retries from all scanners wait for the host
+    to recover instead of burning their attempts. Shares are sized for as many scans
+    as the host had at once in the last HOST_SHARE_WINDOW_SECONDS, so the first scan of a wave
+    does not take the whole budget.
+    """
+    
+    def __init__(self, initial_rate: float = HOST_RATE_LIMIT, min_rate: float = HOST_RATE_MIN,
+                 max_rate: float = HOST_RATE_MAX):
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self._hosts: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+    
+    def _host(self, host: str) -> Dict[str, float]:
+        if host not in self._hosts:
+            self._hosts[host] = {"rate": self.initial_rate, "allocated": 0.0, "active": 0, "peak": 0,
+                                 "peak_at": 0.0, "failures": 0, "blocked_until": 0.0}
+        return self._hosts[host]
+    
+    @staticmethod
+    def backoff_seconds(failures: int) -> float:
+        return min(RETRY_BACKOFF_SECONDS * 2 ** max(0, failures - 1), MAX_RETRY_BACKOFF_SECONDS)
+    
+    async def acquire(self, host: str) -> float:
+        """Wait until the host is not backing off, then reserve and return a share of its rate."""
+        while True:
+            with self._lock:
+                state = self._host(host)
+                now = time.time()
+                wait = state["blocked_until"] - now
+                if wait <= 0:
+                    # Expect as many concurrent scans as the host had recently
+                    state["active"] += 1
+                    if state["active"] >= state["peak"] or now - state["peak_at"] > HOST_SHARE_WINDOW_SECONDS:
+                        state["peak"], state["peak_at"] = state["active"], now
+                    share = max(min(state["rate"] / state["peak"], state["rate"] - state["allocated"]), self.min_rate)
+                    state["allocated"] += share
+                    return share
+            logger.info(f"Host {host} is backing off, waiting {wait:.1f}s")
+            await asyncio.sleep(wait)
+    
+    def release(self, host: str, share: float, success: bool) -> None:
+        """Return a share and adapt the host's rate to the outcome of the scan."""
+        with self._lock:
+            state = self._host(host)
+            state["active"] -= 1
+            state["allocated"] = max(0.0, state["allocated"] - share)
+            if success:
+                state["failures"] = 0
+                state["rate"] = min(self.max_rate, state["rate"] + HOST_RATE_INCREASE)
+            else:
+                state["failures"] += 1
+                state["rate"] = max(self.min_rate, state["rate"] * HOST_RATE_DECREASE)
+                state["blocked_until"] = max(state["blocked_until"],
+                                             time.time() + self.backoff_seconds(state["failures"]))
+                logger.warning(f"Lowered request rate for {host} to {state['rate']:.0f}/s "
+                               f"after {state['failures']} consecutive failures")
+    
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {host: {"rate": state["rate"], "active": state["active"], "failures": state["failures"]}
+                    for host, state in self._hosts.items()}
+
+
+def _rate_limit_host(target: str) -> str:
+    """Reduce a normalized target to the host whose request budget it uses."""
+    host = target.split('/', 1)[0]
+    name, _, port = host.rpartition(':')
+    return name if name and port.isdigit() else host
+
+
+# Shared by all scanners so that tools hitting the same host share its budget
+host_limiter = HostRateLimiter()
 
 
 class SecurityScanner:
     """Base class for all security scanning operations."""
     
-    def __init__(self, timeout_seconds: int = 300, retry_attempts: int = 3):
+    # Upper bound for a single line of tool output kept by the stream reader
+    STREAM_LINE_LIMIT = 1024 * 1024
+    
+    def __init__(self, timeout_seconds: int = 300, retry_attempts: int = 3, kill_grace_seconds: int = 5,
+                 cache: Optional[ScanResultCache] = None, use_cache: bool = True, refresh: bool = False):
         self.timeout_seconds = timeout_seconds
         self.retry_attempts = retry_attempts
+        self.kill_grace_seconds = kill_grace_seconds
+        self.cache = cache if cache is not None else scan_cache
+        self.use_cache = use_cache
+        self.refresh = refresh  # Skip cache lookups but still store fresh results
     
-    def execute_command(self, command: List[str], target: str, target_scope: TargetScope) -> Tuple[str, bool]:
-        """Execute a shell command with proper timeout and error handling."""
-        # Normalize and validate target
-        normalized_target = target_scope._normalize_domain(target)
-        if not target_scope.is_target_allowed(normalized_target):
-            error_msg = f"Target {target} is outside the allowed scope {target_scope.allowed_domains}. Operation terminated."
-            logger.error(error_msg)
-            return error_msg, False
+    @staticmethod
+    def _scope_error(target: str, target_scope: TargetScope) -> Optional[Dict]:
+        """Error result for a target outside the scope, or None when it may be scanned."""
+        if target_scope.is_target_allowed(target_scope._normalize_domain(target)):
+            return None
+        error_msg = f"Target {target} is outside the allowed scope {target_scope.allowed_domains}. Operation terminated."
+        logger.error(error_msg)
+        return {"error": error_msg}
+    
+    def cached_scan(self, tool: str, target: str, command: List[str], run_scan: Callable[[], Dict],
+                    target_scope: TargetScope, wordlist: Optional[str] = None) -> Dict:
+        """Return a cached result for this exact scan, or run it and cache a successful result.
+        
+        The scope is checked first, so a result cached under a wider scope is never
+        returned for a target the current scope excludes.
+        """
+        scope_error = self._scope_error(target, target_scope)
+        if scope_error is not None:
+            return scope_error
+        if not self.use_cache:
+            return run_scan()
+        
+        key = self.cache.make_key(tool, target, command, wordlist)
+        if not self.refresh:
+            cached = self.cache.get(key)
+            if cached is not None:
+                logger.info(f"Using cached {tool} result for {target}")
+                return cached
+        
+        result = run_scan()
+        if "error" not in result:
+            self.cache.set(key, tool, target, result)
+        return result
+    
+    def execute_command(self, command: List[str], target: Union[str, List[str]], target_scope: TargetScope,
+                        parser: Optional[StreamParser] = None, keep_output: bool = True,
+                        rate_flags: Optional[Callable[[float], List[str]]] = None) -> Tuple[str, bool]:
+        """Execute a shell command with proper timeout and error handling.
+        
+        Blocking wrapper around execute_command_async; it must not be called from
+        a thread that is already running an event loop.
+        """
+        return asyncio.run(self.execute_command_async(command, target, target_scope, parser, keep_output,
+                                                      rate_flags))
+    
+    async def execute_command_async(self, command: List[str], target: Union[str, List[str]],
+                                    target_scope: TargetScope, parser: Optional[StreamParser] = None,
+                                    keep_output: bool = True,
+                                    rate_flags: Optional[Callable[[float], List[str]]] = None) -> Tuple[str, bool]:
+        """Execute a command, streaming stdout line by line into the optional parser.
+        
+        target may be a list for commands that scan several targets; every one of them
+        must be in scope. With rate_flags, each attempt takes a share of the target
+        host's request budget from host_limiter and appends the flags rate_flags builds
+        for it; retries then wait for the host's backoff. Otherwise retries back off
+        exponentially. Waiting never blocks a thread. With keep_output=False stdout is
+        only passed to the parser and an empty string is returned on success.
+        """
+        # Normalize and validate targets
+        targets = [target] if isinstance(target, str) else target
+        normalized_targets = [target_scope._normalize_domain(t) for t in targets]
+        for original_target, normalized_target in zip(targets, normalized_targets):
+            if not target_scope.is_target_allowed(normalized_target):
+                error_msg = f"Target {original_target} is outside the allowed scope {target_scope.allowed_domains}. Operation terminated."
+                logger.error(error_msg)
+                return error_msg, False
+        
+        logger.info(f"Executing command for validated target {', '.join(normalized_targets)}: {' '.join(command)}")
         
-        logger.info(f"Executing command for validated target {normalized_target}: {' '.join(command)}")
+        host = _rate_limit_host(normalized_targets[0]) if rate_flags is not None and len(targets) == 1 else None
         
         for attempt in range(self.retry_attempts):
+            if parser is not None:
+                parser.reset()
+            attempt_command = command
+            share = None
+            if host is not None:
+                share = await host_limiter.acquire(host)
+                attempt_command = command + rate_flags(share)
+            
+            failure = "cancelled"
             try:
-                process = Popen(command, stdout=PIPE, stderr=PIPE)
-                stdout, stderr = process.communicate(timeout=self.timeout_seconds)
-                
-                if process.returncode != 0:
-                    error_msg = stderr.decode('utf-8', errors='replace')
-                    logger.warning(f"Command failed (attempt {attempt+1}/{self.retry_attempts}): {error_msg}")
-                    if attempt == self.retry_attempts - 1:
-                        return f"Command failed after {self.retry_attempts} attempts: {error_msg}", False
-                    time.sleep(2 * (attempt + 1))  # Exponential backoff
-                    continue
+                returncode, output, error_output = await self._run_process(attempt_command, parser, keep_output)
+                if returncode == 0:
+                    failure = None
+                else:
+                    logger.warning(f"Command failed (attempt {attempt+1}/{self.retry_attempts}): {error_output}")
+                    failure = f"Command failed after {self.retry_attempts} attempts: {error_output}"
                 
-                output = stdout.decode('utf-8', errors='replace')
-                return output, True
-                
-            except TimeoutExpired:
-                process.kill()
+            except asyncio.TimeoutError:
                 logger.warning(f"Command timed out after {self.timeout_seconds}s (attempt {attempt+1}/{self.retry_attempts})")
-                if attempt == self.retry_attempts - 1:
-                    return f"Command timed out after {self.retry_attempts} attempts", False
-                time.sleep(2 * (attempt + 1))  # Exponential backoff
+                failure = f"Command timed out after {self.retry_attempts} attempts"
                 
             except Exception as e:
                 logger.error(f"Error executing command: {e}")
-                if attempt == self.retry_attempts - 1:
-                    return f"Error executing command: {str(e)}", False
-                time.sleep(2 * (attempt + 1))  # Exponential backoff
+                failure = f"Error executing command: {str(e)}"
+            
+            finally:
+                if share is not None:
+                    host_limiter.release(host, share, success=failure is None)
+            
+            if failure is None:
+                return output, True
+            if attempt == self.retry_attempts - 1:
+                return failure, False
+            if share is None:
+                # Rate limited commands wait for the host's backoff when acquiring their next share
+                await asyncio.sleep(HostRateLimiter.backoff_seconds(attempt + 1))
         
         return "All retry attempts failed", False
+    
+    async def _run_process(self, command: List[str], parser: Optional[StreamParser],
+                           keep_output: bool) -> Tuple[int, str, str]:
+        """Run one attempt of a command and return its exit code, stdout and stderr."""
+        started = time.monotonic()
+        cpu_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=self.STREAM_LINE_LIMIT,
+            start_new_session=True  # Own process group, so child processes are stopped too
+        )
+        stdout_lines = []
+        
+        async def read_stdout():
+            async for raw_line in process.stdout:
+                line = raw_line.decode('utf-8', errors='replace')
+                if parser is not None:
+                    parser.feed(line)
+                if keep_output:
+                    stdout_lines.append(line)
+        
+        try:
+            _, stderr, _ = await asyncio.wait_for(
+                asyncio.gather(read_stdout(), process.stderr.read(), process.wait()),
+                timeout=self.timeout_seconds
+            )
+        except BaseException:
+            # Timeout or cancellation: stop the process and reap it
+            await self._terminate_process(process)
+            raise
+        finally:
+            self._record_process_metrics(command[0], started, cpu_before)
+        
+        return process.returncode, "".join(stdout_lines), stderr.decode('utf-8', errors='replace')
+    
+    @staticmethod
+    def _record_process_metrics(tool: str, started: float, cpu_before: resource.struct_rusage) -> None:
+        """Record wall time and, from the children rusage delta, CPU time of a finished process."""
+        cpu_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu_seconds = (cpu_after.ru_utime - cpu_before.ru_utime) + (cpu_after.ru_stime - cpu_before.ru_stime)
+        tool = os.path.basename(tool)
+        metrics.observe("audit_tool_wall_seconds", time.monotonic() - started, tool=tool)
+        metrics.inc("audit_tool_cpu_seconds_total", cpu_seconds, tool=tool)
+    
+    async def _terminate_process(self, process: asyncio.subprocess.Process) -> None:
+        """Terminate a running process group, escalating to SIGKILL, and wait for it to exit."""
+        if process.returncode is not None:
+            return
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+            await asyncio.wait_for(process.wait(), timeout=self.kill_grace_seconds)
+        except asyncio.TimeoutError:
+            os.killpg(process.pid, signal.SIGKILL)
+            await process.wait()
+        except ProcessLookupError:
+            # The process exited between the check and the signal
+            await process.wait()
 
 
 class NmapScanner(SecurityScanner):
-    """Tool for running Nmap scans."""
+    """Tool for running Nmap scans.
+    
+    Nmap writes XML to stdout, which is parsed as it streams in; the normal-format
+    report is still written to a file. Raw output is only kept in the result when
+    keep_raw_output is set (NMAP_KEEP_RAW_OUTPUT=1).
+    """
+    
+    def __init__(self, *args, keep_raw_output: Optional[bool] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if keep_raw_output is None:
+            keep_raw_output = os.environ.get("NMAP_KEEP_RAW_OUTPUT", "0") == "1"
+        self.keep_raw_output = keep_raw_output
+    
+    def _command(self, target: str, scan_type: str) -> List[str]:
+        return ["nmap", scan_type, "-oN", f"nmap_{target.replace('/', '_')}.txt", "-oX", "-", target]
     
     def scan(self, target: str, target_scope: TargetScope, scan_type: str = "-sV") -> Dict:
         """Run an Nmap scan with the specified options."""
-        command = ["nmap", scan_type, "-oN", f"nmap_{target.replace('/', '_')}.txt", target]
-        output, success = self.execute_command(command, target, target_scope)
+        command = self._command(target, scan_type)
+        return self.cached_scan("nmap", target, command, lambda: self._run_scan(command, target, target_scope),
+                                target_scope)
+    
+    def _run_scan(self, command: List[str], target: str, target_scope: TargetScope) -> Dict:
+        parser = NmapXmlParser()
+        output, success = self.execute_command(command, target, target_scope, parser=parser,
+                                               keep_output=self.keep_raw_output)
         
         if not success:
             return {"error": f"Nmap scan failed: {output}"}
         
-        # Extract useful information
-        open_ports = re.findall(r"(\d+/\w+)\s+open\s+(\w+)", output)
-        services = {}
-        for port_info, service in open_ports:
-            port = port_info.split('/')[0]
-            services[port] = service
-        
         result = {
             "target": target,
-            "open_ports": services,
-            "raw_output": output
+            "open_ports": parser.open_ports(),
+            "hosts": parser.hosts
         }
+        if self.keep_raw_output:
+            result["raw_output"] = output
         
         return result
+    
+    def scan_batch(self, targets: List[str], target_scope: TargetScope, scan_type: str = "-sV") -> Dict[str, Dict]:
+        """Scan several targets with one nmap invocation and split the results per target.
+        
+        Each target's result has the same shape as scan() and is cached under the same
+        key, so batched and single scans share cache entries.
+        """
+        results: Dict[str, Dict] = {}
+        cache_keys: Dict[str, str] = {}
+        pending = []
+        
+        for target in targets:
+            scope_error = self._scope_error(target, target_scope)
+            if scope_error is not None:
+                results[target] = scope_error
+                continue
+            if self.use_cache:
+                cache_keys[target] = self.cache.make_key("nmap", target, self._command(target, scan_type))
+                if not self.refresh:
+                    cached = self.cache.get(cache_keys[target])
+                    if cached is not None:
+                        logger.info(f"Using cached nmap result for {target}")
+                        results[target] = cached
+                        continue
+            pending.append(target)
+        
+        if not pending:
+            return results
+        
+        with tempfile.NamedTemporaryFile('w', prefix='nmap_targets_', suffix='.txt', delete=False) as f:
+            f.write("\n".join(pending) + "\n")
+            targets_file = f.name
+        batch_id = hashlib.sha256("\n".join(pending).encode('utf-8')).hexdigest()[:12]
+        command = ["nmap", scan_type, "-oN", f"nmap_batch_{batch_id}.txt", "-oX", "-", "-iL", targets_file]
+        
+        parser = NmapXmlParser()
+        try:
+            output, success = self.execute_command(command, pending, target_scope, parser=parser,
+                                                   keep_output=False)
+        finally:
+            os.remove(targets_file)
+        
+        if not success:
+            for target in pending:
+                results[target] = {"error": f"Nmap scan failed: {output}"}
+            return results
+        
+        # Match host records to requested targets by address or hostname
+        hosts_by_name: Dict[str, Dict] = {}
+        for host in parser.hosts:
+            for name in [host["address"]] + host.get("hostnames", []):
+                if name:
+                    hosts_by_name[name.lower()] = host
+        
+        for target in pending:
+            host = hosts_by_name.get(target.lower())
+            if host is None:
+                # Nmap already ran host discovery for it in this batch and found it down;
+                # this is what a scan of the target on its own would have returned
+                logger.info(f"No host record for {target} in batched nmap scan, recording it as down")
+                result = {"target": target, "open_ports": {}, "hosts": [], "status": "down"}
+            else:
+                result = {
+                    "target": target,
+                    "open_ports": {
+                        str(port["port"]): port.get("service", "unknown")
+                        for port in host["ports"] if port["state"] == "open"
+                    },
+                    "hosts": [host]
+                }
+            results[target] = result
+            if self.use_cache:
+                self.cache.set(cache_keys[target], "nmap", target, result)
+        
+        return results
+
+
+# Wordlists
+DEFAULT_WORDLIST = os.environ.get(
+    "AUDIT_WORDLIST", os.path.join(os.path.dirname(os.path.abspath(__file__)), "wordlist.txt")
+)
+
+
+class CompiledWordlist:
+    """A normalized, deduplicated wordlist, memory-mapped from the wordlist store.
+    
+    Entries are stored newline-separated in <id>.lst, with the byte offset of every
+    entry in <id>.idx, so a range of entries is a single slice of the mapped file.
+    """
+    
+    def __init__(self, wordlist_id: str, data_path: str, index_path: str):
+        self.id = wordlist_id
+        self.path = data_path
+        self._data = self._map(data_path)
+        self._index = self._map(index_path)
+        self.offsets = memoryview(self._index).cast('I') if self._index else memoryview(array('I', [0]))
+    
+    @staticmethod
+    def _map(path: str) -> Union[mmap.mmap, bytes]:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+    
+    def entries(self, start: int, end: int) -> bytes:
+        """Return entries start to end (exclusive) as newline-terminated bytes."""
+        return self._data[self.offsets[start]:self.offsets[end]]
+
+
+class WordlistStore:
+    """Compiles wordlists into a shared store and hands out per-task selections of them.
+    
+    Compiling strips blank lines, comments and leading slashes and drops duplicate
+    entries; the result is content-addressed, so every scanner and process shares one
+    copy. Selections (ranges of entries, minus paths already found) are written once
+    to selections/ and reused.
+    """
+    
+    def __init__(self, store_dir: str = "wordlists"):
+        self.store_dir = store_dir
+        self._compiled: Dict[Tuple[str, float, int], CompiledWordlist] = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _normalize(source: str) -> bytes:
+        seen = set()
+        entries = []
+        with open(source, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                entry = line.strip().lstrip('/')
+                if entry and not entry.startswith('#') and entry not in seen:
+                    seen.add(entry)
+                    entries.append(entry)
+        return "".join(f"{entry}\n" for entry in entries).encode('utf-8')
+    
+    def compile(self, source: str) -> CompiledWordlist:
+        """Return the compiled form of a wordlist file, compiling it on first use."""
+        stat = os.stat(source)
+        memo_key = (os.path.abspath(source), stat.st_mtime, stat.st_size)
+        with self._lock:
+            if memo_key in self._compiled:
+                return self._compiled[memo_key]
+            
+            data = self._normalize(source)
+            wordlist_id = hashlib.sha256(data).hexdigest()[:16]
+            data_path = os.path.join(self.store_dir, f"{wordlist_id}.lst")
+            index_path = os.path.join(self.store_dir, f"{wordlist_id}.idx")
+            if not (os.path.exists(data_path) and os.path.exists(index_path)):
+                offsets = array('I', [0])
+                offsets.extend(match.end() for match in re.finditer(b"\n", data))
+                os.makedirs(self.store_dir, exist_ok=True)
+                self._write_atomic(data_path, data)
+                self._write_atomic(index_path, offsets.tobytes())
+            
+            wordlist = CompiledWordlist(wordlist_id, data_path, index_path)
+            self._compiled[memo_key] = wordlist
+            logger.info(f"Wordlist {source}: {len(wordlist)} unique entries (id {wordlist_id})")
+            return wordlist
+    
+    @staticmethod
+    def _write_atomic(path: str, data: bytes) -> None:
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    
+    def select(self, wordlist: CompiledWordlist, ranges: List[List[int]],
+               exclude: Optional[set] = None) -> Optional[str]:
+        """Write the entries in ranges, minus those in exclude, to a wordlist file and return its path.
+        
+        Returns None when nothing is left to try. Selecting every entry with nothing
+        excluded returns the compiled wordlist itself.
+        """
+        exclude = {entry.encode('utf-8') for entry in exclude or ()}
+        if not exclude and ranges == [[0, len(wordlist)]]:
+            return wordlist.path if len(wordlist) else None
+        
+        selection_key = json.dumps([ranges, sorted(entry.decode('utf-8') for entry in exclude)])
+        selection_id = hashlib.sha256(selection_key.encode('utf-8')).hexdigest()[:16]
+        path = os.path.join(self.store_dir, "selections", f"{wordlist.id}_{selection_id}.txt")
+        if os.path.exists(path):
+            return path
+        
+        chunks = [wordlist.entries(start, end) for start, end in ranges]
+        if exclude:
+            chunks = [b"".join(entry + b"\n" for entry in chunk.split(b"\n") if entry and entry not in exclude)
+                      for chunk in chunks]
+        data = b"".join(chunks)
+        if not data:
+            return None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._write_atomic(path, data)
+        return path
+
+
+def _subtract_ranges(total: int, claimed: List[List[int]]) -> List[List[int]]:
+    """Return the ranges of [0, total) not covered by the sorted, disjoint claimed ranges."""
+    free = []
+    position = 0
+    for start, end in claimed:
+        if start > position:
+            free.append([position, start])
+        position = max(position, end)
+    if position < total:
+        free.append([position, total])
+    return free
+
+
+def _merge_ranges(ranges: List[List[int]]) -> List[List[int]]:
+    """Sort ranges and merge those that touch or overlap."""
+    merged: List[List[int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _split_ranges(ranges: List[List[int]], parts: int) -> List[List[List[int]]]:
+    """Split ranges into parts consecutive pieces holding (almost) the same number of entries."""
+    total = sum(end - start for start, end in ranges)
+    pieces: List[List[List[int]]] = [[] for _ in range(parts)]
+    bounds = [total * (part + 1) // parts for part in range(parts)]
+    part, consumed = 0, 0
+    for start, end in ranges:
+        while start < end:
+            take = min(end - start, bounds[part] - consumed)
+            if take > 0:
+                pieces[part].append([start, start + take])
+                start += take
+                consumed += take
+            if consumed >= bounds[part] and part < parts - 1:
+                part += 1
+    return pieces
+
+
+wordlist_store = WordlistStore(os.environ.get("WORDLIST_STORE_DIR", "wordlists"))
 
 
 class GobusterScanner(SecurityScanner):
     """Tool for running directory discovery with Gobuster."""
     
-    def scan(self, target: str, target_scope: TargetScope, wordlist: str = "/Users/deekshaagrawal/TGBH_CheeseBurger/intelligence/app/wordlist.txt") -> Dict:
+    def scan(self, target: str, target_scope: TargetScope, wordlist: str = DEFAULT_WORDLIST) -> Dict:
         """Run Gobuster directory scan."""
         if not target.startswith(('http://', 'https://')):
             target = f"http://{target}"
             
         command = ["gobuster", "dir", "-u", target, "-w", wordlist, "-o", f"gobuster_{target.replace('://', '_').replace('/', '_')}.txt"]
-        output, success = self.execute_command(command, target, target_scope)
+        return self.cached_scan("gobuster", target, command,
+                                lambda: self._run_scan(command, target, target_scope), target_scope,
+                                wordlist=wordlist)
+    
+    @staticmethod
+    def _rate_flags(rate: float) -> List[str]:
+        """Threads and per-thread delay that keep gobuster at rate requests per second."""
+        threads = _threads_for_rate(rate, 50)
+        return ["-t", str(threads), "--delay", f"{int(1000 * threads / rate)}ms"]
+    
+    def _run_scan(self, command: List[str], target: str, target_scope: TargetScope) -> Dict:
+        output, success = self.execute_command(command, target, target_scope, rate_flags=self._rate_flags)
         
         if not success:
             return {"error": f"Gobuster scan failed: {output}"}
@@ -215,47 +1237,64 @@ class GobusterScanner(SecurityScanner):
         return result
 
 
+def _parse_int_set(value: str) -> Optional[set]:
+    """Parse a comma-separated list of integers and ranges such as "200-299,301" into a set."""
+    if not value:
+        return None
+    numbers = set()
+    for part in value.split(','):
+        low, _, high = part.strip().partition('-')
+        numbers.update(range(int(low), int(high or low) + 1))
+    return numbers
+
+
 class FfufScanner(SecurityScanner):
-    """Tool for fuzzing with ffuf."""
+    """Tool for fuzzing with ffuf.
+    
+    ffuf streams one JSON result per line (-json), which FfufJsonParser turns into
+    compact hits as they arrive; the raw output is never kept. Matching statuses,
+    filtered sizes and the hit cap default to FFUF_MATCH_STATUS, FFUF_FILTER_SIZES
+    and FFUF_MAX_HITS, and the status and size filters are passed on to ffuf itself.
+    """
     
-    def scan(self, target: str, target_scope: TargetScope, wordlist: str = "/Users/deekshaagrawal/TGBH_CheeseBurger/intelligence/app/wordlist.txt") -> Dict:
+    DEFAULT_MATCH_STATUS = "200-299,301,302,307,401,403,405,500"
+    
+    def __init__(self, *args, max_hits: Optional[int] = None, match_status: Optional[str] = None,
+                 filter_sizes: Optional[str] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_hits = max_hits if max_hits is not None else int(os.environ.get("FFUF_MAX_HITS", 500))
+        self.match_status = match_status or os.environ.get("FFUF_MATCH_STATUS", self.DEFAULT_MATCH_STATUS)
+        self.filter_sizes = filter_sizes if filter_sizes is not None else os.environ.get("FFUF_FILTER_SIZES", "")
+    
+    def scan(self, target: str, target_scope: TargetScope, wordlist: str = DEFAULT_WORDLIST) -> Dict:
         """Run ffuf fuzzing."""
         if not target.startswith(('http://', 'https://')):
             target = f"http://{target}"
             
-        command = ["ffuf", "-u", f"{target}/FUZZ", "-w", wordlist, "-o", f"ffuf_{target.replace('://', '_').replace('/', '_')}.json", "-of", "json"]
-        output, success = self.execute_command(command, target, target_scope)
+        command = ["ffuf", "-u", f"{target}/FUZZ", "-w", wordlist, "-json", "-noninteractive", "-mc", self.match_status]
+        if self.filter_sizes:
+            command += ["-fs", self.filter_sizes]
+        return self.cached_scan("ffuf", target, command,
+                                lambda: self._run_scan(command, target, target_scope), target_scope,
+                                wordlist=wordlist)
+    
+    @staticmethod
+    def _rate_flags(rate: float) -> List[str]:
+        """Threads and request rate limit for ffuf."""
+        return ["-t", str(_threads_for_rate(rate, 40)), "-rate", str(max(1, int(rate)))]
+    
+    def _run_scan(self, command: List[str], target: str, target_scope: TargetScope) -> Dict:
+        parser = FfufJsonParser(target, max_hits=self.max_hits, match_status=_parse_int_set(self.match_status),
+                                filter_sizes=_parse_int_set(self.filter_sizes))
+        output, success = self.execute_command(command, target, target_scope, parser=parser, keep_output=False,
+                                               rate_flags=self._rate_flags)
         
         if not success:
             return {"error": f"FFUF scan failed: {output}"}
         
-        # Try to read the JSON output file
-        try:
-            json_file = f"ffuf_{target.replace('://', '_').replace('/', '_')}.json"
-            if os.path.exists(json_file):
-                with open(json_file, 'r') as f:
-                    ffuf_results = json.load(f)
-                    
-                    result = {
-                        "target": target,
-                        "discovered_endpoints": [item.get('input', {}).get('FUZZ') for item in ffuf_results.get('results', [])],
-                        "status_codes": {item.get('input', {}).get('FUZZ'): item.get('status') for item in ffuf_results.get('results', [])}
-                    }
-                    
-                    return result
-        except Exception as e:
-            logger.error(f"Error processing ffuf results: {e}")
-            
-        # Fallback to parsing console output
-        endpoints = re.findall(r"| (\w+)\s+\|\s+\d+", output)
-        
-        result = {
-            "target": target,
-            "discovered_endpoints": endpoints,
-            "raw_output": output
-        }
-        
-        return result
+        if parser.truncated:
+            logger.warning(f"ffuf on {target} returned more than {self.max_hits} hits, keeping the first {self.max_hits}")
+        return {"target": target, **parser.result()}
 
 
 class SqlmapScanner(SecurityScanner):
@@ -267,7 +1306,17 @@ class SqlmapScanner(SecurityScanner):
             target = f"http://{target}"
             
         command = ["sqlmap", "-u", target, "--batch", "--output-dir=sqlmap_results"]
-        output, success = self.execute_command(command, target, target_scope)
+        return self.cached_scan("sqlmap", target, command, lambda: self._run_scan(command, target, target_scope),
+                                target_scope)
+    
+    @staticmethod
+    def _rate_flags(rate: float) -> List[str]:
+        """Threads (sqlmap allows at most 10) and per-request delay for sqlmap."""
+        threads = _threads_for_rate(rate, 10)
+        return ["--threads", str(threads), "--delay", f"{threads / rate:.2f}"]
+    
+    def _run_scan(self, command: List[str], target: str, target_scope: TargetScope) -> Dict:
+        output, success = self.execute_command(command, target, target_scope, rate_flags=self._rate_flags)
         
         if not success:
             return {"error": f"SQLMap scan failed: {output}"}
@@ -284,6 +1333,638 @@ class SqlmapScanner(SecurityScanner):
         return result
 
 
+# Task scheduling
+MAX_TASK_RETRIES = 3
+NMAP_BATCH_SIZE = 256  # Maximum number of targets merged into one nmap invocation
+RETRY_BACKOFF_SECONDS = 2
+MAX_RETRY_BACKOFF_SECONDS = 60
+
+
+class TaskScheduler:
+    """Priority queues of pending tasks, stored directly in the audit state.
+    
+    Ready tasks wait in state['task_queue'], which maps each lane to a heap of
+    [priority, seq, signature, task] entries. A lane is a task type, with batchable
+    nmap scans split by flags, so callers choose among lanes by looking only at the
+    head of each heap. Tasks backing off after a failure wait in state['task_delayed'],
+    a heap of [ready_at, priority, seq, signature, task] entries ordered by ready time,
+    and move to their lane once ready. state['task_index'] maps the signature of every
+    queued task for constant-time deduplication and state['task_retries'] counts
+    retries per signature. Everything is plain lists and dicts, so the state stays
+    serializable; constructing a scheduler over a state is O(1).
+    """
+    
+    def __init__(self, state: SecurityAuditState, target_scope: TargetScope):
+        self.state = state
+        self.target_scope = target_scope
+        state.setdefault('task_queue', {})
+        state.setdefault('task_delayed', [])
+        state.setdefault('task_index', {})
+        state.setdefault('task_retries', {})
+        state.setdefault('task_seq', 0)
+        if isinstance(state['task_queue'], list):
+            # Checkpoint from before lanes: one heap of [priority, seq, ready_at, signature, task]
+            entries = state['task_queue']
+            state['task_queue'] = {}
+            for priority, seq, ready_at, task_signature, task in entries:
+                self._insert(priority, seq, ready_at, task_signature, task)
+    
+    def __len__(self) -> int:
+        return len(self.state['task_index'])
+    
+    def __contains__(self, task_signature: str) -> bool:
+        return task_signature in self.state['task_index']
+    
+    def lane(self, task: Dict) -> str:
+        """Queue of a task: its type, plus the flags of nmap scans that can be batched."""
+        if task['task_type'] == 'nmap_scan' and _batchable_nmap_task(task, self.target_scope):
+            return f"nmap_scan {task.get('scan_type', '-sV')}"
+        return task['task_type']
+    
+    def push(self, task: Dict, ready_at: float = 0.0) -> bool:
+        """Queue a task unless it was already executed or is already queued."""
+        task_signature = _task_signature(task, self.target_scope)
+        if task_signature in self.state['seen_tasks'] or task_signature in self.state['task_index']:
+            return False
+        
+        self._push_entry(task_signature, task, ready_at)
+        return True
+    
+    def _push_entry(self, task_signature: str, task: Dict, ready_at: float) -> None:
+        try:
+            priority = int(task.get('priority', 3))
+        except (TypeError, ValueError):
+            priority = 3
+        
+        seq = self.state['task_seq']
+        self.state['task_seq'] = seq + 1
+        self._insert(priority, seq, ready_at, task_signature, task)
+    
+    def _insert(self, priority: int, seq: int, ready_at: float, task_signature: str, task: Dict) -> None:
+        if ready_at > 0:
+            heapq.heappush(self.state['task_delayed'], [ready_at, priority, seq, task_signature, task])
+        else:
+            heapq.heappush(self.state['task_queue'].setdefault(self.lane(task), []),
+                           [priority, seq, task_signature, task])
+        self.state['task_index'][task_signature] = seq
+    
+    def _promote(self, now: float) -> None:
+        """Move tasks whose backoff has expired to their lanes."""
+        delayed = self.state['task_delayed']
+        while delayed and delayed[0][0] <= now:
+            _, priority, seq, task_signature, task = heapq.heappop(delayed)
+            heapq.heappush(self.state['task_queue'].setdefault(self.lane(task), []),
+                           [priority, seq, task_signature, task])
+    
+    def pop_ready(self, accept: Optional[Callable[[Dict], bool]] = None,
+                  now: Optional[float] = None) -> Optional[Tuple[str, Dict]]:
+        """Pop the highest-priority ready task whose lane is accepted, or None.
+        
+        accept is asked about the head task of each lane and must only depend on what
+        the lane fixes (the task type, and flags for batchable nmap scans). Tasks of
+        rejected lanes and tasks still backing off are not touched.
+        """
+        self._promote(time.time() if now is None else now)
+        best = None
+        for lane, heap in self.state['task_queue'].items():
+            if heap and (best is None or heap[0][:2] < best[1][0][:2]) and (accept is None or accept(heap[0][3])):
+                best = (lane, heap)
+        if best is None:
+            return None
+        return self._pop(*best)
+    
+    def pop_lane(self, lane: str, limit: int, now: Optional[float] = None) -> List[Tuple[str, Dict]]:
+        """Pop up to limit ready tasks of one lane in priority order."""
+        self._promote(time.time() if now is None else now)
+        heap = self.state['task_queue'].get(lane, [])
+        return [self._pop(lane, heap) for _ in range(min(limit, len(heap)))]
+    
+    def _pop(self, lane: str, heap: List) -> Tuple[str, Dict]:
+        _, _, task_signature, task = heapq.heappop(heap)
+        if not heap:
+            del self.state['task_queue'][lane]
+        del self.state['task_index'][task_signature]
+        return task_signature, task
+    
+    def next_ready_at(self) -> Optional[float]:
+        """Return the earliest time at which a queued task becomes ready."""
+        if any(self.state['task_queue'].values()):
+            return 0.0
+        if not self.state['task_delayed']:
+            return None
+        return self.state['task_delayed'][0][0]
+    
+    def drop_seen(self) -> int:
+        """Remove queued tasks whose signatures were already executed; return how many were removed."""
+        seen = self.state['seen_tasks']
+        removed = 0
+        for lane, heap in list(self.state['task_queue'].items()):
+            pending = [entry for entry in heap if entry[2] not in seen]
+            removed += len(heap) - len(pending)
+            if not pending:
+                del self.state['task_queue'][lane]
+            elif len(pending) < len(heap):
+                heapq.heapify(pending)
+                self.state['task_queue'][lane] = pending
+        delayed = self.state['task_delayed']
+        pending = [entry for entry in delayed if entry[3] not in seen]
+        removed += len(delayed) - len(pending)
+        if len(pending) < len(delayed):
+            heapq.heapify(pending)
+            self.state['task_delayed'] = pending
+        if removed:
+            self.state['task_index'] = {signature: seq for signature, seq in self.state['task_index'].items()
+                                        if signature not in seen}
+        return removed
+    
+    def retry(self, task_signature: str, task: Dict) -> bool:
+        """Requeue a failed task with exponential backoff; return False once retries are exhausted."""
+        retries = self.state['task_retries'].get(task_signature, 0)
+        if retries >= MAX_TASK_RETRIES or task_signature in self.state['task_index']:
+            return False
+        
+        self.state['task_retries'][task_signature] = retries + 1
+        backoff = min(RETRY_BACKOFF_SECONDS * 2 ** retries, MAX_RETRY_BACKOFF_SECONDS)
+        self._push_entry(task_signature, task, time.time() + backoff)
+        logger.info(f"Retrying {task_signature} in {backoff}s (retry {retries + 1}/{MAX_TASK_RETRIES})")
+        return True
+
+
+# LLM clients and response caching
+DEFAULT_LLM_MODEL = "gpt-4o-mini"
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic offline chat model.
+    
+    The responder receives the text of the prompt and returns the reply; by default
+    every prompt is answered with an empty JSON list.
+    """
+    
+    responder: Callable[[str], str] = lambda prompt: "[]"
+    model_name: str = "fake"
+    
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+    
+    @staticmethod
+    def _usage(prompt_text: str, reply: str) -> Dict[str, int]:
+        """Approximate token usage at about four characters per token."""
+        input_tokens, output_tokens = len(prompt_text) // 4, len(reply) // 4
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens}
+    
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        prompt_text = "\n".join(str(message.content) for message in messages)
+        reply = self.responder(prompt_text)
+        message = AIMessage(content=reply, usage_metadata=self._usage(prompt_text, reply))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+    
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        prompt_text = "\n".join(str(message.content) for message in messages)
+        reply = self.responder(prompt_text)
+        for word in re.split(r'(?<=\s)', reply):
+            if word:
+                yield ChatGenerationChunk(message=AIMessageChunk(content=word))
+        # Like OpenAI with stream_usage, report token usage in a final empty chunk
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(prompt_text, reply)))
+
+
+class LLMClientPool:
+    """Shared chat model clients, one per backend, model and temperature.
+    
+    Reusing a client keeps its HTTP connection pool warm across audit steps.
+    The "fake" backend returns FakeChatModel instances for offline runs.
+    """
+    
+    def __init__(self, backend: str = "openai", fake_responder: Optional[Callable[[str], str]] = None):
+        self.backend = backend
+        self.fake_responder = fake_responder
+        self._clients: Dict[Tuple[str, str, float], BaseChatModel] = {}
+        self._lock = threading.Lock()
+    
+    def configure(self, backend: str, fake_responder: Optional[Callable[[str], str]] = None) -> None:
+        """Switch backend and drop the existing clients."""
+        with self._lock:
+            self.backend = backend
+            self.fake_responder = fake_responder
+            self._clients = {}
+    
+    def get(self, model: str = DEFAULT_LLM_MODEL, temperature: float = 0) -> BaseChatModel:
+        """Return the shared client for model and temperature, creating it on first use."""
+        key = (self.backend, model, temperature)
+        with self._lock:
+            if key not in self._clients:
+                if self.backend == "fake":
+                    client = FakeChatModel(model_name=model)
+                    if self.fake_responder is not None:
+                        client.responder = self.fake_responder
+                else:
+                    load_dotenv()
+                    api_key = os.environ.get("OPENAI_API_KEY", "")
+                    client = ChatOpenAI(temperature=temperature, model=model, api_key=api_key, stream_usage=True)
+                self._clients[key] = client
+            return self._clients[key]
+
+
+class LLMResponseCache(ABC):
+    """Base class for content-addressed LLM response caches."""
+    
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+    
+    @abstractmethod
+    def _lookup(self, key: str) -> Optional[str]:
+        """Return the stored response for key, or None."""
+    
+    @abstractmethod
+    def _store(self, key: str, model: str, response: str) -> None:
+        """Store the response for key."""
+    
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for key, counting the hit or miss."""
+        response = self._lookup(key)
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        metrics.inc("audit_cache_requests_total", cache="llm", result="miss" if response is None else "hit")
+        return response
+    
+    def set(self, key: str, model: str, response: str) -> None:
+        """Store the response for key."""
+        self._store(key, model, response)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and the hit rate."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+class InMemoryLRUCache(LLMResponseCache):
+    """LLM response cache kept in process memory, evicting least recently used entries."""
+    
+    def __init__(self, max_entries: int = 1024):
+        super().__init__()
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, str] = OrderedDict()
+    
+    def _lookup(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+    
+    def _store(self, key: str, model: str, response: str) -> None:
+        with self._lock:
+            self._entries[key] = response
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteLLMCache(LLMResponseCache):
+    """LLM response cache persisted in a SQLite database."""
+    
+    def __init__(self, db_path: str = "llm_cache.sqlite"):
+        super().__init__()
+        self.db_path = db_path
+        self._connection: Optional[sqlite3.Connection] = None
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database on first use, so importing this module creates no file; callers hold _lock."""
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS llm_responses ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT, created_at REAL)"
+            )
+            self._connection.commit()
+        return self._connection
+    
+    def _lookup(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT response FROM llm_responses WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+    
+    def _store(self, key: str, model: str, response: str) -> None:
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO llm_responses (key, model, response, created_at) VALUES (?, ?, ?, ?)",
+                (key, model, response, time.time())
+            )
+            self._connection.commit()
+
+
+def create_llm_cache(backend: str) -> Optional[LLMResponseCache]:
+    """Create the LLM response cache for a backend name: memory, sqlite or none."""
+    if backend == "memory":
+        return InMemoryLRUCache(int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 1024)))
+    if backend == "sqlite":
+        return SQLiteLLMCache(os.environ.get("LLM_CACHE_PATH", "llm_cache.sqlite"))
+    if backend == "none":
+        return None
+    raise ValueError(f"Unknown LLM cache backend: {backend}")
+
+
+llm_pool = LLMClientPool(os.environ.get("LLM_BACKEND", "openai"))
+llm_cache = create_llm_cache(os.environ.get("LLM_CACHE_BACKEND", "memory"))
+
+# Stands in for the scan target in cache keys so identical results on different hosts share an entry
+TARGET_PLACEHOLDER = "__AUDIT_TARGET__"
+
+
+def _replace_target(text: str, target: str, replacement: str) -> str:
+    """Replace whole occurrences of target (not parts of longer hosts or addresses) in text."""
+    return re.sub(rf"(?<![\w.-]){re.escape(target)}(?![\w-]|\.\w)", replacement, text)
+
+
+def _llm_cache_key(prompt_text: str, model: str, temperature: float, results: Any = None) -> str:
+    results_hash = hashlib.sha256(json.dumps(results, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return hashlib.sha256(json.dumps([llm_pool.backend, model, temperature, prompt_text, results_hash]).encode('utf-8')).hexdigest()
+
+
+def _record_llm_metrics(model: str, duration: float, usage: Optional[Dict[str, int]]) -> None:
+    """Record the latency and, when the client reports it, the token usage of one LLM request."""
+    metrics.observe("audit_llm_request_duration_seconds", duration, model=model)
+    if usage:
+        metrics.inc("audit_llm_tokens_total", usage.get("input_tokens", 0), model=model, type="input")
+        metrics.inc("audit_llm_tokens_total", usage.get("output_tokens", 0), model=model, type="output")
+
+
+def invoke_llm(prompt: Any, model: str = DEFAULT_LLM_MODEL, temperature: float = 0,
+               results: Any = None, target: Optional[str] = None) -> str:
+    """Invoke the shared LLM client, memoizing the response.
+    
+    The cache key covers the model, the prompt and a hash of the scan results. When
+    target is given it is masked out of the key, so the same results seen on another
+    host reuse the cached response with the target substituted back in.
+    """
+    prompt_text = prompt.to_string() if hasattr(prompt, "to_string") else str(prompt)
+    if target:
+        prompt_text = _replace_target(prompt_text, target, TARGET_PLACEHOLDER)
+        results = json.loads(_replace_target(json.dumps(results, default=str), target, TARGET_PLACEHOLDER))
+    key = _llm_cache_key(prompt_text, model, temperature, results)
+    
+    if llm_cache is not None:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            logger.info(f"Using cached {model} response")
+            return cached.replace(TARGET_PLACEHOLDER, target) if target else cached
+    
+    started = time.monotonic()
+    response = llm_pool.get(model, temperature).invoke(prompt)
+    _record_llm_metrics(model, time.monotonic() - started, response.usage_metadata)
+    content = response.content
+    
+    if llm_cache is not None:
+        llm_cache.set(key, model, _replace_target(content, target, TARGET_PLACEHOLDER) if target else content)
+    return content
+
+
+def stream_llm(prompt: Any, model: str = DEFAULT_LLM_MODEL, temperature: float = 0,
+               results: Any = None) -> Iterator[str]:
+    """Stream the LLM response chunk by chunk, caching the complete response.
+    
+    A cached response is yielded as a single chunk.
+    """
+    prompt_text = prompt.to_string() if hasattr(prompt, "to_string") else str(prompt)
+    key = _llm_cache_key(prompt_text, model, temperature, results)
+    
+    if llm_cache is not None:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            logger.info(f"Using cached {model} response")
+            yield cached
+            return
+    
+    chunks = []
+    usage = None
+    started = time.monotonic()
+    for chunk in llm_pool.get(model, temperature).stream(prompt):
+        if chunk.usage_metadata:
+            usage = chunk.usage_metadata
+        if chunk.content:
+            chunks.append(chunk.content)
+            yield chunk.content
+    _record_llm_metrics(model, time.monotonic() - started, usage)
+    
+    if llm_cache is not None:
+        llm_cache.set(key, model, "".join(chunks))
+
+
+# Audit checkpointing
+# Node that runs after each checkpointed node when an audit is resumed
+RESUME_NEXT_NODE = {
+    "initialize_audit": "execute_task",
+    "execute_task": "analyze_results",
+    "generate_report": END
+}
+
+
+class AuditCheckpointStore:
+    """Persists the audit state after every workflow node so interrupted audits can resume.
+    
+    Only the latest checkpoint of each audit is kept; the state is stored as JSON
+    together with the name of the node that produced it.
+    """
+    
+    def __init__(self, db_path: str = "audit_checkpoints.sqlite"):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database on first use, so importing this module creates no file; callers hold _lock."""
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS audit_checkpoints ("
+                "audit_id TEXT PRIMARY KEY, node TEXT, step INTEGER, state TEXT, updated_at REAL)"
+            )
+            self._connection.commit()
+        return self._connection
+    
+    def save(self, audit_id: str, node: str, state: SecurityAuditState) -> None:
+        """Replace the checkpoint of an audit with the state produced by node."""
+        payload = json.dumps({key: value for key, value in state.items() if key != 'remaining_steps'})
+        with self._lock:
+            self._connect().execute(
+                "INSERT INTO audit_checkpoints (audit_id, node, step, state, updated_at) VALUES (?, ?, 1, ?, ?) "
+                "ON CONFLICT(audit_id) DO UPDATE SET node = excluded.node, step = step + 1, "
+                "state = excluded.state, updated_at = excluded.updated_at",
+                (audit_id, node, payload, time.time())
+            )
+            self._connection.commit()
+    
+    def load(self, audit_id: str) -> Optional[SecurityAuditState]:
+        """Return the last checkpointed state of an audit, or None if there is none."""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT state FROM audit_checkpoints WHERE audit_id = ?", (audit_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def delete(self, audit_id: str) -> None:
+        with self._lock:
+            self._connect().execute("DELETE FROM audit_checkpoints WHERE audit_id = ?", (audit_id,))
+            self._connection.commit()
+    
+    def list_audits(self) -> List[Dict[str, Any]]:
+        """List checkpointed audits with their last node, step count and update time."""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT audit_id, node, step, updated_at FROM audit_checkpoints ORDER BY updated_at DESC"
+            ).fetchall()
+        return [{"audit_id": audit_id, "node": node, "step": step, "updated_at": updated_at}
+                for audit_id, node, step, updated_at in rows]
+
+
+checkpoint_store = AuditCheckpointStore(os.environ.get("AUDIT_CHECKPOINT_PATH", "audit_checkpoints.sqlite"))
+
+
+# Audit task log
+TASKS_LOG_DIR = os.environ.get("TASKS_LOG_DIR", "tasks_logs")
+# The log is flushed on every event but only fsynced every TASK_LOG_FSYNC_EVENTS
+# events or TASK_LOG_FSYNC_SECONDS seconds, whichever comes first
+TASK_LOG_FSYNC_EVENTS = 32
+TASK_LOG_FSYNC_SECONDS = 1.0
+
+
+class TaskEventLog:
+    """Append-only JSON Lines log of the task events of one audit.
+    
+    Every audit writes to its own tasks_logs/audit_<audit_id>.jsonl file through a
+    handle that stays open for the whole audit, so logging an event costs one
+    appended line regardless of how large the audit has grown. Use for_audit to get
+    the shared handle of an audit and read_task_tree to rebuild its task tree.
+    """
+    
+    _open_logs: Dict[str, 'TaskEventLog'] = {}
+    _open_logs_lock = threading.Lock()
+    
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+    
+    @staticmethod
+    def path_for(audit_id: str) -> str:
+        return os.path.join(TASKS_LOG_DIR, f"audit_{audit_id}.jsonl")
+    
+    @classmethod
+    def for_audit(cls, audit_id: str) -> 'TaskEventLog':
+        """Return the open log of an audit, opening it for appending if needed."""
+        with cls._open_logs_lock:
+            task_log = cls._open_logs.get(audit_id)
+            if task_log is None:
+                task_log = cls(cls.path_for(audit_id))
+                cls._open_logs[audit_id] = task_log
+            return task_log
+    
+    @classmethod
+    def close_audit(cls, audit_id: str) -> None:
+        with cls._open_logs_lock:
+            task_log = cls._open_logs.pop(audit_id, None)
+        if task_log is not None:
+            task_log.close()
+    
+    def append(self, event: str, **data: Any) -> None:
+        """Append one event to the log."""
+        line = json.dumps({"event": event, "timestamp": time.time(), **data}) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._unsynced += 1
+            if (self._unsynced >= TASK_LOG_FSYNC_EVENTS
+                    or time.monotonic() - self._last_sync >= TASK_LOG_FSYNC_SECONDS):
+                self._sync()
+    
+    def _sync(self) -> None:
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+    
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+
+def read_task_events(path: str) -> Iterator[Dict]:
+    """Yield the events of a task log, ignoring a partially written last line."""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping truncated task log line in {path}")
+
+
+def read_task_tree(path: str) -> Dict:
+    """Rebuild the task tree of an audit from its task log.
+    
+    Returns the objective and scope of the audit and a list of root tasks; every
+    task carries its status, attempts and the follow-up tasks it produced as children.
+    """
+    tree = {"audit_id": None, "objective": None, "target_scope": None, "finished": False, "tasks": []}
+    nodes = {}
+    
+    for event in read_task_events(path):
+        if event['event'] == 'audit_started':
+            tree.update(audit_id=event['audit_id'], objective=event['objective'],
+                        target_scope=event['target_scope'])
+        elif event['event'] == 'tasks_queued':
+            for entry in event['tasks']:
+                node = {"signature": entry['signature'], "task": entry['task'], "status": "queued",
+                        "attempts": 0, "children": []}
+                nodes[entry['signature']] = node
+                parent = nodes.get(entry.get('parent'))
+                (parent['children'] if parent else tree['tasks']).append(node)
+        elif event['event'] == 'task_finished':
+            node = nodes.get(event['signature'])
+            if node is not None:
+                node['attempts'] += 1
+                node['execution_time'] = event['execution_time']
+                if event['success']:
+                    node['status'] = "completed"
+                else:
+                    node['status'] = "retrying" if event['retrying'] else "failed"
+        elif event['event'] == 'audit_finished':
+            tree['finished'] = True
+    
+    return tree
+
+
+def _log_queued_tasks(state: SecurityAuditState, tasks: List[Dict], target_scope: TargetScope) -> None:
+    """Log newly queued tasks, linking follow-ups to the task that produced them."""
+    entries = []
+    for task in tasks:
+        source = task.get('source_task')
+        parent = f"{source['type']}:{target_scope._normalize_domain(source['target'])}" if source else None
+        entries.append({"signature": _task_signature(task, target_scope), "parent": parent, "task": task})
+    if entries:
+        TaskEventLog.for_audit(state['audit_id']).append("tasks_queued", tasks=entries)
+
+
 # LangGraph Node Functions
 def initialize_audit(state: SecurityAuditState) -> SecurityAuditState:
     """Initialize the security audit with objective and scope."""
@@ -315,11 +1996,6 @@ def initialize_audit(state: SecurityAuditState) -> SecurityAuditState:
         return state
     
 
-    # Set up LLM
-    load_dotenv()
-    api_key = os.environ.get("OPENAI_API_KEY", "")
-    llm = ChatOpenAI(temperature=0, model="gpt-4o-mini", api_key=api_key)
-    
     # Create initial task plan
     prompt = ChatPromptTemplate.from_messages([
         ("system", """You are a cybersecurity expert tasked with breaking down security testing objectives into specific executable tasks.
@@ -333,7 +2009,7 @@ def initialize_audit(state: SecurityAuditState) -> SecurityAuditState:
         ("human", "{objective}\n\nTarget scope: {allowed_targets}")
     ])
     allowed_targets=", ".join(target_scope.allowed_domains + [str(ip) for ip in target_scope.allowed_ip_ranges])
-    response = llm.invoke(
+    response = invoke_llm(
         prompt.format(
             objective=state['objective'],
             allowed_targets=allowed_targets)
@@ -342,109 +2018,203 @@ def initialize_audit(state: SecurityAuditState) -> SecurityAuditState:
     print("Allowed Targets : ",allowed_targets)
     
     # Extract JSON from the response
-    task_list_str = re.search(r'```json\n(.*?)\n```', response.content, re.DOTALL)
-    if task_list_str:
-        task_list = json.loads(task_list_str.group(1))
-    else:
-        # Try to find JSON without code block
-        task_list_str = re.search(r'\[\s*\{.*\}\s*\]', response.content, re.DOTALL)
-        if task_list_str:
-            task_list = json.loads(task_list_str.group(0))
-        else:
-            logger.error(f"Could not parse task list from: {response.content}")
-            task_list = []
+    task_list = _parse_task_list(response, "task list")
     
     # Sort tasks by priority
     task_list.sort(key=lambda x: x.get('priority', 3))
-    tasks_log_dir = 'tasks_logs'
-    os.makedirs(tasks_log_dir, exist_ok=True)
-    timestamp = time.strftime("%Y%m%d_%H%M%S")
-    tasks_log_path = os.path.join(tasks_log_dir, f"initial_tasks_{timestamp}.json")
-    
-    with open(tasks_log_path, 'w') as f:
-        json.dump({
-            "timestamp": timestamp,
-            "objective": state['objective'],
-            "target_scope": state['target_scope'],
-            "tasks": task_list
-        }, f, indent=2)
+    task_log = TaskEventLog.for_audit(state['audit_id'])
+    task_log.append("audit_started", audit_id=state['audit_id'], objective=state['objective'],
+                    target_scope=state['target_scope'])
     
     # Update state
-    state['task_queue'] = task_list
+    state['task_queue'] = {}
+    state['task_delayed'] = []
+    state['task_index'] = {}
+    state['task_retries'] = {}
+    state['task_seq'] = 0
+    scheduler = TaskScheduler(state, target_scope)
+    queued_tasks = [task for task in task_list if scheduler.push(task)]
+    _log_queued_tasks(state, queued_tasks, target_scope)
     state['completed_tasks'] = []
     state['results'] = {}
+    state['analyzed_count'] = 0
     
-    logger.info(f"Initial task plan created with {len(state['task_queue'])} tasks")
+    logger.info(f"Initial task plan created with {len(state['task_index'])} tasks")
     return state
 
 
-def execute_next_task(state: SecurityAuditState) -> SecurityAuditState:
-    """Execute the next task in the queue."""
-    if not state['task_queue']:
-        logger.info("No tasks remaining in queue")
-        return state
-    
-    # Get the next task
-    task = state['task_queue'].pop(0)
-    task_target = task['target']
-    
-    # Create target scope
-    target_scope = TargetScope.from_dict(state['target_scope'])
-    
-    # Normalize the target
-    normalized_target = target_scope._normalize_domain(task_target)
-    task_signature = f"{task['task_type']}:{normalized_target}"
+def _task_signature(task: Dict, target_scope: TargetScope) -> str:
+    """Build the deduplication signature of a task from its type and normalized target."""
+    return f"{task['task_type']}:{target_scope._normalize_domain(task['target'])}"
+
+
+# Task types that brute-force paths from the shared wordlist
+WORDLIST_TASK_TYPES = ("gobuster_scan", "ffuf_scan")
+
+
+def _discovered_paths(state: SecurityAuditState, target: str) -> set:
+    """Return the paths already discovered on a target by earlier directory scans."""
+    paths = set()
+    for task_type, field in (("gobuster_scan", "discovered_directories"), ("ffuf_scan", "discovered_endpoints")):
+        task_result = state['results'].get(f"{task_type}:{target}")
+        if task_result and task_result['success']:
+            paths.update(path for path in task_result['result'].get(field, []) if path)
+    return paths
+
+
+def _assign_wordlists(state: SecurityAuditState, jobs: List[List[Tuple[str, Dict]]],
+                      target_scope: TargetScope) -> Dict[str, Dict]:
+    """Give each directory scan in jobs the wordlist entries nobody has tried on its target yet.
     
-    # Check if task has already been executed
-    if task_signature in state['seen_tasks']:
-        logger.info(f"Task {task_signature} already executed, skipping")
-        return state
+    Entries already tried on a target (claimed in state['wordlist_claims']) and paths
+    already discovered there are left out; when several scans of the same target run
+    in this step, the remaining entries are split between them.
+    """
+    signatures_by_target: Dict[str, List[str]] = {}
+    for job in jobs:
+        for task_signature, task in job:
+            if task['task_type'] in WORDLIST_TASK_TYPES:
+                target = target_scope._normalize_domain(task['target'])
+                signatures_by_target.setdefault(target, []).append(task_signature)
+    if not signatures_by_target:
+        return {}
     
-    logger.info(f"Executing task: {task_signature}")
+    try:
+        wordlist = wordlist_store.compile(DEFAULT_WORDLIST)
+    except OSError as e:
+        # Only the directory scans fail; the other tasks of the step run as usual
+        logger.error(f"Could not load wordlist {DEFAULT_WORDLIST}: {str(e)}")
+        return {task_signature: {"error": f"Could not load wordlist {DEFAULT_WORDLIST}: {str(e)}"}
+                for signatures in signatures_by_target.values() for task_signature in signatures}
     
-    # Execute the task
-    result = None
-    success = False
-    start_time = time.time()
+    claims = state.setdefault('wordlist_claims', {})
+    assignments = {}
+    for target, signatures in signatures_by_target.items():
+        free = _subtract_ranges(len(wordlist), claims.get(target, {}).get(wordlist.id, []))
+        exclude = _discovered_paths(state, target)
+        for task_signature, ranges in zip(signatures, _split_ranges(free, len(signatures))):
+            assignments[task_signature] = {
+                "wordlist_id": wordlist.id,
+                "ranges": ranges,
+                "path": wordlist_store.select(wordlist, ranges, exclude)
+            }
+    return assignments
+
+
+def _run_task(task: Dict, target_scope: TargetScope, refresh: bool = False,
+              wordlist_assignment: Optional[Dict] = None) -> Tuple[Dict, bool]:
+    """Run a single task with the matching scanner and return its result and success flag.
     
+    With refresh=True cached scan results are ignored and replaced. Directory scans
+    use the wordlist selection in wordlist_assignment when one is given, are skipped
+    when that selection is empty and fail when the wordlist could not be loaded.
+    """
+    normalized_target = target_scope._normalize_domain(task['target'])
+    wordlist = DEFAULT_WORDLIST
+    if wordlist_assignment is not None and task['task_type'] in WORDLIST_TASK_TYPES:
+        if 'error' in wordlist_assignment:
+            return {"target": normalized_target, "error": wordlist_assignment['error']}, False
+        if wordlist_assignment['path'] is None:
+            logger.info(f"Every wordlist entry was already tried on {normalized_target}, skipping {task['task_type']}")
+            field = "discovered_directories" if task['task_type'] == 'gobuster_scan' else "discovered_endpoints"
+            return {"target": normalized_target, field: [], "skipped": "wordlist already tried on this target"}, True
+        wordlist = wordlist_assignment['path']
     try:
         if task['task_type'] == 'nmap_scan':
-            scanner = NmapScanner()
-            result = scanner.scan(normalized_target, target_scope)
-            success = "error" not in result
+            scanner = NmapScanner(refresh=refresh)
+            result = scanner.scan(normalized_target, target_scope, scan_type=task.get('scan_type', '-sV'))
             
         elif task['task_type'] == 'gobuster_scan':
-            scanner = GobusterScanner()
-            result = scanner.scan(normalized_target, target_scope)
-            success = "error" not in result
+            scanner = GobusterScanner(refresh=refresh)
+            result = scanner.scan(normalized_target, target_scope, wordlist=wordlist)
             
         elif task['task_type'] == 'ffuf_scan':
-            scanner = FfufScanner()
-            result = scanner.scan(normalized_target, target_scope)
-            success = "error" not in result
+            scanner = FfufScanner(refresh=refresh)
+            result = scanner.scan(normalized_target, target_scope, wordlist=wordlist)
             
         elif task['task_type'] == 'sqlmap_scan':
-            scanner = SqlmapScanner()
+            scanner = SqlmapScanner(refresh=refresh)
             result = scanner.scan(normalized_target, target_scope)
-            success = "error" not in result
             
         else:
             logger.warning(f"Unknown task type: {task['task_type']}")
-            result = {"error": f"Unknown task type: {task['task_type']}"}
-            success = False
+            return {"error": f"Unknown task type: {task['task_type']}"}, False
             
     except Exception as e:
         logger.error(f"Error executing {task['task_type']} on {normalized_target}: {str(e)}")
-        result = {"error": str(e)}
-        success = False
+        return {"error": str(e)}, False
     
-    execution_time = time.time() - start_time
+    return result, "error" not in result
+
+
+def _batchable_nmap_task(task: Dict, target_scope: TargetScope) -> bool:
+    """Whether an nmap task can share a batched scan.
+    
+    Only single in-scope hosts qualify: an out-of-scope target would fail the whole
+    batch, and CIDR blocks or ranges cannot be matched back to one host record.
+    """
+    target = target_scope._normalize_domain(task['target'])
+    if not target_scope.is_target_allowed(target):
+        return False
+    try:
+        ipaddress.ip_address(target)
+        return True
+    except ValueError:
+        # A plain hostname; IP ranges like 10.0.0.1-5 have no letters
+        return re.fullmatch(r"(?=.*[A-Za-z])[A-Za-z0-9.-]+", target) is not None
+
+
+def _pop_nmap_batch(scheduler: TaskScheduler, task: Dict) -> List[Tuple[str, Dict]]:
+    """Pop further ready batchable nmap tasks that use the same flags as task, up to NMAP_BATCH_SIZE in total."""
+    return scheduler.pop_lane(scheduler.lane(task), NMAP_BATCH_SIZE - 1)
+
+
+def _run_job(job: List[Tuple[str, Dict]], target_scope: TargetScope, refresh: bool = False,
+             wordlist_assignments: Optional[Dict[str, Dict]] = None) -> List[Tuple[Dict, bool]]:
+    """Run a job of one task, or of several nmap tasks merged into one batched scan."""
+    if len(job) == 1:
+        return [_run_task(job[0][1], target_scope, refresh=refresh,
+                          wordlist_assignment=(wordlist_assignments or {}).get(job[0][0]))]
+    
+    targets = [target_scope._normalize_domain(task['target']) for _, task in job]
+    try:
+        scanner = NmapScanner(refresh=refresh)
+        results = scanner.scan_batch(targets, target_scope, scan_type=job[0][1].get('scan_type', '-sV'))
+    except Exception as e:
+        logger.error(f"Error executing batched nmap scan on {len(targets)} targets: {str(e)}")
+        return [({"error": str(e)}, False) for _ in job]
+    
+    return [(results[target], "error" not in results[target]) for target in targets]
+
+
+def _next_job(scheduler: TaskScheduler, accept: Optional[Callable[[Dict], bool]] = None) -> Optional[List[Tuple[str, Dict]]]:
+    """Pop the next ready task, merged with other pending nmap tasks that use the same flags."""
+    next_task = scheduler.pop_ready(accept=accept)
+    if next_task is None:
+        return None
+    job = [next_task]
+    if next_task[1]['task_type'] == 'nmap_scan' and _batchable_nmap_task(next_task[1], scheduler.target_scope):
+        job.extend(_pop_nmap_batch(scheduler, next_task[1]))
+    return job
+
+
+def _record_task_result(state: SecurityAuditState, scheduler: TaskScheduler, task: Dict, task_signature: str,
+                        result: Dict, success: bool, execution_time: float,
+                        wordlist_assignment: Optional[Dict] = None) -> None:
+    """Merge the outcome of an executed task back into the audit state."""
     logger.info(f"Task completed in {execution_time:.2f}s: {task_signature}, success: {success}")
     
     # Only mark task as seen after successful execution
     if success:
         state['seen_tasks'][task_signature] = True
         
+        # The wordlist entries this scan tried are not handed out for its target again
+        if wordlist_assignment is not None:
+            target = task_signature.split(':', 1)[1]
+            target_claims = state.setdefault('wordlist_claims', {}).setdefault(target, {})
+            wordlist_id = wordlist_assignment['wordlist_id']
+            target_claims[wordlist_id] = _merge_ranges(target_claims.get(wordlist_id, []) + wordlist_assignment['ranges'])
+        
         # Record result
         task_result = {
             "task": task,
@@ -457,70 +2227,155 @@ def execute_next_task(state: SecurityAuditState) -> SecurityAuditState:
         # Add to completed tasks and store result
         state['completed_tasks'].append(task)
         state['results'][task_signature] = task_result
-    else:
-        # If task failed, we might want to retry it later
-        state['task_queue'].append(task)
+    elif not scheduler.retry(task_signature, task):
+        # Retries exhausted: keep the failure and stop the task from being queued again
+        logger.error(f"Task {task_signature} failed after {MAX_TASK_RETRIES} retries, giving up")
+        state['seen_tasks'][task_signature] = False
+        state['results'][task_signature] = {
+            "task": task,
+            "result": result,
+            "success": False,
+            "execution_time": execution_time,
+            "timestamp": time.time()
+        }
     
-    return state
+    TaskEventLog.for_audit(state['audit_id']).append(
+        "task_finished", signature=task_signature, success=success, execution_time=execution_time,
+        retrying=not success and task_signature in scheduler
+    )
 
 
-def analyze_results(state: SecurityAuditState) -> SecurityAuditState:
-    """Analyze the results of completed tasks and generate follow-up tasks."""
-    if not state['completed_tasks']:
+def execute_next_task(state: SecurityAuditState) -> SecurityAuditState:
+    """Execute the next task in the queue."""
+    if not state['task_index']:
+        logger.info("No tasks remaining in queue")
         return state
     
-    # Get the most recently completed task
-    last_task = state['completed_tasks'][-1]
-    task_signature = f"{last_task['task_type']}:{last_task['target']}"
-    task_result = state['results'].get(task_signature)
+    # Create target scope
+    target_scope = TargetScope.from_dict(state['target_scope'])
+    scheduler = TaskScheduler(state, target_scope)
     
-    if not task_result or not task_result['success']:
-        # Skip analysis for failed tasks
+    # Get the next task, waiting for a retry backoff to expire if nothing else is ready
+    job = _next_job(scheduler)
+    if job is None:
+        time.sleep(max(0.0, scheduler.next_ready_at() - time.time()))
+        job = _next_job(scheduler)
+    
+    logger.info(f"Executing task: {', '.join(task_signature for task_signature, _ in job)}")
+    
+    wordlist_assignments = _assign_wordlists(state, [job], target_scope)
+    start_time = time.time()
+    outcomes = _run_job(job, target_scope, refresh=state.get('force_refresh', False),
+                        wordlist_assignments=wordlist_assignments)
+    execution_time = time.time() - start_time
+    
+    for (task_signature, task), (result, success) in zip(job, outcomes):
+        _record_task_result(state, scheduler, task, task_signature, result, success, execution_time,
+                            wordlist_assignments.get(task_signature))
+    return state
+
+
+def _select_task_wave(scheduler: TaskScheduler, max_tasks: int,
+                      tool_concurrency: Dict[str, int]) -> List[List[Tuple[str, Dict]]]:
+    """Pop up to max_tasks ready jobs in priority order, respecting the per-tool caps.
+    
+    A job is one task, or several nmap tasks batched into one process. Tasks that do
+    not fit in this wave keep their position in the queue.
+    """
+    wave = []
+    tool_counts: Dict[str, int] = {}
+    
+    def fits(task: Dict) -> bool:
+        return tool_counts.get(task['task_type'], 0) < tool_concurrency.get(task['task_type'], 1)
+    
+    while len(wave) < max_tasks:
+        job = _next_job(scheduler, accept=fits)
+        if job is None:
+            break
+        task_type = job[0][1]['task_type']
+        tool_counts[task_type] = tool_counts.get(task_type, 0) + 1
+        wave.append(job)
+    
+    return wave
+
+
+def execute_task_wave(state: SecurityAuditState, max_parallel_tasks: int = DEFAULT_MAX_PARALLEL_TASKS,
+                      tool_concurrency: Optional[Dict[str, int]] = None) -> SecurityAuditState:
+    """Execute a wave of independent jobs concurrently.
+    
+    Results are merged back in queue order, so the resulting state does not depend
+    on which scan happens to finish first.
+    """
+    if not state['task_index']:
+        logger.info("No tasks remaining in queue")
         return state
     
-    # Set up LLM
-    llm = ChatOpenAI(temperature=0, model="gpt-4o-mini")
+    tool_concurrency = {**DEFAULT_TOOL_CONCURRENCY, **(tool_concurrency or {})}
+    target_scope = TargetScope.from_dict(state['target_scope'])
+    scheduler = TaskScheduler(state, target_scope)
+    wave = _select_task_wave(scheduler, max_parallel_tasks, tool_concurrency)
+    if not wave:
+        # Every queued task is backing off after a failure
+        time.sleep(max(0.0, scheduler.next_ready_at() - time.time()))
+        wave = _select_task_wave(scheduler, max_parallel_tasks, tool_concurrency)
     
-    # Create follow-up tasks
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", """You are a cybersecurity expert analyzing the results of a security scan. 
-        Based on these results, recommend follow-up tasks to further investigate any findings.
-        Return your recommendations as a JSON list of objects with these fields:
-        - task_type: The type of task (nmap_scan, gobuster_scan, ffuf_scan, sqlmap_scan)
-        - target: The specific target to scan (could be a URL, domain, IP, etc.)
-        - description: A brief description of why this follow-up task is needed
-        - priority: A number from 1-5 with 1 being highest priority
-        Focus only on the most promising leads. Quality over quantity.
-        """),
-        ("human", "Scan Type: {scan_type}\nTarget: {target}\nResults: {results}")
-    ])
+    logger.info(f"Executing wave of {len(wave)} jobs: {[[signature for signature, _ in job] for job in wave]}")
     
-    response = llm.invoke(
-        prompt.format(
-            scan_type=last_task['task_type'],
-            target=last_task['target'],
-            results=json.dumps(task_result['result'])
-        )
-    )
+    refresh = state.get('force_refresh', False)
+    # Directory scans of the same target in this wave split the untried wordlist entries
+    wordlist_assignments = _assign_wordlists(state, wave, target_scope)
     
-    # Extract JSON from the response
-    tasks_str = re.search(r'```json\n(.*?)\n```', response.content, re.DOTALL)
+    def timed_run(job: List[Tuple[str, Dict]]) -> Tuple[List[Tuple[Dict, bool]], float]:
+        start_time = time.time()
+        outcomes = _run_job(job, target_scope, refresh=refresh, wordlist_assignments=wordlist_assignments)
+        return outcomes, time.time() - start_time
+    
+    with ThreadPoolExecutor(max_workers=len(wave)) as executor:
+        # Run each job in a copy of the node's context so its metrics count towards this audit
+        futures = [executor.submit(contextvars.copy_context().run, timed_run, job) for job in wave]
+        job_outcomes = [future.result() for future in futures]
+    
+    for job, (outcomes, execution_time) in zip(wave, job_outcomes):
+        for (task_signature, task), (result, success) in zip(job, outcomes):
+            _record_task_result(state, scheduler, task, task_signature, result, success, execution_time,
+                                wordlist_assignments.get(task_signature))
+    
+    return state
+
+
+def _prompt_payload(result: Dict) -> Dict:
+    """Return a scan result without raw tool output, for use in LLM prompts."""
+    return {key: value for key, value in result.items() if key != "raw_output"}
+
+
+# Maximum number of follow-up tasks accepted per analyzed task
+MAX_FOLLOW_UP_TASKS = 5
+
+
+def _parse_task_list(content: str, description: str) -> List[Dict]:
+    """Extract a JSON list of tasks from an LLM response."""
+    tasks_str = re.search(r'```json\n(.*?)\n```', content, re.DOTALL)
     if tasks_str:
-        follow_up_tasks = json.loads(tasks_str.group(1))
-    else:
-        # Try to find JSON without code block
-        tasks_str = re.search(r'\[\s*\{.*\}\s*\]', response.content, re.DOTALL)
-        if tasks_str:
-            follow_up_tasks = json.loads(tasks_str.group(0))
-        else:
-            logger.error(f"Could not parse follow-up tasks from: {response.content}")
-            follow_up_tasks = []
+        return json.loads(tasks_str.group(1))
     
-    # Filter and add follow-up tasks with strict scope validation
+    # Try to find JSON without code block
+    tasks_str = re.search(r'\[\s*\{.*\}\s*\]', content, re.DOTALL)
+    if tasks_str:
+        return json.loads(tasks_str.group(0))
+    
+    logger.error(f"Could not parse {description} from: {content}")
+    return []
+
+
+def _filter_follow_up_tasks(state: SecurityAuditState, follow_up_tasks: List[Dict],
+                            target_scope: TargetScope) -> List[Dict]:
+    """Drop follow-up tasks that were already executed, are queued, repeat each other or are out of scope."""
+    batch_signatures = set()
     filtered_tasks = []
-    target_scope = TargetScope.from_dict(state['target_scope'])
     
     for task in follow_up_tasks:
+        if not task.get('task_type') or not task.get('target'):
+            continue
         task_target = target_scope._normalize_domain(task['target'])
         task_signature = f"{task['task_type']}:{task_target}"
         
@@ -529,11 +2384,8 @@ def analyze_results(state: SecurityAuditState) -> SecurityAuditState:
             logger.info(f"Task {task_signature} already executed successfully, skipping")
             continue
         
-        # Skip if the task is already in the queue
-        if any(t['task_type'] == task['task_type'] and 
-               target_scope._normalize_domain(t['target']) == task_target 
-               for t in state['task_queue']):
-            # logger.info(f"Task {task_signature} already in queue, skipping")
+        # Skip if the task is already in the queue or earlier in this batch
+        if task_signature in state['task_index'] or task_signature in batch_signatures:
             continue
         
         # Strict scope validation
@@ -541,50 +2393,147 @@ def analyze_results(state: SecurityAuditState) -> SecurityAuditState:
             logger.warning(f"Follow-up task for target {task_target} rejected: outside scope {target_scope.allowed_domains}")
             continue
         
+        batch_signatures.add(task_signature)
         filtered_tasks.append(task)
     
-    # Limit number of follow-up tasks to prevent explosion
-    max_follow_up_tasks = 5
-    filtered_tasks = filtered_tasks[:max_follow_up_tasks]
-    
-    # Sort by priority and add to queue
+    return filtered_tasks
+
+
+def _queue_follow_up_tasks(state: SecurityAuditState, filtered_tasks: List[Dict], target_scope: TargetScope) -> None:
+    """Sort follow-up tasks by priority, add them to the queue and log them."""
     filtered_tasks.sort(key=lambda x: x.get('priority', 3))
-    if filtered_tasks:
-        # Find the most recent tasks log file
-            tasks_log_dir = 'tasks_logs'
-            log_files = sorted([f for f in os.listdir(tasks_log_dir) if f.startswith('initial_tasks_')], reverse=True)
-            
-            if log_files:
-                most_recent_log = os.path.join(tasks_log_dir, log_files[0])
-                
-                # Read existing log
-                with open(most_recent_log, 'r') as f:
-                    log_data = json.load(f)
-                
-                # Add follow-up tasks to the log
-                if 'follow_up_tasks' not in log_data:
-                    log_data['follow_up_tasks'] = []
-                
-                # Add timestamp and details to follow-up tasks
-                for task in filtered_tasks:
-                    task['generated_at'] = time.strftime("%Y%m%d_%H%M%S")
-                    task['source_task'] = {
-                        'type': last_task['task_type'],
-                        'target': last_task['target']
-                    }
-                
-                log_data['follow_up_tasks'].extend(filtered_tasks)
-                
-                # Write back to the file
-                with open(most_recent_log, 'w') as f:
-                    json.dump(log_data, f, indent=2)
-                
-                logger.info(f"Follow-up tasks logged to {most_recent_log}")
     
-    
-    state['task_queue'].extend(filtered_tasks)
+    scheduler = TaskScheduler(state, target_scope)
+    queued_tasks = [task for task in filtered_tasks if scheduler.push(task)]
+    _log_queued_tasks(state, queued_tasks, target_scope)
     
     logger.info(f"Added {len(filtered_tasks)} follow-up tasks based on results analysis")
+
+
+def _analyze_task(state: SecurityAuditState, task: Dict, target_scope: TargetScope) -> None:
+    """Ask the LLM for follow-up tasks based on the result of one completed task."""
+    task_signature = _task_signature(task, target_scope)
+    task_result = state['results'].get(task_signature)
+    
+    if not task_result or not task_result['success']:
+        # Skip analysis for failed tasks
+        return
+    
+    # Create follow-up tasks
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", """You are a cybersecurity expert analyzing the results of a security scan. 
+        Based on these results, recommend follow-up tasks to further investigate any findings.
+        Return your recommendations as a JSON list of objects with these fields:
+        - task_type: The type of task (nmap_scan, gobuster_scan, ffuf_scan, sqlmap_scan)
+        - target: The specific target to scan (could be a URL, domain, IP, etc.)
+        - description: A brief description of why this follow-up task is needed
+        - priority: A number from 1-5 with 1 being highest priority
+        Focus only on the most promising leads. Quality over quantity.
+        """),
+        ("human", "Scan Type: {scan_type}\nTarget: {target}\nResults: {results}")
+    ])
+    
+    response = invoke_llm(
+        prompt.format(
+            scan_type=task['task_type'],
+            target=task['target'],
+            results=json.dumps(_prompt_payload(task_result['result']))
+        ),
+        results=_prompt_payload(task_result['result']),
+        target=target_scope._normalize_domain(task['target'])
+    )
+    follow_up_tasks = _parse_task_list(response, "follow-up tasks")
+    
+    # Filter follow-up tasks with strict scope validation and limit them to prevent explosion
+    filtered_tasks = _filter_follow_up_tasks(state, follow_up_tasks, target_scope)[:MAX_FOLLOW_UP_TASKS]
+    
+    # Add timestamp and details to follow-up tasks
+    for follow_up in filtered_tasks:
+        follow_up['generated_at'] = time.strftime("%Y%m%d_%H%M%S")
+        follow_up['source_task'] = {
+            'type': task['task_type'],
+            'target': task['target']
+        }
+    
+    _queue_follow_up_tasks(state, filtered_tasks, target_scope)
+
+
+def _analyze_task_batch(state: SecurityAuditState, tasks: List[Dict], target_scope: TargetScope) -> None:
+    """Ask the LLM for follow-up tasks for a whole batch of completed tasks in a single request."""
+    batch = []
+    for task in tasks:
+        task_signature = _task_signature(task, target_scope)
+        task_result = state['results'].get(task_signature)
+        if task_result and task_result['success']:
+            batch.append((task_signature, task, _prompt_payload(task_result['result'])))
+    
+    if not batch:
+        return
+    
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", """You are a cybersecurity expert analyzing the results of several security scans. 
+        Based on these results, recommend follow-up tasks to further investigate any findings.
+        Return your recommendations as a single JSON list of objects with these fields:
+        - task_type: The type of task (nmap_scan, gobuster_scan, ffuf_scan, sqlmap_scan)
+        - target: The specific target to scan (could be a URL, domain, IP, etc.)
+        - description: A brief description of why this follow-up task is needed
+        - priority: A number from 1-5 with 1 being highest priority
+        - source: The ID of the scan whose results motivated the task
+        Focus only on the most promising leads. Quality over quantity.
+        """),
+        ("human", "Scan results:\n{results}")
+    ])
+    
+    batch_results = {task_signature: result for task_signature, _, result in batch}
+    results_text = "\n---\n".join(
+        f"ID: {task_signature}\nScan Type: {task['task_type']}\nTarget: {task['target']}\nResults: {json.dumps(result)}"
+        for task_signature, task, result in batch
+    )
+    response = invoke_llm(prompt.format(results=results_text), results=batch_results)
+    follow_up_tasks = _parse_task_list(response, "follow-up tasks")
+    
+    # Deduplicate and scope-filter the whole batch in one pass, keeping the per-task limit overall
+    filtered_tasks = _filter_follow_up_tasks(state, follow_up_tasks, target_scope)
+    filtered_tasks = filtered_tasks[:MAX_FOLLOW_UP_TASKS * len(batch)]
+    
+    source_tasks = {task_signature: task for task_signature, task, _ in batch}
+    for follow_up in filtered_tasks:
+        follow_up['generated_at'] = time.strftime("%Y%m%d_%H%M%S")
+        # The LLM may return anything as the source; only a known task id is trusted
+        source_id = follow_up.pop('source', None)
+        source = source_tasks.get(source_id) if isinstance(source_id, str) else None
+        if source is None:
+            source = batch[0][1]
+        follow_up['source_task'] = {
+            'type': source['task_type'],
+            'target': source['target']
+        }
+    
+    logger.info(f"Analyzed {len(batch)} completed tasks in one batch")
+    _queue_follow_up_tasks(state, filtered_tasks, target_scope)
+
+
+def analyze_results(state: SecurityAuditState, batched: bool = False) -> SecurityAuditState:
+    """Analyze the results of newly completed tasks and generate follow-up tasks.
+    
+    With batched=True all tasks completed since the previous analysis are sent to the
+    LLM in a single request instead of one request per task.
+    """
+    analyzed_count = state.get('analyzed_count', 0)
+    new_tasks = state['completed_tasks'][analyzed_count:]
+    if not new_tasks:
+        return state
+    
+    target_scope = TargetScope.from_dict(state['target_scope'])
+    
+    if batched:
+        _analyze_task_batch(state, new_tasks, target_scope)
+    else:
+        # A parallel wave can complete several tasks between two analyses
+        for task in new_tasks:
+            _analyze_task(state, task, target_scope)
+    
+    state['analyzed_count'] = len(state['completed_tasks'])
     return state
 
 
@@ -598,19 +2547,160 @@ def should_continue(state: SecurityAuditState) -> str:
     # Check other termination conditions    
     if state.get("task_complete", False):
         return "generate_report"
-    if not state['task_queue']:
+    if not state['task_index']:
         return "generate_report"
         
     # Continue with next task
     return "execute_task"
 
 
-def generate_report(state: SecurityAuditState) -> SecurityAuditState:
-    """Generate a comprehensive security report based on all findings."""
-    logger.info("Generating security report")
+# Report generation budget: total prompt tokens for the findings, and tokens per finding digest
+REPORT_TOKEN_BUDGET = int(os.environ.get("REPORT_TOKEN_BUDGET", 6000))
+REPORT_DIGEST_TOKENS = int(os.environ.get("REPORT_DIGEST_TOKENS", 300))
+# Number of items listed per finding before the rest are only counted
+DIGEST_LIST_LIMIT = 15
+
+
+def _estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token) used for budgeting."""
+    return len(text) // 4 + 1
+
+
+def _summarize_list(items: List[Any]) -> str:
+    listed = ", ".join(str(item) for item in items[:DIGEST_LIST_LIMIT])
+    if len(items) > DIGEST_LIST_LIMIT:
+        listed += f" (+{len(items) - DIGEST_LIST_LIMIT} more)"
+    return listed
+
+
+def _digest_result(task_signature: str, result: Dict) -> Tuple[int, str]:
+    """Summarize one task result as a short finding digest with a severity rank (0 is most severe)."""
+    if "is_vulnerable" in result:
+        if result["is_vulnerable"]:
+            return 0, f"{task_signature}: sqlmap reports a potential SQL injection on {result.get('target')}"
+        return 3, f"{task_signature}: no SQL injection found on {result.get('target')}"
+    
+    if "hosts" in result or "open_ports" in result:
+        ports = []
+        for host in result.get("hosts", []):
+            for port in host["ports"]:
+                if port["state"] == "open":
+                    service = " ".join(filter(None, [port.get("service"), port.get("product"), port.get("version")]))
+                    ports.append(f"{port['port']}/{port['protocol']} {service}".strip())
+        if not ports:
+            ports = [f"{port}/{service}" for port, service in result.get("open_ports", {}).items()]
+        if not ports:
+            return 3, f"{task_signature}: no open ports found"
+        return 1, f"{task_signature}: open ports {_summarize_list(ports)}"
+    
+    for field in ("discovered_directories", "discovered_endpoints"):
+        if field in result:
+            items = result[field]
+            if not items:
+                return 3, f"{task_signature}: nothing discovered"
+            return 2, f"{task_signature}: discovered {len(items)} paths: {_summarize_list(items)}"
+    
+    return 2, f"{task_signature}: {json.dumps(_prompt_payload(result))}"
+
+
+def _report_digest(state: SecurityAuditState, task_signature: str, result: Dict) -> Dict:
+    """Return the cached digest for a result, building it (map step) if the result changed.
+    
+    Digests still over REPORT_DIGEST_TOKENS are condensed by the LLM.
+    """
+    result_hash = hashlib.sha256(json.dumps(result, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    cached = state['report_digests'].get(task_signature)
+    if cached is not None and cached["result_hash"] == result_hash:
+        return cached
+    
+    severity, digest = _digest_result(task_signature, result)
+    if _estimate_tokens(digest) > REPORT_DIGEST_TOKENS:
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", "Condense this security scan finding into at most {max_words} words. Keep targets, ports, versions and paths that matter for a security report."),
+            ("human", "{finding}")
+        ])
+        digest = f"{task_signature}: " + invoke_llm(
+            prompt.format(max_words=REPORT_DIGEST_TOKENS // 2, finding=digest[:REPORT_DIGEST_TOKENS * 40])
+        )
+    
+    entry = {"task_signature": task_signature, "result_hash": result_hash, "severity": severity, "digest": digest}
+    state['report_digests'][task_signature] = entry
+    return entry
+
+
+def _assemble_findings(digests: List[Dict], token_budget: int) -> str:
+    """Pack digests, most severe first, into the token budget (reduce step)."""
+    ordered = sorted(digests, key=lambda entry: entry["severity"])
+    included, omitted = [], []
+    used = 0
+    for entry in ordered:
+        tokens = _estimate_tokens(entry["digest"])
+        if used + tokens <= token_budget:
+            included.append(entry["digest"])
+            used += tokens
+        else:
+            omitted.append(entry["task_signature"])
+    
+    if omitted:
+        included.append(f"{len(omitted)} lower-priority findings omitted for length: {_summarize_list(omitted)}")
+    return "\n".join(f"- {digest}" for digest in included)
+
+
+def _metrics_summary(state: SecurityAuditState) -> str:
+    """Render the node, tool, LLM, cache and queue metrics of an audit as a Markdown section."""
+    totals = metrics.audit_totals(state['audit_id'])
+    lines = ["## Audit Metrics", ""]
+    
+    node_rows = totals.get("audit_node_duration_seconds", [])
+    tool_rows = totals.get("audit_tool_wall_seconds", [])
+    llm_rows = totals.get("audit_llm_request_duration_seconds", [])
+    scanner_seconds = sum(total for _, total, _ in tool_rows)
+    llm_seconds = sum(total for _, total, _ in llm_rows)
+    lines.append(f"Scanner processes ran for {scanner_seconds:.1f}s and LLM requests took {llm_seconds:.1f}s "
+                 f"(report generation excluded from node timings).")
+    
+    if node_rows:
+        lines += ["", "| Workflow node | Runs | Total (s) | Average (s) |", "|---|---|---|---|"]
+        for labels, total, count in sorted(node_rows, key=lambda row: -row[1]):
+            lines.append(f"| {labels['node']} | {count} | {total:.2f} | {total / count:.2f} |")
+    
+    if tool_rows:
+        cpu = {labels['tool']: total for labels, total, _ in totals.get("audit_tool_cpu_seconds_total", [])}
+        lines += ["", "| Tool | Runs | Wall (s) | CPU (s) |", "|---|---|---|---|"]
+        for labels, total, count in sorted(tool_rows, key=lambda row: -row[1]):
+            lines.append(f"| {labels['tool']} | {count} | {total:.2f} | {cpu.get(labels['tool'], 0.0):.2f} |")
+    
+    if llm_rows:
+        tokens = {(labels['model'], labels['type']): total
+                  for labels, total, _ in totals.get("audit_llm_tokens_total", [])}
+        lines += ["", "| LLM model | Requests | Latency (s) | Input tokens | Output tokens |", "|---|---|---|---|---|"]
+        for labels, total, count in llm_rows:
+            model = labels['model']
+            lines.append(f"| {model} | {count} | {total:.2f} | {int(tokens.get((model, 'input'), 0))} "
+                         f"| {int(tokens.get((model, 'output'), 0))} |")
+    
+    cache_counts: Dict[str, Dict[str, float]] = {}
+    for labels, total, _ in totals.get("audit_cache_requests_total", []):
+        cache_counts.setdefault(labels['cache'], {})[labels['result']] = total
+    if cache_counts:
+        lines += ["", "| Cache | Hits | Misses | Hit rate |", "|---|---|---|---|"]
+        for cache, counts in sorted(cache_counts.items()):
+            hits, misses = int(counts.get('hit', 0)), int(counts.get('miss', 0))
+            lines.append(f"| {cache} | {hits} | {misses} | {hits / (hits + misses):.0%} |")
+    
+    lines += ["", f"Tasks completed: {len(state['completed_tasks'])}, still queued: {len(state['task_index'])}."]
+    return "\n".join(lines) + "\n"
+
+
+def generate_report(state: SecurityAuditState, report_path: str = "security_report.md",
+                    on_report_chunk: Optional[Callable[[str], None]] = None) -> SecurityAuditState:
+    """Generate a comprehensive security report based on all findings.
     
-    # Set up LLM
-    llm = ChatOpenAI(temperature=0, model="gpt-4o-mini")
+    Each successful result is reduced to a cached per-finding digest, the digests are
+    packed into REPORT_TOKEN_BUDGET, and the report is streamed to report_path and to
+    on_report_chunk as the LLM generates it.
+    """
+    logger.info("Generating security report")
     
     # Create report
     prompt = ChatPromptTemplate.from_messages([
@@ -629,45 +2719,114 @@ def generate_report(state: SecurityAuditState) -> SecurityAuditState:
     ])
     
     # Prepare results for the report
-    results_summary = []
-    for task_signature, result in state['results'].items():
-        if result['success']:
-            results_summary.append(f"Task: {task_signature}\nSuccess: {result['success']}\nResult: {json.dumps(result['result'])}\n")
-    
-    response = llm.invoke(
-        prompt.format(
-            objective=state['objective'],
-            results="\n---\n".join(results_summary)
-        )
-    )
+    state.setdefault('report_digests', {})
+    digests = [
+        _report_digest(state, task_signature, result['result'])
+        for task_signature, result in state['results'].items() if result['success']
+    ]
+    findings = _assemble_findings(digests, REPORT_TOKEN_BUDGET)
     
-    # Save report to file
-    report_path = f"security_report.md"
+    # Stream the report to file and caller, followed by the metrics of this audit
+    report_chunks = []
     with open(report_path, 'w') as f:
-        f.write(response.content)
+        def emit(chunk: str) -> None:
+            report_chunks.append(chunk)
+            f.write(chunk)
+            f.flush()
+            if on_report_chunk is not None:
+                on_report_chunk(chunk)
+        
+        for chunk in stream_llm(prompt.format(objective=state['objective'], results=findings),
+                                results=findings):
+            emit(chunk)
+        emit("\n\n" + _metrics_summary(state))
     
     # Update state
-    state['report'] = response.content
+    state['report'] = "".join(report_chunks)
     state['task_complete'] = True  # Mark audit as complete
+    TaskEventLog.for_audit(state['audit_id']).append("audit_finished", report_path=report_path)
+    TaskEventLog.close_audit(state['audit_id'])
     
     logger.info(f"Security report generated and saved to {report_path}")
     return state
 
 
 # Graph workflow building
-def build_security_audit_workflow():
-    """Build and return the security audit workflow graph."""
+def _instrumented(node: str, node_function: Callable[[SecurityAuditState], SecurityAuditState],
+                  store: Optional[AuditCheckpointStore]) -> Callable[[SecurityAuditState], SecurityAuditState]:
+    """Wrap a node to record its metrics under the audit and checkpoint the state it returns."""
+    def run_node(state: SecurityAuditState) -> SecurityAuditState:
+        token = current_audit_id.set(state.get('audit_id'))
+        started = time.monotonic()
+        try:
+            state = node_function(state)
+        finally:
+            metrics.observe("audit_node_duration_seconds", time.monotonic() - started, node=node)
+            current_audit_id.reset(token)
+        metrics.set_gauge("audit_task_queue_depth", len(state.get('task_index', {})))
+        
+        state['checkpoint_node'] = node
+        if store is not None and state.get('audit_id'):
+            store.save(state['audit_id'], node, state)
+        return state
+    return run_node
+
+
+def route_start(state: SecurityAuditState) -> str:
+    """Start a new audit at initialize_audit, or a resumed one after its last checkpointed node."""
+    checkpoint_node = state.get('checkpoint_node')
+    if not checkpoint_node:
+        return "initialize_audit"
+    if checkpoint_node == "analyze_results":
+        return should_continue(state)
+    return RESUME_NEXT_NODE[checkpoint_node]
+
+
+def build_security_audit_workflow(parallel: bool = False, max_parallel_tasks: int = DEFAULT_MAX_PARALLEL_TASKS,
+                                  tool_concurrency: Optional[Dict[str, int]] = None, batch_analysis: bool = False,
+                                  report_path: str = "security_report.md",
+                                  on_report_chunk: Optional[Callable[[str], None]] = None,
+                                  checkpoint_store: Optional[AuditCheckpointStore] = None):
+    """Build and return the security audit workflow graph.
+    
+    With parallel=True the execute_task node runs a wave of up to max_parallel_tasks
+    independent tasks per step instead of a single one. With batch_analysis=True the
+    analyze_results node makes one LLM call per step for all newly completed tasks.
+    The report is written to report_path and streamed to on_report_chunk.
+    With a checkpoint_store the state is saved after every node, and a state
+    restored from it continues after its last checkpointed node.
+    """
     # Initialize the StateGraph
     workflow = StateGraph(SecurityAuditState)
     
+    if parallel:
+        execute_node = partial(execute_task_wave, max_parallel_tasks=max_parallel_tasks,
+                               tool_concurrency=tool_concurrency)
+    else:
+        execute_node = execute_next_task
+    
     # Add nodes to the graph
-    workflow.add_node("initialize_audit", initialize_audit)
-    workflow.add_node("execute_task", execute_next_task)
-    workflow.add_node("analyze_results", analyze_results)
-    workflow.add_node("generate_report", generate_report)
+    nodes = {
+        "initialize_audit": initialize_audit,
+        "execute_task": execute_node,
+        "analyze_results": partial(analyze_results, batched=batch_analysis),
+        "generate_report": partial(generate_report, report_path=report_path, on_report_chunk=on_report_chunk)
+    }
+    for node, node_function in nodes.items():
+        workflow.add_node(node, _instrumented(node, node_function, checkpoint_store))
     
     # Add edges
-    workflow.add_edge(START, "initialize_audit")
+    workflow.add_conditional_edges(
+        START,
+        route_start,
+        {
+            "initialize_audit": "initialize_audit",
+            "execute_task": "execute_task",
+            "analyze_results": "analyze_results",
+            "generate_report": "generate_report",
+            END: END
+        }
+    )
     workflow.add_edge("initialize_audit", "execute_task")
     workflow.add_edge("execute_task", "analyze_results")
     workflow.add_conditional_edges(
@@ -685,29 +2844,120 @@ def build_security_audit_workflow():
 
 
 # Main function to run the security audit
-def run_security_audit(objective: str, allowed_domains: List[str], allowed_ip_ranges: List[str]) -> str:
-    """Run a security audit with the given objective and scope."""
+def _run_workflow(workflow, state: SecurityAuditState,
+                  on_event: Optional[Callable[[str, SecurityAuditState], None]] = None,
+                  max_steps: int = DEFAULT_MAX_STEPS) -> str:
+    """Stream the workflow from state, reporting every node to on_event, and return the report."""
+    final_state = state
+    try:
+        # remaining_steps is managed by LangGraph and counts down from the recursion limit
+        for update in workflow.stream(state, {"recursion_limit": max_steps}, stream_mode="updates"):
+            for node, node_state in update.items():
+                final_state = node_state
+                if on_event is not None:
+                    on_event(node, node_state)
+    finally:
+        metrics.forget_audit(state['audit_id'])
+    logger.info(f"Scan cache statistics: {scan_cache.stats()}")
+    if llm_cache is not None:
+        logger.info(f"LLM cache statistics: {llm_cache.stats()}")
+    
+    return final_state['report']
+
+
+def run_security_audit(objective: str, allowed_domains: List[str], allowed_ip_ranges: List[str],
+                       parallel: bool = False, max_parallel_tasks: int = DEFAULT_MAX_PARALLEL_TASKS,
+                       tool_concurrency: Optional[Dict[str, int]] = None, force_refresh: bool = False,
+                       batch_analysis: bool = False, report_path: str = "security_report.md",
+                       on_report_chunk: Optional[Callable[[str], None]] = None,
+                       on_event: Optional[Callable[[str, SecurityAuditState], None]] = None,
+                       audit_id: Optional[str] = None, checkpoint: bool = True,
+                       max_steps: int = DEFAULT_MAX_STEPS) -> str:
+    """Run a security audit with the given objective and scope.
+    
+    Set parallel=True to run independent scans concurrently, with at most
+    max_parallel_tasks tasks per wave and tool_concurrency capping each tool.
+    Scan results are reused from the scan cache unless force_refresh is set.
+    batch_analysis=True analyzes each wave of completed tasks with a single LLM call.
+    The report is streamed to report_path and, chunk by chunk, to on_report_chunk.
+    on_event is called with the node name and the audit state after every node.
+    Unless checkpoint is False the state is checkpointed under audit_id (generated
+    when not given) so an interrupted audit can be continued with resume_security_audit.
+    After max_steps workflow steps the audit stops and reports on the tasks completed so far.
+    """
     # Create target scope
-    target_scope = TargetScope(allowed_domains, allowed_ip_ranges)
+    target_scope = TargetScope.register(TargetScope(allowed_domains, allowed_ip_ranges))
+    audit_id = audit_id or uuid.uuid4().hex
+    if checkpoint:
+        logger.info(f"Checkpointing audit {audit_id} to {checkpoint_store.db_path}")
     
     # Initialize state
     init_state = SecurityAuditState(
         objective=objective,
         target_scope=target_scope.to_dict(),
-        task_queue=[],
+        task_queue={},
+        task_delayed=[],
+        task_index={},
+        task_retries={},
+        task_seq=0,
         completed_tasks=[],
         results={},
         report="",
         task_complete=False,
-        remaining_steps=50,  # Set maximum number of steps
-        seen_tasks={}  # Initialize task deduplication tracking
+        remaining_steps=max_steps,  # Set maximum number of steps
+        seen_tasks={},  # Initialize task deduplication tracking
+        analyzed_count=0,
+        force_refresh=force_refresh,
+        report_digests={},
+        wordlist_claims={},
+        audit_id=audit_id,
+        checkpoint_node=""
     )
     
     # Build and run workflow
-    workflow = build_security_audit_workflow()
-    final_state = workflow.invoke(init_state)
+    workflow = build_security_audit_workflow(parallel, max_parallel_tasks, tool_concurrency, batch_analysis,
+                                             report_path, on_report_chunk,
+                                             checkpoint_store if checkpoint else None)
+    try:
+        return _run_workflow(workflow, init_state, on_event, max_steps)
+    finally:
+        # generate_report closes the event log, but a failed or cancelled run never reaches it
+        TaskEventLog.close_audit(audit_id)
+
+
+def resume_security_audit(audit_id: str, parallel: bool = False,
+                          max_parallel_tasks: int = DEFAULT_MAX_PARALLEL_TASKS,
+                          tool_concurrency: Optional[Dict[str, int]] = None, batch_analysis: bool = False,
+                          report_path: str = "security_report.md",
+                          on_report_chunk: Optional[Callable[[str], None]] = None,
+                          on_event: Optional[Callable[[str, SecurityAuditState], None]] = None,
+                          max_steps: int = DEFAULT_MAX_STEPS) -> str:
+    """Continue a checkpointed audit after the last node that completed.
     
-    return final_state['report']
+    Queued tasks whose signatures are already in seen_tasks are dropped, so no
+    completed scan is repeated. An audit that already finished returns its report.
+    """
+    state = checkpoint_store.load(audit_id)
+    if state is None:
+        raise ValueError(f"No checkpoint found for audit {audit_id}")
+    
+    logger.info(f"Resuming audit {audit_id} after {state['checkpoint_node']} "
+                f"with {len(state['completed_tasks'])} completed and {len(state['task_index'])} queued tasks")
+    if state['checkpoint_node'] == "generate_report":
+        return state['report']
+    
+    target_scope = TargetScope.from_dict(state['target_scope'])
+    dropped = TaskScheduler(state, target_scope).drop_seen()
+    if dropped:
+        logger.info(f"Dropped {dropped} queued tasks that were already executed")
+    state['remaining_steps'] = max_steps
+    
+    workflow = build_security_audit_workflow(parallel, max_parallel_tasks, tool_concurrency, batch_analysis,
+                                             report_path, on_report_chunk, checkpoint_store)
+    try:
+        return _run_workflow(workflow, state, on_event, max_steps)
+    finally:
+        TaskEventLog.close_audit(audit_id)
 
 
 # Example usage
@@ -723,7 +2973,10 @@ if __name__ == "__main__":
     Identify open ports, discover hidden directories, and test for common web vulnerabilities 
     including SQL injection. Ensure all tests are non-intrusive and respect the target scope."""
     # objective = "Discover open ports on google.com"
-    # Run the security audit
-    report = run_security_audit(objective, allowed_domains, allowed_ip_ranges)
+    # Run the security audit, or continue an interrupted one with: python main.py --resume <audit_id>
+    if len(sys.argv) == 3 and sys.argv[1] == "--resume":
+        report = resume_security_audit(sys.argv[2])
+    else:
+        report = run_security_audit(objective, allowed_domains, allowed_ip_ranges)
     
     print("Security audit completed. Report generated.")
\ No newline at end of file
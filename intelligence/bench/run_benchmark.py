@@ -0,0 +1,199 @@
+"""Offline benchmark for the security audit pipeline.
+
+Runs complete audits against stub nmap/gobuster/ffuf/sqlmap executables that
+replay the scanner output recorded in this repository, with a deterministic fake
+chat model in place of OpenAI. For each scope size it reports end-to-end audit
+time, workflow steps and tasks per second, peak memory, and how many tasks were
+completed and left queued. An audit that runs out of workflow steps before its
+queue is empty is flagged as truncated, and the benchmark exits with an error.
+
+Every scope runs in a fresh child process inside an empty working directory, so
+caches, checkpoints and logs never carry over between runs:
+
+    python bench/run_benchmark.py --scopes 1,100,10000 --output bench_results.json
+
+Scanner latencies come from BENCH_<TOOL>_LATENCY (seconds per invocation, default
+0.05) and BENCH_<TOOL>_UNIT_LATENCY (seconds per scanned host, nmap only);
+BENCH_LLM_LATENCY adds a delay to every fake LLM reply.
+"""
+import os
+import re
+import sys
+import json
+import time
+import resource
+import argparse
+import ipaddress
+import itertools
+import subprocess
+import tempfile
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+STUBS_DIR = os.path.join(BENCH_DIR, "stubs")
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), "app")
+
+DEFAULT_SCOPES = "1,100,10000"
+BENCH_NETWORK = "10.0.0.0/8"
+# Services whose open ports make the fake analyst ask for web scans
+WEB_SERVICES = ("http", "http-proxy", "https")
+# Workflow step budget: at most four tasks per host (nmap and three web follow-ups),
+# each executed and analyzed in a step of its own even in serial mode, plus the
+# initialization, planning and report steps
+STEPS_PER_HOST = 8
+BASE_STEPS = 10
+
+
+def max_steps(size: int) -> int:
+    """Step budget large enough for a complete audit of size hosts."""
+    return BASE_STEPS + STEPS_PER_HOST * size
+
+
+def scope_hosts(size: int) -> List[str]:
+    """Return the first size host addresses of the benchmark network."""
+    return [str(ip) for ip in itertools.islice(ipaddress.ip_network(BENCH_NETWORK).hosts(), size)]
+
+
+def fake_responder(hosts: List[str], llm_latency: float):
+    """Build a deterministic stand-in for the LLM.
+
+    The initial plan is one nmap scan per host; every nmap result with a web port
+    is followed up with gobuster, ffuf and sqlmap scans; other results get none.
+    """
+    def respond(prompt: str) -> str:
+        if llm_latency:
+            time.sleep(llm_latency)
+
+        if "breaking down security testing objectives" in prompt:
+            return json.dumps([
+                {"task_type": "nmap_scan", "target": host, "description": "Port scan", "priority": 1}
+                for host in hosts
+            ])
+
+        if "recommend follow-up tasks" in prompt:
+            follow_ups = []
+            scans = re.finditer(r"(?:ID: (\S+)\n)?Scan Type: (\S+)\nTarget: (\S+)\nResults: (.*)", prompt)
+            for scan in scans:
+                source, scan_type, target, results = scan.groups()
+                if scan_type != "nmap_scan" or not any(f'"{service}"' in results for service in WEB_SERVICES):
+                    continue
+                for task_type, priority in (("gobuster_scan", 2), ("ffuf_scan", 3), ("sqlmap_scan", 3)):
+                    task = {"task_type": task_type, "target": target, "description": "Web follow-up",
+                            "priority": priority}
+                    if source:
+                        task["source"] = source
+                    follow_ups.append(task)
+            return json.dumps(follow_ups)
+
+        if "security report" in prompt:
+            return "# Security Report\n\nBenchmark run: findings are replayed from recorded scans.\n"
+
+        return "Recorded scan output, no notable findings."
+
+    return respond
+
+
+def run_scope(size: int, parallel: bool, batch_analysis: bool, checkpoint: bool) -> Dict:
+    """Run one audit over size hosts in this process and return its measurements."""
+    sys.path.insert(0, APP_DIR)
+    import main
+    main.logger.setLevel("WARNING")
+
+    hosts = scope_hosts(size)
+    main.llm_pool.configure("fake", fake_responder(hosts, float(os.environ.get("BENCH_LLM_LATENCY", 0))))
+
+    steps = []
+
+    def record(node: str, state: Dict) -> None:
+        steps.append((node, len(state.get('completed_tasks', [])), len(state.get('task_index', {}))))
+
+    baseline_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    main.run_security_audit(
+        f"Benchmark security assessment of {size} hosts.",
+        [],
+        hosts,
+        parallel=parallel,
+        batch_analysis=batch_analysis,
+        checkpoint=checkpoint,
+        max_steps=max_steps(size),
+        on_event=record
+    )
+    elapsed = time.perf_counter() - started
+
+    completed_tasks, queued_tasks = steps[-1][1:] if steps else (0, 0)
+    return {
+        "scope": size,
+        "parallel": parallel,
+        "batch_analysis": batch_analysis,
+        "checkpoint": checkpoint,
+        "seconds": round(elapsed, 3),
+        "steps": len(steps),
+        "steps_per_second": round(len(steps) / elapsed, 2),
+        "max_steps": max_steps(size),
+        "completed_tasks": completed_tasks,
+        "queued_tasks": queued_tasks,
+        # Tasks still queued at the end mean the audit stopped on its step budget
+        "truncated": queued_tasks > 0,
+        "tasks_per_second": round(completed_tasks / elapsed, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "audit_rss_mb": round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss_kb) / 1024, 1)
+    }
+
+
+def run_scope_in_child(size: int, args: argparse.Namespace) -> Dict:
+    """Run one scope in a fresh interpreter inside an empty working directory."""
+    command = [sys.executable, os.path.abspath(__file__), "--child", str(size)]
+    if args.serial:
+        command.append("--serial")
+    if args.batch_analysis:
+        command.append("--batch-analysis")
+    if args.no_checkpoint:
+        command.append("--no-checkpoint")
+
+    env = {**os.environ, "PATH": STUBS_DIR + os.pathsep + os.environ.get("PATH", ""),
+           "LLM_BACKEND": "fake", "LLM_CACHE_BACKEND": "memory"}
+    with tempfile.TemporaryDirectory(prefix="audit_bench_") as work_dir:
+        completed = subprocess.run(command, cwd=work_dir, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Benchmark for scope {size} failed:\n{completed.stderr[-4000:]}")
+    # The audit prints to stdout as well; the measurements are on the last line
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the security audit pipeline offline.")
+    parser.add_argument("--scopes", default=DEFAULT_SCOPES, help="Comma-separated numbers of hosts in scope")
+    parser.add_argument("--serial", action="store_true", help="Run one task per step instead of parallel waves")
+    parser.add_argument("--batch-analysis", action="store_true", help="Analyze each wave with one LLM call")
+    parser.add_argument("--no-checkpoint", action="store_true", help="Do not checkpoint the audit state")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        result = run_scope(args.child, not args.serial, args.batch_analysis, not args.no_checkpoint)
+        print(json.dumps(result))
+        return
+
+    results = []
+    print(f"{'scope':>7} {'seconds':>9} {'steps':>6} {'steps/s':>8} {'tasks':>7} {'queued':>7} {'tasks/s':>8} "
+          f"{'peak MB':>8}")
+    for size in (int(scope) for scope in args.scopes.split(",")):
+        result = run_scope_in_child(size, args)
+        results.append(result)
+        print(f"{result['scope']:>7} {result['seconds']:>9.2f} {result['steps']:>6} {result['steps_per_second']:>8.2f} "
+              f"{result['completed_tasks']:>7} {result['queued_tasks']:>7} {result['tasks_per_second']:>8.2f} "
+              f"{result['peak_rss_mb']:>8.1f}{'  TRUNCATED' if result['truncated'] else ''}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    truncated = [str(result['scope']) for result in results if result['truncated']]
+    if truncated:
+        sys.exit(f"Audits ran out of workflow steps with tasks still queued for scopes: {', '.join(truncated)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""Shared helpers for the benchmark scanner stubs.
+
+The stubs replay the scanner output recorded in the intelligence directory,
+with the recorded target replaced by the requested one, after sleeping for
+BENCH_<TOOL>_LATENCY seconds.
+"""
+import os
+import time
+
+RECORDED_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+RECORDED_TARGET = "192.0.0.2"
+
+
+def simulate_latency(tool: str, units: int = 1) -> None:
+    """Sleep for the configured per-invocation latency plus a per-unit latency."""
+    latency = float(os.environ.get(f"BENCH_{tool.upper()}_LATENCY", 0.05))
+    unit_latency = float(os.environ.get(f"BENCH_{tool.upper()}_UNIT_LATENCY", 0))
+    time.sleep(latency + unit_latency * units)
+
+
+def recorded_text(name: str, target: str = RECORDED_TARGET) -> str:
+    """Return a recorded output file with the recorded target replaced by target."""
+    path = os.path.join(RECORDED_DIR, name)
+    if not os.path.exists(path):
+        return ""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        return f.read().replace(RECORDED_TARGET, target)
+
+
+def option(args: list, flag: str, default: str = None) -> str:
+    """Return the value following flag in args."""
+    if flag in args and args.index(flag) + 1 < len(args):
+        return args[args.index(flag) + 1]
+    return default
+
+
+def host_of(url: str) -> str:
+    """Strip the scheme and path from a URL."""
+    return url.split("://", 1)[-1].split("/", 1)[0]